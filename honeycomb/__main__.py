@@ -12,7 +12,11 @@ Usage:
     honeycomb cleanup
     honeycomb update-data [--static-only] [--sgid-only] [--external-only] [--dont-wait]
     honeycomb loop
-    honeycomb upload <basemap>
+    honeycomb upload <basemap> [--verify-remote] [--plan] [--delete-orphans] [--shard <shard>] [--retry-failed]
+    honeycomb merge-shards <basemap>
+    honeycomb benchmark-order <basemap>
+    honeycomb benchmark-swarm [--latency <seconds>] [--error-rate <rate>] [--engine <engine>]
+    honeycomb reconcile <basemap>
     honeycomb stats
     honeycomb resume
     honeycomb vector <basemap> [--skip-update] [--dont-wait]
@@ -33,6 +37,14 @@ Arguments:
     --static-only           Copy static data from the SHARE to your local machine.
     --sgid-only             Copy vector data from the SGID to your local machine.
     --dont-wait             Don't wait until evening to get updated data from internal.
+    --verify-remote         Compare tiles against the bucket rather than the local upload manifest.
+    --plan                  Show what an upload would change without uploading or modifying any local tiles.
+    --delete-orphans        Delete tiles from the bucket that no longer exist in the cache. Skipped if an earlier upload already removed tiles from the exploded cache.
+    --shard <shard>         Upload only one shard of the rows (e.g. 2/4) so that several machines can upload at once.
+    --retry-failed          Upload only the tiles that failed during the previous upload.
+    --latency <seconds>     The seconds that the fake GCS server adds to each request [default: 0.05].
+    --error-rate <rate>     The share of requests that the fake GCS server fails with a 503 [default: 0].
+    --engine <engine>       The upload engine (async or transfer-manager) [default: async].
 
 Examples:
     honeycomb config init                                       Create a default config file.
@@ -44,6 +56,15 @@ Examples:
     honeycomb update-data --static-only                         Refreshes the data on your computer from the static data on the share only.
     honeycomb loop                                              Kicks off the honeycomb process and loops through all of the base maps.
     honeycomb upload Terrain                                    ETLs and uploads the tiles for the Terrain cache to GCP.
+    honeycomb upload Terrain --verify-remote                    Same as above but checks the bucket for existing tiles rather than the local upload manifest.
+    honeycomb upload Terrain --plan                             Shows the tiles that would be created, updated, skipped or orphaned by an upload.
+    honeycomb upload Terrain --delete-orphans                   Uploads Terrain and deletes tiles from the bucket that are no longer in the cache.
+    honeycomb upload Terrain --shard 2/4                        Uploads the second of four disjoint sets of rows for Terrain.
+    honeycomb upload Terrain --retry-failed                     Retries the tiles that failed during the previous upload of Terrain.
+    honeycomb merge-shards Terrain                              Combines the summaries of all of the shards and busts the discover cache.
+    honeycomb benchmark-order Terrain                           Compares the upload throughput of the sorted and spread upload orders in the test bucket.
+    honeycomb benchmark-swarm --latency 0.1 --error-rate 0.01   Times an upload of a synthetic cache to an in-process fake GCS server.
+    honeycomb reconcile Terrain                                 Rebuilds the local upload manifest for Terrain from a listing of its bucket.
     honeycomb Terrain                                           Builds a single base map and pushes to GCP.
     honeycomb Terrain --skip-update                             Builds a single base map (skipping data update) and pushes to GCP.
     honeycomb Terrain --skip-test --spot C:\\\\test.gdb\\extent Builds a single base map (skipping test and for a specific extent) and pushes to GCP.
@@ -68,7 +89,17 @@ except ImportError:
 
 from docopt import docopt
 
-from . import cleanup, config, stats, update_data, vector
+from . import (
+    aoi,
+    benchmark,
+    cleanup,
+    config,
+    manifest,
+    plan,
+    stats,
+    update_data,
+    vector,
+)
 from .log import logger
 from .messaging import send_email
 from .resumable import (
@@ -78,7 +109,7 @@ from .resumable import (
     start_new_job,
     update_job,
 )
-from .swarm import swarm
+from .swarm import merge_shards, parse_shard, swarm
 from .worker_bee import WorkerBee, explode_cache
 
 
@@ -111,15 +142,42 @@ def main():
         if not spot:
             stats.record_start(basemap, "upload")
 
-        upload(basemap)
+        #: a resumed job picks the upload up where it left off
+        upload(
+            basemap,
+            checkpoint=True,
+            spot_tiles=aoi.get_spot_tiles(spot) if spot else None,
+        )
 
         if not spot:
             stats.record_finish(basemap, "upload")
             finish_job()
 
-    def upload(basemap):
+    def upload(
+        basemap,
+        verify_remote=False,
+        delete_orphans=False,
+        shard=None,
+        retry_failed=False,
+        checkpoint=False,
+        spot_tiles=None,
+    ):
         basemap_info = config.get_basemap(basemap)
-        swarm(basemap, basemap_info["bucket"], basemap_info["imageType"])
+        swarm(
+            basemap,
+            basemap_info["bucket"],
+            basemap_info["imageType"],
+            verify_remote=verify_remote,
+            from_bundles=basemap_info.get("uploadFromBundles", False),
+            delete_orphans=delete_orphans,
+            publish_versions=basemap_info.get("publishVersions", False),
+            upload_engine=basemap_info.get("uploadEngine", "async"),
+            shard=shard,
+            skip_blank_tiles=basemap_info.get("skipBlankTiles", False),
+            retry_failed=retry_failed,
+            checkpoint=checkpoint,
+            spot_tiles=spot_tiles,
+        )
 
     if args["config"]:
         if args["init"]:
@@ -144,8 +202,44 @@ def main():
             args["--external-only"],
             args["--dont-wait"],
         )
+    elif args["upload"] and args["<basemap>"] and args["--plan"]:
+        basemap_info = config.get_basemap(args["<basemap>"])
+        plan.plan(
+            args["<basemap>"],
+            basemap_info["bucket"],
+            basemap_info["imageType"],
+            from_bundles=basemap_info.get("uploadFromBundles", False),
+            publish_versions=basemap_info.get("publishVersions", False),
+        )
     elif args["upload"] and args["<basemap>"]:
-        upload(args["<basemap>"])
+        upload(
+            args["<basemap>"],
+            args["--verify-remote"],
+            args["--delete-orphans"],
+            parse_shard(args["--shard"]) if args["--shard"] else None,
+            args["--retry-failed"],
+        )
+    elif args["merge-shards"] and args["<basemap>"]:
+        merge_shards(args["<basemap>"], config.get_basemap(args["<basemap>"])["bucket"])
+    elif args["benchmark-order"] and args["<basemap>"]:
+        basemap_info = config.get_basemap(args["<basemap>"])
+        benchmark.benchmark_upload_order(
+            args["<basemap>"],
+            basemap_info["bucket"],
+            basemap_info["imageType"],
+            from_bundles=basemap_info.get("uploadFromBundles", False),
+        )
+    elif args["benchmark-swarm"]:
+        benchmark.benchmark_swarm(
+            latency=float(args["--latency"]),
+            error_rate=float(args["--error-rate"]),
+            upload_engine=args["--engine"],
+        )
+    elif args["reconcile"] and args["<basemap>"]:
+        bucket_name = config.get_basemap(args["<basemap>"])["bucket"]
+        logger.info(f"reconciling upload manifest with {bucket_name}")
+        count = manifest.reconcile(bucket_name, f"{args['<basemap>']}/")
+        logger.info(f"{count} tiles recorded in the upload manifest")
     elif args["loop"]:
         stop = False
         basemaps = config.get_config_value("basemaps")
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+aoi.py
+
+A module that contains code for working out which tiles of the cache's tiling scheme are in an area of interest.
+"""
+
+import math
+from os.path import join
+
+import arcpy
+
+from . import settings
+from .log import logger
+
+#: the ArcGIS Online tiling scheme (web mercator with 256 pixel tiles and its origin at the top left)
+WEB_MERCATOR = 3857
+ORIGIN_X = -20037508.342787
+ORIGIN_Y = 20037508.342787
+WORLD_WIDTH = 2 * 20037508.342787
+#: the levels of the statewide and the 18-19 cache extents
+SPOT_LEVELS = range(18)
+SPOT_LEVELS_18_19 = [18, 19]
+#: the number of rows and columns in each bundle of a compact cache
+BUNDLE_DIMENSION = 128
+
+
+def get_tile_span(level):
+    """
+    returns the width of a tile at the level in meters
+    """
+    return WORLD_WIDTH / 2**level
+
+
+def get_tile_range(extent, level):
+    """
+    extent: (xmin, ymin, xmax, ymax) in web mercator
+    returns (min_row, max_row, min_column, max_column) of the tiles at the level that touch the extent
+    """
+    xmin, ymin, xmax, ymax = extent
+    span = get_tile_span(level)
+    last = 2**level - 1
+
+    def clamp(index):
+        return min(max(index, 0), last)
+
+    return (
+        clamp(math.floor((ORIGIN_Y - ymax) / span)),
+        clamp(math.floor((ORIGIN_Y - ymin) / span)),
+        clamp(math.floor((xmin - ORIGIN_X) / span)),
+        clamp(math.floor((xmax - ORIGIN_X) / span)),
+    )
+
+
+class SpotTiles(object):
+    """
+    The tiles that intersect the area of interest of a spot cache.
+
+    The tiles are stored as a range of columns for each row of each level rather than as individual tiles
+    so that large areas don't take much memory. The ranges are taken from the part of the area of interest
+    that is within each row so that the corners of the area's extent are not included.
+    """
+
+    def __init__(self):
+        #: level to row to (min_column, max_column)
+        self.levels = {}
+
+    def add_range(self, level, row, min_column, max_column):
+        rows = self.levels.setdefault(int(level), {})
+        row = int(row)
+        if row in rows:
+            min_column = min(min_column, rows[row][0])
+            max_column = max(max_column, rows[row][1])
+        rows[row] = (min_column, max_column)
+
+    def add_geometry(self, geometry, levels):
+        """
+        geometry: an arcpy polygon in web mercator
+        levels: the levels that the geometry is cached at
+        """
+        for level in levels:
+            span = get_tile_span(level)
+            min_row, max_row, _, _ = get_tile_range(_get_extent(geometry), level)
+            for row in range(min_row, max_row + 1):
+                top = ORIGIN_Y - row * span
+                band = geometry.clip(
+                    arcpy.Extent(ORIGIN_X, top - span, ORIGIN_X + WORLD_WIDTH, top)
+                )
+                if band is None or band.area == 0:
+                    continue
+
+                _, _, min_column, max_column = get_tile_range(_get_extent(band), level)
+                self.add_range(level, row, min_column, max_column)
+
+    def has_level(self, level):
+        return int(level) in self.levels
+
+    def has_row(self, level, row):
+        return int(row) in self.levels.get(int(level), {})
+
+    def contains(self, level, row, column):
+        columns = self.levels.get(int(level), {}).get(int(row))
+
+        return columns is not None and columns[0] <= int(column) <= columns[1]
+
+    def intersects_bundle(self, level, origin_row, origin_column):
+        """
+        returns True if any of the tiles are in the bundle with the top left tile at origin_row, origin_column
+        """
+        rows = self.levels.get(int(level), {})
+        for row in range(origin_row, origin_row + BUNDLE_DIMENSION):
+            columns = rows.get(row)
+            if columns is not None and (
+                columns[0] < origin_column + BUNDLE_DIMENSION
+                and columns[1] >= origin_column
+            ):
+                return True
+
+        return False
+
+    def count(self):
+        return sum(
+            max_column - min_column + 1
+            for rows in self.levels.values()
+            for min_column, max_column in rows.values()
+        )
+
+
+def _get_extent(geometry):
+    extent = geometry.extent
+
+    return extent.XMin, extent.YMin, extent.XMax, extent.YMax
+
+
+def read_geometry(feature_class):
+    """
+    returns the union of all of the polygons in the feature class in web mercator or None if it is empty
+    """
+    geometry = None
+    with arcpy.da.SearchCursor(
+        feature_class,
+        ["SHAPE@"],
+        spatial_reference=arcpy.SpatialReference(WEB_MERCATOR),
+    ) as cursor:
+        for (shape,) in cursor:
+            if shape is None:
+                continue
+            geometry = shape if geometry is None else geometry.union(shape)
+
+    return geometry
+
+
+def intersect_18_19_extent(spot_path):
+    """
+    returns the part of the spot cache polygon that is within the level 18-19 cache extent
+    """
+    return str(
+        arcpy.analysis.Intersect(
+            [spot_path, join(settings.EXTENTSFGDB, settings.EXTENT_18_19)],
+            "in_memory/spot_cache_intersect",
+            join_attributes="ONLY_FID",
+        )
+    )
+
+
+def get_spot_tiles(spot_path):
+    """
+    returns the SpotTiles for a spot cache which covers levels 0-17 for the entire polygon and levels
+    18-19 for the part of it that is within the level 18-19 cache extent (see WorkerBee)
+    """
+    spot_tiles = SpotTiles()
+    geometry = read_geometry(spot_path)
+    if geometry is None:
+        raise ValueError(f"{spot_path} does not contain any polygons")
+    spot_tiles.add_geometry(geometry, SPOT_LEVELS)
+
+    geometry_18_19 = read_geometry(intersect_18_19_extent(spot_path))
+    if geometry_18_19 is not None:
+        spot_tiles.add_geometry(geometry_18_19, SPOT_LEVELS_18_19)
+
+    logger.info(f"{spot_tiles.count()} tiles intersect the spot cache polygon")
+
+    return spot_tiles
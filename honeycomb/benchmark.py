@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+benchmark.py
+
+A module that contains code for comparing the sustained upload throughput of different swarm settings
+against the same set of tiles.
+"""
+
+import asyncio
+import math
+import random
+import time
+from itertools import islice
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from PIL import Image
+from tabulate import tabulate
+
+from . import config, fake_gcs, manifest, settings, swarm
+from .log import logger
+
+#: the prefix under the base map that benchmark tiles are uploaded to
+BENCHMARK_FOLDER = "_benchmark"
+#: the number of tiles that are uploaded for each run
+SAMPLE_SIZE = 10000
+#: the orders are alternated this many times so that neither one always runs on a cold connection pool
+ROUNDS = 2
+#: the base map and bucket names of the synthetic cache that benchmark_swarm uploads
+SYNTHETIC_BASEMAP = "SwarmBenchmark"
+SYNTHETIC_BUCKET = "honeycomb-swarm-benchmark"
+#: the levels of the synthetic cache and the number of tiles in each of them
+SYNTHETIC_LEVELS = [14, 15, 16]
+SYNTHETIC_TILES_PER_LEVEL = 1000
+#: the share of synthetic tiles that are blank which is roughly the share in the statewide caches
+SYNTHETIC_BLANK_RATIO = 0.1
+TILE_SIZE = 256
+
+
+def read_sample(name, from_bundles=False, sample_size=SAMPLE_SIZE):
+    """
+    returns (level, tiles) for the first sample_size tiles in the deepest level of the cache in sorted order
+    the tile bytes are read into memory so that the local tiles are not deleted when they are uploaded
+    """
+    levels = list(
+        swarm.read_levels(swarm.get_level_folders(name, from_bundles), from_bundles)
+    )
+    if len(levels) == 0:
+        raise ValueError(f"there are no tiles in the cache for {name}")
+    level, _, tiles = levels[-1]
+
+    return level, [
+        tile._replace(data=tile.data or tile.file_path.read_bytes())
+        for tile in islice(tiles, sample_size)
+    ]
+
+
+def _delete_prefix(bucket_name, prefix):
+    bucket = config.get_storage_client().bucket(bucket_name)
+    for page in manifest.list_bucket(bucket_name, f"{prefix}/").pages:
+        swarm.delete_blobs(bucket, [blob.name for blob in page])
+
+
+def benchmark_upload_order(
+    name, bucket_name, image_type, from_bundles=False, sample_size=SAMPLE_SIZE
+):
+    """
+    uploads the same sample of tiles to a scratch prefix in the test bucket in each of the upload orders
+    and logs the sustained tiles per second of each run
+    returns a dictionary of upload order to a list of tiles per second for each round
+    """
+    bucket_name += "-test"
+    level, tiles = read_sample(name, from_bundles, sample_size)
+    logger.info(
+        f"benchmarking upload orders with {len(tiles)} tiles from level {level} of {name} in {bucket_name}"
+    )
+
+    results = {upload_order: [] for upload_order in swarm.UPLOAD_ORDERS}
+    for round_number in range(ROUNDS):
+        for upload_order in swarm.UPLOAD_ORDERS:
+            prefix = f"{name}/{BENCHMARK_FOLDER}/{upload_order}{round_number}"
+            start = time.perf_counter()
+            asyncio.run(
+                swarm._upload_levels(
+                    prefix,
+                    bucket_name,
+                    image_type,
+                    [(level, [], iter(tiles))],
+                    diagnostics_enabled=False,
+                    log_all_tiles=False,
+                    verify_remote=False,
+                    delete_orphans=False,
+                    fresh_prefix=True,
+                    upload_order=upload_order,
+                )
+            )
+            results[upload_order].append(
+                swarm._get_rate(len(tiles), time.perf_counter() - start)
+            )
+            _delete_prefix(bucket_name, prefix)
+
+    logger.info(
+        "\n".join(
+            [
+                f"upload order benchmark for {name} ({len(tiles)} tiles)",
+                tabulate(
+                    [
+                        [upload_order, *rates, round(sum(rates) / len(rates), 1)]
+                        for upload_order, rates in results.items()
+                    ],
+                    headers=[
+                        "order",
+                        *[f"round {number + 1}" for number in range(ROUNDS)],
+                        "mean tiles/s",
+                    ],
+                ),
+            ]
+        )
+    )
+
+    return results
+
+
+def generate_exploded_cache(
+    exploded_folder,
+    levels=SYNTHETIC_LEVELS,
+    tiles_per_level=SYNTHETIC_TILES_PER_LEVEL,
+    blank_ratio=SYNTHETIC_BLANK_RATIO,
+    seed=0,
+):
+    """
+    writes an exploded cache of PNG tiles to exploded_folder in the same layout as explode_cache
+    each level is a square block of tiles and all of the tiles are unique noise except for the blank ones
+    returns the number of tiles that were written
+    """
+    generator = random.Random(seed)
+    blank = Image.new("RGBA", (TILE_SIZE, TILE_SIZE), (0, 0, 0, 0))
+    columns = math.ceil(math.sqrt(tiles_per_level))
+    count = 0
+    for level in levels:
+        level_folder = Path(exploded_folder) / "_alllayers" / f"L{level:02}"
+        for index in range(tiles_per_level):
+            row, column = divmod(index, columns)
+            row_folder = level_folder / f"R{row:08x}"
+            row_folder.mkdir(parents=True, exist_ok=True)
+            if generator.random() < blank_ratio:
+                image = blank
+            else:
+                image = Image.merge(
+                    "RGB",
+                    [
+                        Image.effect_noise(
+                            (TILE_SIZE, TILE_SIZE), generator.uniform(16, 64)
+                        )
+                        for _ in range(3)
+                    ],
+                )
+            image.save(row_folder / f"C{column:08x}.png", "PNG")
+            count += 1
+
+    return count
+
+
+def benchmark_swarm(
+    image_type="jpeg",
+    latency=0.0,
+    error_rate=0.0,
+    upload_engine="async",
+    levels=SYNTHETIC_LEVELS,
+    tiles_per_level=SYNTHETIC_TILES_PER_LEVEL,
+):
+    """
+    times swarm.swarm end to end for a synthetic exploded cache that is uploaded to an in-process fake GCS
+    server (see fake_gcs.FakeStorageServer) with latency seconds added to each request and error_rate of
+    the requests failing with a retryable error
+    returns a dictionary of the results which are also logged
+    """
+    with (
+        TemporaryDirectory() as caches_dir,
+        fake_gcs.FakeStorageServer(latency, error_rate, seed=0) as server,
+    ):
+        tile_count = generate_exploded_cache(
+            Path(caches_dir) / f"{SYNTHETIC_BASEMAP}_Exploded", levels, tiles_per_level
+        )
+        logger.info(
+            f"benchmarking swarm with {tile_count} synthetic tiles, {latency}s of latency and a {error_rate} error rate"
+        )
+
+        storage_client = config.storage_client
+        caches_dir_setting = settings.CACHES_DIR
+        config.storage_client = config.create_storage_client(server.endpoint)
+        settings.CACHES_DIR = Path(caches_dir)
+        try:
+            start = time.perf_counter()
+            swarm.swarm(
+                SYNTHETIC_BASEMAP,
+                SYNTHETIC_BUCKET,
+                image_type,
+                #: test uploads are not recorded in the throughput stats
+                is_test=True,
+                #: rebuild the manifest from the empty fake bucket so that every tile is uploaded
+                verify_remote=True,
+                upload_engine=upload_engine,
+                notify=False,
+            )
+            seconds = time.perf_counter() - start
+        finally:
+            config.storage_client = storage_client
+            settings.CACHES_DIR = caches_dir_setting
+
+        bucket_name = f"{SYNTHETIC_BUCKET}-test"
+        uploaded = server.get_objects(bucket_name)
+        #: keep the synthetic tiles out of the upload manifest
+        manifest.delete_tiles(bucket_name, list(uploaded))
+
+    results = {
+        "tiles": tile_count,
+        "uploaded": len(uploaded),
+        "seconds": round(seconds, 1),
+        "tiles_per_second": swarm._get_rate(tile_count, seconds),
+        "requests": sum(server.requests.values()),
+        "injected_errors": server.injected_errors,
+    }
+    logger.info(
+        "\n".join(
+            [
+                f"swarm benchmark ({upload_engine} engine, {image_type})",
+                tabulate(results.items(), headers=["", ""]),
+            ]
+        )
+    )
+
+    return results
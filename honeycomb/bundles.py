@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+bundles.py
+
+A module that contains a reader for ArcGIS compact cache (V2) bundle files.
+This allows swarm to read tiles directly out of the cache rather than exploding it first.
+
+Each bundle holds a 128x128 block of tiles. It starts with a 64 byte header followed by an index of
+8 byte records (one per tile, row-major). The lower 5 bytes of each record are the offset of the tile
+data in the file and the upper 3 bytes are its size. Empty tiles have a size of zero.
+"""
+
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+
+BUNDLE_DIMENSION = 128
+VERSION = 3
+HEADER_SIZE = 64
+RECORD_COUNT = BUNDLE_DIMENSION * BUNDLE_DIMENSION
+RECORD_SIZE = 8
+INDEX_SIZE = RECORD_COUNT * RECORD_SIZE
+OFFSET_MASK = 2**40 - 1
+#: levels that were modified this recently when they were counted are counted again on the next look in case
+#: a bundle was added within the resolution of the file system's modification times
+MTIME_SETTLE_SECONDS = 2
+
+
+def parse_bundle_name(bundle_path):
+    """
+    returns the (row, column) of the top left tile in the bundle from a file name like R0080C0100.bundle
+    """
+    stem = Path(bundle_path).stem
+    column_index = stem.index("C")
+
+    return int(stem[1:column_index], 16), int(stem[column_index + 1 :], 16)
+
+
+def read_bundle(bundle_path, include=None):
+    """
+    yields (row, column, data) for each of the non-empty tiles in the bundle
+    include: a function of (row, column) that returns False for tiles that should be skipped
+    skipped tiles are filtered using the index so that their data is never read from the file
+    """
+    origin_row, origin_column = parse_bundle_name(bundle_path)
+
+    with (
+        open(bundle_path, "rb") as bundle_file,
+        mmap.mmap(bundle_file.fileno(), 0, access=mmap.ACCESS_READ) as bundle,
+    ):
+        if len(bundle) < HEADER_SIZE + INDEX_SIZE:
+            raise ValueError(f"{bundle_path} is too small to be a compact cache bundle")
+
+        version, record_count = struct.unpack_from("<II", bundle, 0)
+        if version != VERSION or record_count != RECORD_COUNT:
+            raise ValueError(f"{bundle_path} is not a compact cache V2 bundle")
+
+        for index, (record,) in enumerate(
+            struct.iter_unpack("<Q", bundle[HEADER_SIZE : HEADER_SIZE + INDEX_SIZE])
+        ):
+            size = record >> 40
+            if size == 0:
+                continue
+
+            row = origin_row + index // BUNDLE_DIMENSION
+            column = origin_column + index % BUNDLE_DIMENSION
+            if include is not None and not include(row, column):
+                continue
+
+            offset = record & OFFSET_MASK
+            yield row, column, bundle[offset : offset + size]
+
+
+def read_level(level_folder):
+    """
+    yields (row, column, data) for each of the non-empty tiles in all of the bundles in a level folder (e.g. L05)
+    """
+    for bundle_path in sorted(Path(level_folder).glob("*.bundle")):
+        yield from read_bundle(bundle_path)
+
+
+def read_tiles(alllayers_folder):
+    """
+    yields (level, row, column, data) for each of the non-empty tiles in a compact cache's _alllayers folder
+    """
+    for level_folder in sorted(Path(alllayers_folder).glob("L*")):
+        level = int(level_folder.name[1:])
+        for row, column, data in read_level(level_folder):
+            yield level, row, column, data
+
+
+class BundleInventory(object):
+    """
+    The number of bundles in each level of a compact cache's _alllayers folder.
+
+    Adding or removing a bundle changes the modification time of its level folder so only the levels whose
+    modification time has changed since they were last counted are scanned again. This keeps the progress
+    checks that run after every extent from walking the entire cache each time.
+    """
+
+    def __init__(self, alllayers_folder):
+        self.alllayers_folder = Path(alllayers_folder)
+        #: level folder name (e.g. L05) to (mtime_ns, count, counted_at)
+        self._levels = {}
+        #: the number of level folders that were scanned by the most recent call to refresh
+        self.scanned_levels = 0
+
+    def refresh(self):
+        """
+        counts the bundles in any new or modified levels
+        returns a dictionary of level folder name to the number of bundles in it
+        """
+        self.scanned_levels = 0
+        if not self.alllayers_folder.exists():
+            self._levels = {}
+
+            return {}
+
+        levels = {}
+        with os.scandir(self.alllayers_folder) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    #: e.g. missing.jpg
+                    continue
+
+                mtime_ns = entry.stat().st_mtime_ns
+                cached = self._levels.get(entry.name)
+                if (
+                    cached is not None
+                    and cached[0] == mtime_ns
+                    and cached[2] - mtime_ns / 1e9 > MTIME_SETTLE_SECONDS
+                ):
+                    levels[entry.name] = cached
+                    continue
+
+                counted_at = time.time()
+                levels[entry.name] = (mtime_ns, _count_bundles(entry.path), counted_at)
+                self.scanned_levels += 1
+        self._levels = levels
+
+        return self.get_level_counts()
+
+    def get_level_counts(self):
+        return {name: count for name, (_, count, _) in sorted(self._levels.items())}
+
+    def count(self):
+        """
+        returns the total number of bundles in the cache
+        """
+        return sum(self.refresh().values())
+
+
+def _count_bundles(level_folder):
+    with os.scandir(level_folder) as entries:
+        return sum(1 for entry in entries if entry.name.endswith(".bundle"))
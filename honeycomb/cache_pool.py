@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+cache_pool.py
+
+A module that contains code for running ManageTileCache for several grid cells of the same cache at once
+in worker processes.
+"""
+
+import os
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing.util import Finalize
+from typing import Any, NamedTuple
+
+import arcpy
+
+from . import aoi, settings, utilities
+
+
+class GridCell(NamedTuple):
+    #: the name of the cell in the logs (e.g. CacheGrids_4_18_19: OBJECTID: 5)
+    name: str
+    #: the key that the cell is recorded under in cache_extents_completed when it is complete
+    job_key: str
+    #: the arcpy polygon of the cell
+    geometry: Any
+    scales: list
+    #: (level, bundle_row, bundle_column) for each of the bundles that the cell writes tiles to
+    bundles: frozenset
+
+
+def get_bundles(extent, levels):
+    """
+    extent: (xmin, ymin, xmax, ymax) in web mercator
+    returns a frozenset of (level, bundle_row, bundle_column) for each of the bundles that have tiles that
+    touch the extent at the levels
+    """
+    bundles = set()
+    for level in levels:
+        min_row, max_row, min_column, max_column = aoi.get_tile_range(extent, level)
+        for bundle_row in range(
+            min_row // aoi.BUNDLE_DIMENSION, max_row // aoi.BUNDLE_DIMENSION + 1
+        ):
+            for bundle_column in range(
+                min_column // aoi.BUNDLE_DIMENSION,
+                max_column // aoi.BUNDLE_DIMENSION + 1,
+            ):
+                bundles.add((level, bundle_row, bundle_column))
+
+    return frozenset(bundles)
+
+
+def get_parallel_processing_factor(processes):
+    """
+    returns the share of the cores that ManageTileCache uses in each of the worker processes
+    settings sets it to 90% which would have every worker trying to use most of the cores at once
+    """
+    return f"{max(90 // processes, 1)}%"
+
+
+def _start_worker(processes):
+    #: each worker opens its own copy of the project so that they don't hold locks on each other's copies
+    utilities.pro_maps = utilities.ProMapCache(f"_{os.getpid()}")
+    #: the copies are named after the process so they are never reused. Worker processes skip atexit hooks
+    #: when they exit but they do run the finalizers with an exit priority.
+    Finalize(None, utilities.pro_maps.remove_copies, exitpriority=10)
+    arcpy.env.parallelProcessingFactor = get_parallel_processing_factor(processes)
+
+
+def _cache_cell(basemap, tiling_scheme, scales, geometry_json):
+    """
+    runs in a worker process
+    returns None if the cell was cached or the geoprocessing messages if it failed
+    """
+    try:
+        arcpy.management.ManageTileCache(
+            str(settings.CACHES_DIR),
+            "RECREATE_EMPTY_TILES",
+            in_cache_name=basemap,
+            in_datasource=utilities.get_pro_map(basemap),
+            tiling_scheme=tiling_scheme,
+            scales=scales,
+            area_of_interest=arcpy.AsShape(geometry_json, True),
+        )
+    except arcpy.ExecuteError:
+        return arcpy.GetMessages()
+
+    return None
+
+
+def cache_cells(basemap, tiling_scheme, cells, processes, on_complete):
+    """
+    runs ManageTileCache for each of the GridCells in a pool of processes worker processes
+
+    The cells all write to the same compact cache so a cell is only started once none of the running cells
+    write to any of its bundles. Otherwise, the cells are started in order.
+
+    on_complete(cell, messages, seconds) is called in this process as each cell finishes. messages is None if
+    the cell was cached or the error messages if it failed. seconds is how long the cell took.
+    """
+    pending = list(cells)
+    running = {}
+    busy_bundles = set()
+    with ProcessPoolExecutor(
+        processes, initializer=_start_worker, initargs=(processes,)
+    ) as pool:
+        while len(pending) > 0 or len(running) > 0:
+            index = 0
+            while len(running) < processes and index < len(pending):
+                cell = pending[index]
+                if not cell.bundles.isdisjoint(busy_bundles):
+                    index += 1
+                    continue
+
+                pending.pop(index)
+                busy_bundles |= cell.bundles
+                future = pool.submit(
+                    _cache_cell, basemap, tiling_scheme, cell.scales, cell.geometry.JSON
+                )
+                running[future] = (cell, time.time())
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                cell, start = running.pop(future)
+                busy_bundles -= cell.bundles
+                try:
+                    messages = future.result()
+                except Exception:
+                    #: e.g. the worker crashed (BrokenProcessPool) or the map was not found in the project. The
+                    #: error is passed on to on_complete so that the cell is recorded rather than ending the run
+                    messages = traceback.format_exc()
+                on_complete(cell, messages, time.time() - start)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+concurrency.py
+
+A module that contains an adaptive limit on the number of in-flight upload requests.
+"""
+
+import asyncio
+import statistics
+from threading import Lock
+
+from .log import logger
+
+#: the share of requests in a window that can hit a retryable error before backing off
+ERROR_RATE_THRESHOLD = 0.02
+#: how much slower than the fastest observed window the median latency can get before backing off
+LATENCY_TOLERANCE = 2.0
+#: multiplicative decrease applied when backing off
+BACKOFF_FACTOR = 0.7
+MINIMUM_WINDOW_SIZE = 20
+
+
+class AdaptiveConcurrency(object):
+    """
+    An additive-increase/multiplicative-decrease (AIMD) limit on the number of in-flight requests.
+
+    The latencies of completed requests and the number of retryable errors are collected in windows.
+    At the end of each window, the limit is cut if too many requests hit retryable errors (e.g. 429/503)
+    or if the median latency has climbed well above the best that has been observed (the link or bucket
+    is saturated). Otherwise, the limit is raised by one.
+    """
+
+    def __init__(self, minimum, maximum, initial):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))
+        self.in_flight = 0
+        self.best_latency = None
+        self._latencies = []
+        self._errors = 0
+        self._errors_lock = Lock()
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self, latency=None):
+        """
+        latency: the duration of the request in seconds or None if no request was made
+        """
+        async with self._condition:
+            self.in_flight -= 1
+            if latency is not None:
+                self._latencies.append(latency)
+                if len(self._latencies) >= max(self.limit, MINIMUM_WINDOW_SIZE):
+                    self._adjust()
+            self._condition.notify_all()
+
+    def record_retryable_error(self, error):
+        """
+        passed as the on_error callback of the upload Retry so it is called from the upload threads
+        """
+        with self._errors_lock:
+            self._errors += 1
+
+    def _adjust(self):
+        with self._errors_lock:
+            errors = self._errors
+            self._errors = 0
+        latency = statistics.median(self._latencies)
+        error_rate = errors / len(self._latencies)
+        self._latencies = []
+
+        if self.best_latency is None or latency < self.best_latency:
+            self.best_latency = latency
+
+        if error_rate > ERROR_RATE_THRESHOLD:
+            new_limit = int(self.limit * BACKOFF_FACTOR)
+            reason = f"retryable error rate: {error_rate:.1%}"
+        elif latency > self.best_latency * LATENCY_TOLERANCE:
+            new_limit = int(self.limit * BACKOFF_FACTOR)
+            reason = f"median latency: {latency:.2f}s (best: {self.best_latency:.2f}s)"
+        else:
+            new_limit = self.limit + 1
+            reason = f"median latency: {latency:.2f}s"
+
+        new_limit = max(self.minimum, min(new_limit, self.maximum))
+        if new_limit != self.limit:
+            logger.info(f"upload concurrency: {self.limit} -> {new_limit} ({reason})")
+            self.limit = new_limit
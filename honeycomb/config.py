@@ -6,10 +6,11 @@ A module that contains logic for reading and writing the config file
 """
 
 from json import dumps, loads
-from os import makedirs
+from os import cpu_count, makedirs
 from os.path import abspath, dirname, exists, join
 
 import requests
+from google.auth.credentials import AnonymousCredentials
 from google.cloud import storage
 from urllib3.util.retry import Retry
 
@@ -24,31 +25,73 @@ except Exception:
 
 storage_client = None
 
+#: the number of in-flight upload requests that swarm starts with and the range that it can adjust within
+default_upload_concurrency = {"initial": 75, "max": 150, "min": 8}
+#: the largest share of a level's tiles in the bucket that can be deleted as orphans
+default_orphan_ratio_threshold = 0.1
+#: the memory cap of the cache of converted tiles that swarm keeps
+default_conversion_cache_megabytes = 256
+#: the order that swarm uploads the tiles in (see swarm.UPLOAD_ORDERS)
+default_upload_order = "sorted"
+#: the storage API endpoint (e.g. http://localhost:4443 for an emulator) or None for GCS
+default_gcs_endpoint = None
+#: leave a core for the upload threads
+conversion_processes = max((cpu_count() or 2) - 1, 1)
+#: the number of worker processes that the transfer manager upload engine uses
+transfer_processes = cpu_count() or 2
+
+
+def create_storage_client(endpoint=None):
+    """
+    returns a storage client with a pooled connection for every in-flight upload
+    if endpoint is set, requests are sent to it without credentials (e.g. to an emulator such as fake_gcs)
+    """
+    if endpoint is None:
+        client = storage.Client(get_config_value("gcpProject"))
+    else:
+        client = storage.Client(
+            get_config_value("gcpProject"),
+            credentials=AnonymousCredentials(),
+            client_options={"api_endpoint": endpoint},
+        )
+    #: allow a connection for every in-flight upload
+    max_connections = get_upload_concurrency()["max"]
+
+    #: 5xx responses are left to the google Retry of each request so that the retryable errors of uploads
+    #: reach the upload concurrency limiter (see AdaptiveConcurrency) rather than being retried here first
+    retry_strategy = Retry(
+        total=5,
+        backoff_factor=1,
+        allowed_methods=[
+            "HEAD",
+            "GET",
+            "PUT",
+            "POST",
+            "DELETE",
+            "OPTIONS",
+            "TRACE",
+        ],
+        raise_on_status=False,
+    )
+
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=max_connections,
+        pool_maxsize=max_connections,
+        max_retries=retry_strategy,
+        pool_block=True,
+    )
+    #: emulators are usually served over http
+    for scheme in ("https://", "http://"):
+        client._http.mount(scheme, adapter)
+        client._http._auth_request.session.mount(scheme, adapter)
 
-pool_threads = 75
+    return client
 
 
 def get_storage_client():
     global storage_client
     if storage_client is None:
-        storage_client = storage.Client(get_config_value("gcpProject"))
-
-        retry_strategy = Retry(
-            total=5,
-            backoff_factor=1,
-            status_forcelist=[500, 502, 503, 504],
-            allowed_methods=["HEAD", "GET", "PUT", "POST", "DELETE", "OPTIONS", "TRACE"],
-            raise_on_status=False,
-        )
-
-        adapter = requests.adapters.HTTPAdapter(
-            pool_connections=pool_threads,
-            pool_maxsize=pool_threads,
-            max_retries=retry_strategy,
-            pool_block=True,
-        )
-        storage_client._http.mount("https://", adapter)
-        storage_client._http._auth_request.session.mount("https://", adapter)
+        storage_client = create_storage_client(get_gcs_endpoint())
 
     return storage_client
 
@@ -58,11 +101,16 @@ def create_default_config():
         data = {
             "basemaps": {},
             "configuration": "dev",
+            "conversionCacheMegabytes": default_conversion_cache_megabytes,
             "gcpProject": "",
+            "gcsEndpoint": default_gcs_endpoint,
             "gizaInstance": "https://discover.agrc.utah.gov",
             "mxdFolder": "C:\\temp",
             "notify": ["ugrc-developers@utah.gov"],
+            "orphanRatioThreshold": default_orphan_ratio_threshold,
             "sendEmails": False,
+            "uploadConcurrency": default_upload_concurrency,
+            "uploadOrder": default_upload_order,
             "vectorBaseMaps": {},
             "vectorTilesFolder": "C:\\temp",
         }
@@ -130,6 +178,48 @@ def get_config_value(key):
     return _get_config()[key]
 
 
+def get_upload_concurrency():
+    """
+    returns the min, max and initial number of in-flight upload requests with defaults for any missing values
+    """
+    try:
+        configured = get_config_value("uploadConcurrency")
+    except KeyError:
+        configured = {}
+
+    return {**default_upload_concurrency, **configured}
+
+
+def get_orphan_ratio_threshold():
+    try:
+        return get_config_value("orphanRatioThreshold")
+    except KeyError:
+        return default_orphan_ratio_threshold
+
+
+def get_conversion_cache_bytes():
+    try:
+        megabytes = get_config_value("conversionCacheMegabytes")
+    except KeyError:
+        megabytes = default_conversion_cache_megabytes
+
+    return int(megabytes * 1024 * 1024)
+
+
+def get_upload_order():
+    try:
+        return get_config_value("uploadOrder")
+    except KeyError:
+        return default_upload_order
+
+
+def get_gcs_endpoint():
+    try:
+        return get_config_value("gcsEndpoint")
+    except KeyError:
+        return default_gcs_endpoint
+
+
 def is_dev():
     return _get_config()["configuration"] == "dev"
 
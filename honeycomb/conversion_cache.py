@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+conversion_cache.py
+
+A module that contains a memory-capped cache of converted tiles keyed by the contents of the source tile.
+"""
+
+from collections import OrderedDict
+from hashlib import blake2b
+
+#: a rough allowance for the key, tuple and dictionary entry of each cached tile
+ENTRY_OVERHEAD = 200
+
+
+class ConversionCache(object):
+    """
+    A least-recently-used cache of encoded tiles.
+
+    Many tiles in a cache are byte-identical (e.g. water, empty desert and repeated patterns) so the result
+    of converting one of them can be reused for the rest rather than decoding and re-encoding each copy.
+    The cache is used from the event loop in the parent process so that it is shared by all of the
+    conversion processes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        #: the conversion time that was skipped because of hits
+        self.seconds_saved = 0.0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def get_key(data):
+        return blake2b(data, digest_size=16).digest()
+
+    def get(self, key):
+        """
+        returns a tuple of (encoded, seconds) or None if the tile is not cached
+        encoded is the encoded tile (see encoding.encode_tile) without timings and seconds is how long it
+        took to encode
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.seconds_saved += entry[1]
+
+        return entry
+
+    def put(self, key, encoded, seconds):
+        """
+        encoded: the encoded tile without timings
+        seconds: how long it took to encode the tile
+        """
+        entry_size = len(encoded[0]) + ENTRY_OVERHEAD
+        if entry_size > self.max_bytes or key in self._entries:
+            return
+
+        self._entries[key] = (encoded, seconds)
+        self.size += entry_size
+        while self.size > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self.size -= len(evicted[0]) + ENTRY_OVERHEAD
+
+    def get_hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0
+
+        return round(self.hits / lookups, 3)
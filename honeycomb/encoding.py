@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+encoding.py
+
+A module that contains the CPU-bound tile conversion code that swarm runs in worker processes.
+It is intentionally kept free of arcpy and the rest of honeycomb so that it is cheap to import.
+"""
+
+import time
+from base64 import b64encode
+from io import BytesIO
+from typing import NamedTuple
+
+from google_crc32c import Checksum
+from PIL import Image
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+#: uniform tiles of these colors are blank (transparent tiles are converted onto white)
+BLANK_COLORS = {(255, 255, 255)}
+#: the number of blank tile checksums that are remembered by each process
+MAX_BLANK_CHECKSUMS = 10000
+
+#: the checksums of tiles that have already been found to be blank in this process
+_blank_checksums = set()
+
+
+class EncodedTile(NamedTuple):
+    data: bytes
+    content_type: str
+    #: formatted to match the crc32c property of GCS blobs
+    checksum: str
+    converted: bool
+    #: operation name to seconds
+    timings: dict
+    blank: bool
+    #: the size of the tile before it was encoded
+    source_size: int
+
+
+def get_checksum(data):
+    #: formatted to match the crc32c property of GCS blobs
+    return b64encode(Checksum(data).digest()).decode("utf-8")
+
+
+def convert_png_to_jpg(data) -> bytes:
+    """
+    This function exists because I was unable to get the ManageTileCache tool in worker_bee.py
+    to generate JPGs. No matter what tile cache scheme file I pointed it at, it stubbornly
+    generated PNGs.
+    """
+    image = Image.open(BytesIO(data))
+    bands = image.split()
+    if len(bands) == 4:
+        new_image = Image.new("RGB", image.size, (255, 255, 255))
+        new_image.paste(image, mask=bands[3])  # 3 is the alpha channel
+    else:
+        #: handle PNGs with no alpha channel (blank white tiles)
+        new_image = image.convert("RGB")
+    output = BytesIO()
+    new_image.save(output, "JPEG", quality=75)
+
+    return output.getvalue()
+
+
+def _flatten(image):
+    """
+    returns an RGB image with any transparent pixels composited onto white
+    """
+    if image.mode == "RGB":
+        return image
+
+    image = image.convert("RGBA")
+    flattened = Image.new("RGB", image.size, (255, 255, 255))
+    flattened.paste(image, mask=image.split()[3])
+
+    return flattened
+
+
+def _save(image, image_format, **options) -> bytes:
+    output = BytesIO()
+    image.save(output, image_format, **options)
+
+    return output.getvalue()
+
+
+def convert_png_to_optimized_jpg(data) -> bytes:
+    """
+    the same as convert_png_to_jpg but with optimized Huffman tables which are smaller for the same quality
+    """
+    return _save(_flatten(Image.open(BytesIO(data))), "JPEG", quality=75, optimize=True)
+
+
+def convert_png_to_webp(data) -> bytes:
+    """
+    lossy WebP keeps the alpha channel and is much smaller than JPEG for imagery and terrain
+    """
+    image = Image.open(BytesIO(data))
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+
+    return _save(image, "WEBP", quality=75, method=4)
+
+
+def convert_png_to_lossless_webp(data) -> bytes:
+    image = Image.open(BytesIO(data))
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+
+    return _save(image, "WEBP", lossless=True, quality=100, method=4)
+
+
+def quantize_png(data) -> bytes:
+    """
+    reduces the tile to an 8-bit palette which suits line work with few colors (e.g. Overlay)
+    """
+    image = Image.open(BytesIO(data)).convert("RGBA")
+    quantized = image.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+
+    return _save(quantized, "PNG", optimize=True)
+
+
+def optimize_png(data) -> bytes:
+    """
+    losslessly recompresses the tile and keeps the original if it is already smaller
+    """
+    optimized = _save(Image.open(BytesIO(data)), "PNG", optimize=True)
+    if len(optimized) >= len(data):
+        return data
+
+    return optimized
+
+
+#: the imageType of a base map to the encoder that PNG tiles are converted with and its content type
+#: PNG tiles are uploaded as they are for any other imageType (e.g. png)
+ENCODERS = {
+    "jpeg": (convert_png_to_jpg, "image/jpeg"),
+    "jpeg-optimized": (convert_png_to_optimized_jpg, "image/jpeg"),
+    "webp": (convert_png_to_webp, "image/webp"),
+    "webp-lossless": (convert_png_to_lossless_webp, "image/webp"),
+    "png8": (quantize_png, "image/png"),
+    "png-optimized": (optimize_png, "image/png"),
+}
+
+
+def get_encoder(image_type):
+    """
+    returns a tuple of (encoder, content_type) for the image type of a base map or None if PNG tiles are
+    uploaded as they are
+    """
+    if not image_type:
+        return None
+
+    return ENCODERS.get(image_type.lower())
+
+
+def is_blank(data):
+    """
+    returns True if the tile is fully transparent or a single color from BLANK_COLORS
+    blank tiles are usually byte-identical so their checksums are remembered to avoid decoding them again
+    """
+    checksum = get_checksum(data)
+    if checksum in _blank_checksums:
+        return True
+
+    image = Image.open(BytesIO(data))
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+    extrema = image.getextrema()
+
+    if image.mode == "RGBA" and extrema[3][1] == 0:
+        blank = True
+    else:
+        blank = (
+            all(low == high for low, high in extrema)
+            and tuple(low for low, _ in extrema[:3]) in BLANK_COLORS
+            and (image.mode == "RGB" or extrema[3][0] == 255)
+        )
+
+    if blank and len(_blank_checksums) < MAX_BLANK_CHECKSUMS:
+        _blank_checksums.add(checksum)
+
+    return blank
+
+
+def encode_tile(file_path, image_type, data=None, detect_blank=False):
+    """
+    file_path: the exploded tile file
+    image_type: the imageType of the base map
+    data: the tile bytes if they have already been read (e.g. from a bundle)
+    detect_blank: check if the tile is blank (see is_blank)
+
+    converts PNG tiles with the encoder for the image type of the base map (see ENCODERS)
+    returns an EncodedTile
+    blank tiles are not converted since they are not uploaded
+    """
+    timings = {}
+    if data is None:
+        start = time.perf_counter()
+        data = file_path.read_bytes()
+        timings["read"] = time.perf_counter() - start
+    source_size = len(data)
+    converted = False
+    blank = False
+    if detect_blank:
+        start = time.perf_counter()
+        blank = is_blank(data)
+        timings["blank"] = time.perf_counter() - start
+    #: set the content type explicitly in case it ever changes for a particular tile
+    #: if you pass none then the content type of the existing blob object is used
+    if data.startswith(PNG_SIGNATURE):
+        encoder = get_encoder(image_type)
+        if encoder is not None and not blank:
+            convert, content_type = encoder
+            start = time.perf_counter()
+            data = convert(data)
+            timings["convert"] = time.perf_counter() - start
+            converted = True
+        else:
+            content_type = "image/png"
+    else:
+        content_type = "image/jpeg"
+
+    start = time.perf_counter()
+    checksum = get_checksum(data)
+    timings["checksum"] = time.perf_counter() - start
+
+    return EncodedTile(
+        data, content_type, checksum, converted, timings, blank, source_size
+    )
+
+
+def measure_tile(file_path, image_type, data=None):
+    """
+    encodes a tile the same way as encode_tile but only returns a tuple of (size, crc32c)
+    so that the encoded bytes don't need to be sent back from the worker process
+    """
+    encoded = encode_tile(file_path, image_type, data)
+
+    return len(encoded.data), encoded.checksum
+
+
+def stage_tile(
+    file_path,
+    image_type,
+    staging_path,
+    data=None,
+    remote_checksum=None,
+    detect_blank=False,
+):
+    """
+    encodes a tile the same way as encode_tile for uploading by file name
+    the encoded bytes are written to staging_path if they are different from the tile file unless they
+    match remote_checksum or the tile is blank in which case the tile will not be uploaded
+    returns a tuple of (upload_path, size, encoded) where encoded is an EncodedTile without the data so
+    that it doesn't need to be sent back from the worker process
+    """
+    encoded = encode_tile(file_path, image_type, data, detect_blank)
+    upload_path = file_path
+    if (
+        (encoded.converted or data is not None)
+        and encoded.checksum != remote_checksum
+        and not encoded.blank
+    ):
+        staging_path.write_bytes(encoded.data)
+        upload_path = staging_path
+
+    return str(upload_path), len(encoded.data), encoded._replace(data=b"")
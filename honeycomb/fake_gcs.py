@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+fake_gcs.py
+
+A module that contains an in-process fake of the parts of the GCS JSON API that honeycomb uses so that
+uploads can be tested and benchmarked without a bucket.
+"""
+
+import json
+import random
+import threading
+import time
+from base64 import b64encode
+from collections import Counter
+from email.parser import BytesParser
+from hashlib import md5
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+from .encoding import get_checksum
+
+#: the largest number of objects that are returned in a single page of a listing
+MAX_PAGE_SIZE = 1000
+
+
+class FakeObject(object):
+    def __init__(self, bucket, name, data, content_type, metadata, generation):
+        self.bucket = bucket
+        self.name = name
+        self.data = data
+        self.content_type = content_type
+        self.cache_control = metadata.get("cacheControl")
+        self.generation = generation
+        self.crc32c = get_checksum(data)
+        self.md5 = b64encode(md5(data).digest()).decode("utf-8")
+
+    def get_resource(self, endpoint):
+        quoted = quote(self.name, safe="")
+        resource = {
+            "kind": "storage#object",
+            "id": f"{self.bucket}/{self.name}/{self.generation}",
+            "bucket": self.bucket,
+            "name": self.name,
+            "generation": str(self.generation),
+            "metageneration": "1",
+            "size": str(len(self.data)),
+            "contentType": self.content_type,
+            "crc32c": self.crc32c,
+            "md5Hash": self.md5,
+            "mediaLink": f"{endpoint}/download/storage/v1/b/{self.bucket}/o/{quoted}?generation={self.generation}&alt=media",
+        }
+        if self.cache_control is not None:
+            resource["cacheControl"] = self.cache_control
+
+        return resource
+
+
+class FakeStorageServer(object):
+    """
+    A threaded HTTP server that stores objects in memory and answers the JSON API requests that the
+    google-cloud-storage client makes for multipart uploads, listings, metadata, downloads, deletes and
+    batches of deletes. Every bucket exists and is empty until it is written to.
+
+    latency: seconds that each request is delayed by to simulate the round trip to GCS
+    error_rate: the share of requests that fail with error_status before they are handled
+    seed: seeds the random number generator for error_rate so that runs are repeatable
+
+    Use it as a context manager and point a client at endpoint (see config.create_storage_client).
+    """
+
+    def __init__(
+        self,
+        latency=0.0,
+        error_rate=0.0,
+        error_status=HTTPStatus.SERVICE_UNAVAILABLE,
+        seed=None,
+        host="127.0.0.1",
+        port=0,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        #: bucket name to object name to FakeObject
+        self.buckets = {}
+        #: operation name to the number of requests that were received
+        self.requests = Counter()
+        self.injected_errors = 0
+        self._random = random.Random(seed)
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _FakeStorageHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self._server.server_address[:2]
+
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def get_objects(self, bucket_name):
+        """
+        returns a dictionary of object name to FakeObject for the bucket
+        """
+        with self._lock:
+            return dict(self.buckets.get(bucket_name, {}))
+
+    def should_fail(self):
+        with self._lock:
+            failed = self.error_rate > 0 and self._random.random() < self.error_rate
+            if failed:
+                self.injected_errors += 1
+
+        return failed
+
+    def put_object(self, bucket_name, name, data, content_type, metadata):
+        with self._lock:
+            self._generation += 1
+            fake_object = FakeObject(
+                bucket_name, name, data, content_type, metadata, self._generation
+            )
+            self.buckets.setdefault(bucket_name, {})[name] = fake_object
+
+        return fake_object
+
+    def get_object(self, bucket_name, name):
+        with self._lock:
+            return self.buckets.get(bucket_name, {}).get(name)
+
+    def delete_object(self, bucket_name, name):
+        with self._lock:
+            return self.buckets.get(bucket_name, {}).pop(name, None) is not None
+
+    def list_objects(self, bucket_name, prefix, delimiter, page_token, max_results):
+        """
+        returns a tuple of (objects, prefixes, next_page_token) for a page of objects in name order
+        """
+        with self._lock:
+            names = sorted(
+                name
+                for name in self.buckets.get(bucket_name, {})
+                if name.startswith(prefix) and name > page_token
+            )
+            objects = []
+            prefixes = set()
+            next_page_token = None
+            for name in names:
+                if delimiter:
+                    index = name.find(delimiter, len(prefix))
+                    if index >= 0:
+                        prefixes.add(name[: index + len(delimiter)])
+                        continue
+                if len(objects) == max_results:
+                    next_page_token = objects[-1].name
+                    break
+                objects.append(self.buckets[bucket_name][name])
+
+        return objects, sorted(prefixes), next_page_token
+
+
+class _FakeStorageHandler(BaseHTTPRequestHandler):
+    #: keep connections alive so that the client's connection pool is exercised the same way as with GCS
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def _handle(self, method):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+
+        if self.fake.should_fail():
+            self._send_json(
+                self.fake.error_status,
+                _error(self.fake.error_status, "injected error"),
+            )
+
+            return
+
+        status, headers, content = self._route(method, url.path, query, body)
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _send_json(self, status, resource):
+        content = json.dumps(resource).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _route(self, method, path, query, body):
+        """
+        returns a tuple of (status, headers, content) for a single request
+        """
+        parts = [unquote(part) for part in path.strip("/").split("/")]
+        if method == "POST" and parts[:3] == ["batch", "storage", "v1"]:
+            self.fake.requests["batch"] += 1
+
+            return self._batch(body)
+
+        if method == "POST" and parts[:4] == ["upload", "storage", "v1", "b"]:
+            self.fake.requests["upload"] += 1
+
+            return self._upload(parts[4], query, body)
+
+        if parts[:1] == ["download"]:
+            parts = parts[1:]
+            query["alt"] = "media"
+
+        if method == "GET" and parts[:3] == ["storage", "v1", "b"] and len(parts) == 4:
+            self.fake.requests["bucket"] += 1
+
+            return _json_response(
+                HTTPStatus.OK,
+                {"kind": "storage#bucket", "id": parts[3], "name": parts[3]},
+            )
+
+        if parts[:3] != ["storage", "v1", "b"] or len(parts) < 5 or parts[4] != "o":
+            return _json_response(
+                HTTPStatus.NOT_FOUND, _error(HTTPStatus.NOT_FOUND, "not found")
+            )
+
+        bucket_name = parts[3]
+        #: the client quotes the slashes in object names but the rest of the path is the name either way
+        name = "/".join(parts[5:])
+        if name == "":
+            self.fake.requests["list"] += 1
+
+            return self._list(bucket_name, query)
+
+        fake_object = self.fake.get_object(bucket_name, name)
+        if method == "DELETE":
+            self.fake.requests["delete"] += 1
+            if not self.fake.delete_object(bucket_name, name):
+                return _json_response(
+                    HTTPStatus.NOT_FOUND, _error(HTTPStatus.NOT_FOUND, "not found")
+                )
+
+            return HTTPStatus.NO_CONTENT, {}, b""
+
+        if fake_object is None:
+            return _json_response(
+                HTTPStatus.NOT_FOUND, _error(HTTPStatus.NOT_FOUND, "not found")
+            )
+
+        if query.get("alt") == "media":
+            self.fake.requests["download"] += 1
+
+            return (
+                HTTPStatus.OK,
+                {
+                    "Content-Type": fake_object.content_type,
+                    "x-goog-hash": f"crc32c={fake_object.crc32c},md5={fake_object.md5}",
+                    "x-goog-generation": str(fake_object.generation),
+                },
+                fake_object.data,
+            )
+
+        self.fake.requests["get"] += 1
+
+        return _json_response(
+            HTTPStatus.OK, fake_object.get_resource(self.fake.endpoint)
+        )
+
+    def _upload(self, bucket_name, query, body):
+        if query.get("uploadType") != "multipart":
+            return _json_response(
+                HTTPStatus.NOT_IMPLEMENTED,
+                _error(
+                    HTTPStatus.NOT_IMPLEMENTED, "only multipart uploads are supported"
+                ),
+            )
+
+        message = _parse_multipart(self.headers["Content-Type"], body)
+        metadata_part, media_part = message.get_payload()
+        metadata = json.loads(metadata_part.get_payload(decode=True))
+        data = media_part.get_payload(decode=True)
+        name = metadata.get("name", query.get("name"))
+        if "crc32c" in metadata and metadata["crc32c"] != get_checksum(data):
+            return _json_response(
+                HTTPStatus.BAD_REQUEST,
+                _error(HTTPStatus.BAD_REQUEST, "the crc32c does not match the data"),
+            )
+
+        fake_object = self.fake.put_object(
+            bucket_name,
+            name,
+            data,
+            metadata.get("contentType", media_part.get_content_type()),
+            metadata,
+        )
+
+        return _json_response(
+            HTTPStatus.OK, fake_object.get_resource(self.fake.endpoint)
+        )
+
+    def _list(self, bucket_name, query):
+        objects, prefixes, next_page_token = self.fake.list_objects(
+            bucket_name,
+            query.get("prefix", ""),
+            query.get("delimiter"),
+            query.get("pageToken", ""),
+            min(int(query.get("maxResults", MAX_PAGE_SIZE)), MAX_PAGE_SIZE),
+        )
+        resource = {
+            "kind": "storage#objects",
+            "items": [
+                fake_object.get_resource(self.fake.endpoint) for fake_object in objects
+            ],
+        }
+        if prefixes:
+            resource["prefixes"] = prefixes
+        if next_page_token is not None:
+            resource["nextPageToken"] = next_page_token
+
+        return _json_response(HTTPStatus.OK, resource)
+
+    def _batch(self, body):
+        """
+        answers each of the requests in a batch (only deletes and gets are supported)
+        """
+        boundary = "batch_boundary"
+        parts = []
+        message = _parse_multipart(self.headers["Content-Type"], body)
+        for subrequest in message.get_payload():
+            request_line = subrequest.get_payload(decode=True).decode("utf-8")
+            method, uri, _ = request_line.split("\r\n", 1)[0].split(" ", 2)
+            url = urlsplit(uri)
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            status, _, content = self._route(method, url.path, query, b"")
+            status = HTTPStatus(status)
+            parts.append(
+                "\r\n".join(
+                    [
+                        f"--{boundary}",
+                        "Content-Type: application/http",
+                        f"Content-ID: <response-{subrequest['Content-ID'] or len(parts)}>",
+                        "",
+                        f"HTTP/1.1 {status.value} {status.phrase}",
+                        "Content-Type: application/json",
+                        f"Content-Length: {len(content)}",
+                        "",
+                        content.decode("utf-8"),
+                    ]
+                )
+            )
+        parts.append(f"--{boundary}--")
+
+        return (
+            HTTPStatus.OK,
+            {"Content-Type": f"multipart/mixed; boundary={boundary}"},
+            "\r\n".join(parts).encode("utf-8"),
+        )
+
+
+def _parse_multipart(content_type, body):
+    return BytesParser().parsebytes(
+        b"Content-Type: " + content_type.encode("utf-8") + b"\r\n\r\n" + body
+    )
+
+
+def _error(status, message):
+    return {"error": {"code": int(status), "message": message}}
+
+
+def _json_response(status, resource):
+    return (
+        status,
+        {"Content-Type": "application/json"},
+        json.dumps(resource).encode("utf-8"),
+    )
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+history.py
+
+A module that contains a record of how long each area of interest took to cache in past jobs and a model
+that uses it to order the grid cells and estimate how long a job has left.
+"""
+
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import NamedTuple
+
+from . import config
+
+
+class PlannedAoi(NamedTuple):
+    #: the name of the area of interest in the logs (e.g. CacheGrids_4_18_19: OBJECTID: 5)
+    name: str
+    #: the key that the area of interest is recorded under in cache_extents_completed when it is complete
+    job_key: str
+    levels: tuple
+    #: the number of bundles that the area of interest writes tiles to or None if it is not known
+    bundles: int | None
+    #: the number of areas of interest at the same levels that are cached at once
+    processes: int = 1
+
+
+def get_label(levels):
+    if len(levels) == 1:
+        return f"Level {levels[0]}"
+
+    return f"Levels {levels[0]}-{levels[-1]}"
+
+
+class CacheHistory(object):
+    """
+    An append-only JSON lines file with one record for each area of interest that was cached.
+
+    Records are kept across jobs so that the next job can use them to estimate how long each area of
+    interest will take. The same grid cell is cached at more than one level so records are looked up by name and
+    levels. The most recent record for each name and levels wins.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def record(self, name, levels, seconds, bundles):
+        line = json.dumps(
+            {
+                "name": name,
+                "levels": list(levels),
+                "seconds": round(seconds, 3),
+                "bundles": bundles,
+                "time": datetime.now().isoformat(),
+            }
+        )
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a", encoding="utf-8") as history_file:
+            history_file.write(line + "\n")
+
+    def read(self):
+        """
+        returns a list of the records in the history
+        """
+        if not self.path.exists():
+            return []
+
+        with self.path.open(encoding="utf-8") as history_file:
+            return [json.loads(line) for line in history_file if line.strip()]
+
+    def get_durations(self):
+        """
+        returns a dictionary of (name, levels) to the seconds that the area of interest took the last time it
+        was cached at those levels
+        """
+        return {
+            (record["name"], tuple(record["levels"])): record["seconds"]
+            for record in self.read()
+        }
+
+    def get_level_rates(self):
+        """
+        returns a dictionary of level to the mean seconds per bundle of the single level records that have a
+        bundle count
+        """
+        totals = {}
+        for record in self.read():
+            if len(record["levels"]) != 1 or not record["bundles"]:
+                continue
+
+            seconds, bundles = totals.get(record["levels"][0], (0, 0))
+            totals[record["levels"][0]] = (
+                seconds + record["seconds"],
+                bundles + record["bundles"],
+            )
+
+        return {
+            level: seconds / bundles for level, (seconds, bundles) in totals.items()
+        }
+
+
+def get_cache_history(basemap):
+    name = basemap.replace("/", "_")
+
+    return CacheHistory(Path(config.config_folder) / "cache_history" / f"{name}.jsonl")
+
+
+class EtaModel(object):
+    """
+    Estimates how long areas of interest take to cache.
+
+    An area of interest is expected to take as long as it did the last time that it was cached. Otherwise,
+    it is expected to take the mean seconds per bundle of its level in past jobs times the number of bundles
+    that it writes to. Otherwise, it is expected to take the mean of the areas of interest at the same
+    levels that have been cached in this job.
+    """
+
+    def __init__(self, history):
+        self.durations = history.get_durations()
+        self.level_rates = history.get_level_rates()
+        #: levels to the seconds that each area of interest at those levels took in this job
+        self.job_durations = {}
+
+    def add(self, planned, seconds):
+        self.job_durations.setdefault(planned.levels, []).append(seconds)
+
+    def estimate(self, planned):
+        """
+        returns the estimated seconds that the area of interest takes to cache or None if it is not known
+        """
+        key = (planned.name, tuple(planned.levels))
+        if key in self.durations:
+            return self.durations[key]
+
+        if (
+            len(planned.levels) == 1
+            and planned.bundles
+            and planned.levels[0] in self.level_rates
+        ):
+            return self.level_rates[planned.levels[0]] * planned.bundles
+
+        job_durations = self.job_durations.get(planned.levels)
+        if job_durations:
+            return sum(job_durations) / len(job_durations)
+
+        return None
+
+    def get_remaining(self, pending):
+        """
+        pending: the PlannedAois that are not cached yet
+        returns a list of (label, areas, seconds) for each group of levels in the order that they are cached
+        seconds is None if any of the areas of interest at those levels can't be estimated
+        """
+        groups = {}
+        for planned in pending:
+            groups.setdefault(planned.levels, []).append(planned)
+
+        remaining = []
+        for levels, group in sorted(groups.items()):
+            estimates = [self.estimate(planned) for planned in group]
+            if None in estimates:
+                seconds = None
+            else:
+                #: the areas are spread across the processes so the level takes as long as its share of one
+                seconds = sum(estimates) / max(group[0].processes, 1)
+            remaining.append((get_label(levels), len(group), seconds))
+
+        return remaining
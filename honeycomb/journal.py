@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+journal.py
+
+A module that contains an on-disk journal of the tiles that failed to upload so that they can be retried
+without walking the rest of the cache.
+"""
+
+import json
+import threading
+from datetime import datetime
+from pathlib import Path
+
+#: the longest error message that is kept for each tile
+MAX_MESSAGE_LENGTH = 500
+
+
+class FailedTileJournal(object):
+    """
+    An append-only JSON lines file with one record for each tile that failed to convert or upload.
+
+    Records are written as soon as a tile fails so that the journal survives a crash. Tiles are uploaded
+    from several threads so writes are serialized with a lock.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def record(self, prefix, tile, stage, error):
+        """
+        prefix: the prefix in the bucket that the tile was being uploaded to
+        tile: the swarm.Tile that failed
+        stage: convert or upload
+        error: the exception that was raised
+        """
+        line = json.dumps(
+            {
+                "prefix": prefix,
+                "level": tile.level,
+                "row": tile.row,
+                "column": tile.column,
+                "file_path": str(tile.file_path),
+                "from_bundle": tile.data is not None,
+                "stage": stage,
+                "error": type(error).__name__,
+                "message": str(error)[:MAX_MESSAGE_LENGTH],
+                "time": datetime.now().isoformat(),
+            }
+        )
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as journal_file:
+                journal_file.write(line + "\n")
+
+    def read(self):
+        """
+        returns a list of the records in the journal
+        """
+        if not self.path.exists():
+            return []
+
+        with self.path.open(encoding="utf-8") as journal_file:
+            return [json.loads(line) for line in journal_file if line.strip()]
+
+    def clear(self):
+        with self._lock:
+            self.path.unlink(missing_ok=True)
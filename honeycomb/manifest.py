@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+manifest.py
+
+A module that contains a persistent local record of the tiles that have been uploaded to GCP.
+This allows swarm to decide whether a tile has changed without asking GCP about every blob.
+"""
+
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from threading import Lock
+
+from . import config
+
+manifest_location = Path(config.config_folder) / "upload_manifest.sqlite"
+
+#: sqlite only allows a single writer at a time and the upload threads all write to the manifest
+write_lock = Lock()
+
+
+def _connect():
+    connection = sqlite3.connect(manifest_location, timeout=60)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tiles (
+            bucket TEXT NOT NULL,
+            name TEXT NOT NULL,
+            crc32c TEXT NOT NULL,
+            size INTEGER,
+            generation INTEGER,
+            PRIMARY KEY (bucket, name)
+        ) WITHOUT ROWID
+        """
+    )
+
+    return connection
+
+
+def _prefix_range(prefix):
+    #: a range query on the primary key is much faster than LIKE
+    return prefix, prefix + "\uffff"
+
+
+def get_tiles(bucket_name, prefix):
+    """
+    returns a dictionary of blob name to crc32c for all of the recorded tiles that start with prefix
+    """
+    with closing(_connect()) as connection:
+        rows = connection.execute(
+            "SELECT name, crc32c FROM tiles WHERE bucket = ? AND name >= ? AND name < ?",
+            (bucket_name, *_prefix_range(prefix)),
+        )
+
+        return dict(rows)
+
+
+def record_tiles(bucket_name, tiles):
+    """
+    tiles: iterable of (name, crc32c, size, generation) tuples
+
+    records tiles that have just been uploaded
+    """
+    with write_lock, closing(_connect()) as connection, connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO tiles (bucket, name, crc32c, size, generation) VALUES (?, ?, ?, ?, ?)",
+            ((bucket_name, *tile) for tile in tiles),
+        )
+
+
+def delete_tiles(bucket_name, blob_names):
+    """
+    removes tiles that have been deleted from the bucket
+    """
+    with write_lock, closing(_connect()) as connection, connection:
+        connection.executemany(
+            "DELETE FROM tiles WHERE bucket = ? AND name = ?",
+            ((bucket_name, blob_name) for blob_name in blob_names),
+        )
+
+
+def list_bucket(bucket_name, prefix):
+    """
+    returns an iterator of all of the blobs that start with prefix in a single paged listing
+    only the name, crc32c, size and generation properties are populated
+    """
+    return config.get_storage_client().list_blobs(
+        bucket_name,
+        prefix=prefix,
+        fields="items(name,crc32c,size,generation),nextPageToken",
+    )
+
+
+def reconcile(bucket_name, prefix):
+    """
+    rebuilds the manifest for all tiles that start with prefix from a listing of the bucket
+    returns the number of tiles that were recorded
+    """
+    blobs = list_bucket(bucket_name, prefix)
+
+    with write_lock, closing(_connect()) as connection, connection:
+        connection.execute(
+            "DELETE FROM tiles WHERE bucket = ? AND name >= ? AND name < ?",
+            (bucket_name, *_prefix_range(prefix)),
+        )
+        cursor = connection.executemany(
+            "INSERT INTO tiles (bucket, name, crc32c, size, generation) VALUES (?, ?, ?, ?, ?)",
+            (
+                (bucket_name, blob.name, blob.crc32c, blob.size, blob.generation)
+                for blob in blobs
+            ),
+        )
+
+        return cursor.rowcount
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+metrics.py
+
+A module that contains a low-overhead histogram for collecting upload timings.
+"""
+
+import math
+
+#: the smallest duration that is tracked (0.1 ms)
+MINIMUM_SECONDS = 0.0001
+#: each bucket is 10% wider than the previous which keeps percentiles within 10% of the true value
+GROWTH = 1.1
+
+
+class Histogram(object):
+    """
+    A histogram of durations using logarithmic buckets.
+
+    Recording a value is a single dictionary increment so it is cheap enough to do for every tile and
+    the memory used is bounded by the range of the values rather than the number of values.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def record(self, seconds):
+        if seconds <= MINIMUM_SECONDS:
+            index = 0
+        else:
+            index = int(math.log(seconds / MINIMUM_SECONDS, GROWTH)) + 1
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def percentile(self, percent):
+        """
+        returns the upper bound of the bucket that contains the percentile in seconds
+        """
+        if self.count == 0:
+            return 0
+
+        target = math.ceil(self.count * percent / 100)
+        cumulative = 0
+        for index in sorted(self.buckets):
+            cumulative += self.buckets[index]
+            if cumulative >= target:
+                return min(MINIMUM_SECONDS * GROWTH**index, self.maximum)
+
+        return self.maximum
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total_seconds": round(self.total, 3),
+            "p50_ms": round(self.percentile(50) * 1000, 1),
+            "p90_ms": round(self.percentile(90) * 1000, 1),
+            "p99_ms": round(self.percentile(99) * 1000, 1),
+            "max_ms": round(self.maximum * 1000, 1),
+        }
+
+    def __str__(self):
+        if self.count == 0:
+            return "n/a"
+
+        return "p50 {p50_ms}ms, p90 {p90_ms}ms, p99 {p99_ms}ms (n={count})".format(
+            **self.to_dict()
+        )
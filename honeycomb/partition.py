@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+partition.py
+
+A module that contains code for merging and splitting the cells of the level 18-19 cache grids so that each
+ManageTileCache call does a similar amount of work.
+"""
+
+import math
+from collections import Counter
+from typing import NamedTuple
+
+import arcpy
+
+from . import resumable, settings, utilities
+from .log import logger
+
+#: cells are split once their cost is this many times the target cost
+SPLIT_RATIO = 2
+#: the most parts that a dense cell is split into along each side
+MAX_SPLITS = 4
+#: the most cells along each side of a block of merged sparse cells
+MAX_MERGE = 4
+
+
+class Cell(NamedTuple):
+    oid: int
+    #: (xmin, ymin, xmax, ymax)
+    extent: tuple
+    #: the relative amount of work that it takes to cache the cell (e.g. the number of features in it)
+    cost: float
+
+
+class PartitionAoi(NamedTuple):
+    #: the OBJECTIDs of the grid cells that the area of interest covers
+    oids: tuple
+    #: the position of the area of interest in a split cell in row-major order
+    part: int
+    #: the number of parts that the cell was split into (a square number) or 1 if it was not split
+    parts: int
+    cost: float
+
+
+def _get_grid_indexes(cells):
+    """
+    returns a dictionary of oid to (row, column) for cells that are laid out on a regular grid
+    cells that are clipped (e.g. by the state boundary) are given the index of the full cell that they are in
+    """
+    width = max(cell.extent[2] - cell.extent[0] for cell in cells)
+    height = max(cell.extent[3] - cell.extent[1] for cell in cells)
+    tolerance = 1e-6
+    origin_x = min(
+        cell.extent[0]
+        for cell in cells
+        if cell.extent[2] - cell.extent[0] >= width * (1 - tolerance)
+    )
+    origin_y = max(
+        cell.extent[3]
+        for cell in cells
+        if cell.extent[3] - cell.extent[1] >= height * (1 - tolerance)
+    )
+
+    return {
+        cell.oid: (
+            math.floor((origin_y - cell.extent[3]) / height + tolerance),
+            math.floor((cell.extent[0] - origin_x) / width + tolerance),
+        )
+        for cell in cells
+    }
+
+
+def _grow_block(row, column, by_index, available, target_cost):
+    """
+    returns the cells in the largest rectangle of available neighboring cells with the cell at row, column
+    in its top left corner that stays within target_cost and MAX_MERGE
+    """
+    rows, columns = 1, 1
+    cost = by_index[(row, column)].cost
+    grew = True
+    while grew:
+        grew = False
+        for add_column in (True, False):
+            if add_column:
+                if columns == MAX_MERGE:
+                    continue
+                indexes = [(row + offset, column + columns) for offset in range(rows)]
+            else:
+                if rows == MAX_MERGE:
+                    continue
+                indexes = [(row + rows, column + offset) for offset in range(columns)]
+
+            if not all(index in available for index in indexes):
+                continue
+
+            added_cost = sum(by_index[index].cost for index in indexes)
+            if cost + added_cost > target_cost:
+                continue
+
+            cost += added_cost
+            if add_column:
+                columns += 1
+            else:
+                rows += 1
+            grew = True
+
+    return [
+        by_index[(row + row_offset, column + column_offset)]
+        for row_offset in range(rows)
+        for column_offset in range(columns)
+    ]
+
+
+def partition_cells(cells, target_cost=None):
+    """
+    returns a list of PartitionAoi that cover all of the cells
+
+    Blocks of neighboring cells whose combined cost is within target_cost are merged into a single area of
+    interest and cells that cost more than SPLIT_RATIO times target_cost are split into a square of parts.
+    target_cost defaults to the mean cost of the cells. If none of the cells have a cost, they are left as
+    they are.
+    """
+    if len(cells) == 0:
+        return []
+
+    if target_cost is None:
+        target_cost = sum(cell.cost for cell in cells) / len(cells)
+    if target_cost <= 0:
+        return [
+            PartitionAoi((cell.oid,), 0, 1, cell.cost)
+            for cell in sorted(cells, key=lambda cell: cell.oid)
+        ]
+
+    indexes = _get_grid_indexes(cells)
+    by_index = {}
+    for cell in sorted(cells, key=lambda cell: cell.oid):
+        #: a clipped cell that shares an index with another cell is never merged
+        by_index.setdefault(indexes[cell.oid], cell)
+    available = {
+        index
+        for index, cell in by_index.items()
+        if cell.cost <= target_cost * SPLIT_RATIO
+    }
+
+    aois = []
+    for cell in sorted(cells, key=lambda cell: (indexes[cell.oid], cell.oid)):
+        index = indexes[cell.oid]
+        if cell.cost > target_cost * SPLIT_RATIO:
+            splits = min(math.ceil(math.sqrt(cell.cost / target_cost)), MAX_SPLITS)
+            parts = splits * splits
+            aois.extend(
+                PartitionAoi((cell.oid,), part, parts, cell.cost / parts)
+                for part in range(parts)
+            )
+        elif by_index[index] is not cell:
+            aois.append(PartitionAoi((cell.oid,), 0, 1, cell.cost))
+        elif index in available:
+            block = _grow_block(*index, by_index, available, target_cost)
+            for block_cell in block:
+                available.discard(indexes[block_cell.oid])
+            aois.append(
+                PartitionAoi(
+                    tuple(sorted(block_cell.oid for block_cell in block)),
+                    0,
+                    1,
+                    sum(block_cell.cost for block_cell in block),
+                )
+            )
+
+    return aois
+
+
+def get_aoi_name(grid, aoi):
+    """
+    cells that are not merged or split keep the same name as when the grid is not partitioned
+    """
+    if aoi.parts > 1:
+        return f"{grid}: OBJECTID: {aoi.oids[0]} ({aoi.part + 1} of {aoi.parts})"
+    if len(aoi.oids) > 1:
+        return f"{grid}: OBJECTIDS: {', '.join(str(oid) for oid in aoi.oids)}"
+
+    return f"{grid}: OBJECTID: {aoi.oids[0]}"
+
+
+def build_geometry(aoi, shapes):
+    """
+    shapes: a dictionary of oid to the polygon of each grid cell
+    returns the polygon of the area of interest
+    """
+    if aoi.parts == 1:
+        geometry = shapes[aoi.oids[0]]
+        for oid in aoi.oids[1:]:
+            geometry = geometry.union(shapes[oid])
+
+        return geometry
+
+    shape = shapes[aoi.oids[0]]
+    splits = math.isqrt(aoi.parts)
+    row, column = divmod(aoi.part, splits)
+    extent = shape.extent
+    width = (extent.XMax - extent.XMin) / splits
+    height = (extent.YMax - extent.YMin) / splits
+
+    return shape.clip(
+        arcpy.Extent(
+            extent.XMin + column * width,
+            extent.YMax - (row + 1) * height,
+            extent.XMin + (column + 1) * width,
+            extent.YMax - row * height,
+        )
+    )
+
+
+def _is_visible(layer, scale):
+    #: a threshold of zero means that there is no limit
+    return (layer.minThreshold == 0 or scale <= layer.minThreshold) and (
+        layer.maxThreshold == 0 or scale >= layer.maxThreshold
+    )
+
+
+def get_feature_counts(basemap, grid, scale):
+    """
+    returns a Counter of grid cell oid to the number of features in the visible layers of the base map's map
+    that intersect the cell at the scale
+    """
+    counts = Counter()
+    pro_map = utilities.get_pro_map(basemap)
+    for layer in pro_map.listLayers():
+        if (
+            not layer.isFeatureLayer
+            or not layer.visible
+            or not _is_visible(layer, scale)
+        ):
+            continue
+
+        joined = arcpy.analysis.SpatialJoin(
+            grid,
+            layer,
+            "memory/partition_counts",
+            "JOIN_ONE_TO_ONE",
+            "KEEP_ALL",
+            match_option="INTERSECT",
+        )
+        with arcpy.da.SearchCursor(joined, ["TARGET_FID", "Join_Count"]) as cursor:
+            for oid, count in cursor:
+                counts[oid] += count
+        arcpy.management.Delete(joined)
+
+    return counts
+
+
+def get_grid_aois(basemap, grid, scale):
+    """
+    returns a list of (name, geometry) for the areas of interest that the grid is cached in at the scale
+
+    The cells are partitioned by the number of features in each of them (see partition_cells). The
+    partition is recorded in the current job so that a resumed job caches the same areas of interest.
+    """
+    shapes = {}
+    with arcpy.da.SearchCursor(grid, ["SHAPE@", "OID@"]) as cursor:
+        for shape, oid in cursor:
+            shapes[oid] = shape
+
+    key = f"{grid}-{scale}"
+    recorded = resumable.get_grid_partition(key)
+    if recorded is not None:
+        aois = [
+            PartitionAoi(tuple(oids), part, parts, cost)
+            for oids, part, parts, cost in recorded
+        ]
+    else:
+        counts = get_feature_counts(basemap, grid, scale)
+        cells = [
+            Cell(
+                oid,
+                (
+                    shape.extent.XMin,
+                    shape.extent.YMin,
+                    shape.extent.XMax,
+                    shape.extent.YMax,
+                ),
+                counts[oid],
+            )
+            for oid, shape in shapes.items()
+        ]
+        aois = partition_cells(cells)
+        resumable.save_grid_partition(key, [list(aoi) for aoi in aois])
+        logger.info(
+            f"partitioned the {len(cells)} cells of {grid} into {len(aois)} areas of interest at level {settings.SCALES.index(scale)}"
+        )
+
+    grid_aois = []
+    for aoi in aois:
+        geometry = build_geometry(aoi, shapes)
+        #: parts of clipped cells can be empty
+        if geometry is None or geometry.area == 0:
+            continue
+        grid_aois.append((get_aoi_name(grid, aoi), geometry))
+
+    return grid_aois
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+plan.py
+
+A module that contains code for previewing the changes that an upload would make to a bucket
+without uploading anything or modifying the local tiles.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import humanize
+from tabulate import tabulate
+
+from . import config, encoding, manifest, stats, swarm
+from .log import logger
+
+ACTIONS = ["create", "update", "skip", "orphan"]
+#: the number of tiles that are encoded at a time to keep memory bounded
+BATCH_SIZE = 1000
+
+
+def _empty_level_plan():
+    plan = {}
+    for action in ACTIONS:
+        plan[action] = 0
+        plan[f"{action}_bytes"] = 0
+
+    return plan
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def get_prefix(name, bucket_name, publish_versions=False):
+    """
+    returns the prefix in the bucket that the local tiles are compared with
+    base maps that publish versions are compared with the published version (see swarm.publish_version)
+    """
+    if not publish_versions:
+        return name
+
+    bucket = config.get_storage_client().bucket(bucket_name)
+    version = swarm.get_published_version(bucket, name)
+    if version is None:
+        return name
+
+    return swarm.get_version_prefix(name, version)
+
+
+def plan_level(prefix, bucket_name, image_type, level, tiles, process_pool):
+    """
+    compares the local tiles for a level with a single listing of the prefix in the bucket
+    returns a dictionary of counts and bytes for each action
+    """
+    level_plan = _empty_level_plan()
+    remote_tiles = {
+        blob.name: (blob.crc32c, blob.size)
+        for blob in manifest.list_bucket(bucket_name, f"{prefix}/{level}/")
+    }
+
+    for batch in _batches(tiles, BATCH_SIZE):
+        measurements = process_pool.map(
+            encoding.measure_tile,
+            [tile.file_path for tile in batch],
+            [image_type] * len(batch),
+            [tile.data for tile in batch],
+            chunksize=50,
+        )
+        for tile, (size, checksum) in zip(batch, measurements):
+            remote_tile = remote_tiles.pop(swarm.get_blob_name(prefix, tile), None)
+            if remote_tile is None:
+                action = "create"
+            elif remote_tile[0] != checksum:
+                action = "update"
+            else:
+                action = "skip"
+            level_plan[action] += 1
+            level_plan[f"{action}_bytes"] += size
+
+    #: anything left in the bucket doesn't exist locally
+    level_plan["orphan"] = len(remote_tiles)
+    level_plan["orphan_bytes"] = sum(size or 0 for _, size in remote_tiles.values())
+
+    return level_plan
+
+
+def estimate_seconds(basemap, tiles, bytes_to_upload):
+    """
+    estimates how long it will take to upload based on the throughput of previous uploads
+    returns None if there is no history for the base map
+    """
+    throughput = stats.get_upload_throughput(basemap)
+    if throughput is None:
+        return None
+
+    tiles_per_second, bytes_per_second = throughput
+    if tiles_per_second == 0 or bytes_per_second == 0:
+        #: e.g. the recorded uploads only skipped tiles
+        return None
+
+    #: small tiles are limited by requests per second and large tiles by bandwidth
+    return max(tiles / tiles_per_second, bytes_to_upload / bytes_per_second)
+
+
+def plan(name, bucket_name, image_type, from_bundles=False, publish_versions=False):
+    """
+    logs the number of tiles and bytes that would be created, updated, skipped or orphaned
+    for each level along with an estimate of the transfer time
+
+    If publish_versions is set, the tiles are compared with the published version. A new version is
+    uploaded to an empty prefix so the skipped tiles are also counted in the tiles to upload.
+    """
+    prefix = get_prefix(name, bucket_name, publish_versions)
+    logger.info(f"planning upload of {name} to {bucket_name} (comparing with {prefix})")
+    level_plans = []
+
+    with ProcessPoolExecutor(config.conversion_processes) as process_pool:
+        for level_folder in swarm.get_level_folders(name, from_bundles):
+            level = str(int(level_folder.name[1:]))
+            _, tiles = swarm.read_level_tiles(level, level_folder, from_bundles)
+            level_plans.append(
+                (
+                    level,
+                    plan_level(
+                        prefix, bucket_name, image_type, level, tiles, process_pool
+                    ),
+                )
+            )
+
+    totals = _empty_level_plan()
+    for _, level_plan in level_plans:
+        for key in totals:
+            totals[key] += level_plan[key]
+
+    table = [
+        [level]
+        + [
+            f"{level_plan[action]} ({humanize.naturalsize(level_plan[f'{action}_bytes'])})"
+            for action in ACTIONS
+        ]
+        for level, level_plan in [*level_plans, ("totals", totals)]
+    ]
+
+    upload_actions = ["create", "update"]
+    if publish_versions:
+        upload_actions.append("skip")
+    tiles_to_upload = sum(totals[action] for action in upload_actions)
+    bytes_to_upload = sum(totals[f"{action}_bytes"] for action in upload_actions)
+    seconds = estimate_seconds(name, tiles_to_upload, bytes_to_upload)
+    if seconds is None:
+        estimate = "unknown (no upload throughput has been recorded)"
+    else:
+        estimate = humanize.precisedelta(
+            seconds, minimum_unit="minutes", format="%0.0f"
+        )
+
+    logger.info(
+        "\n".join(
+            [
+                f"upload plan for {name} ({bucket_name})",
+                tabulate(table, headers=["level", *ACTIONS]),
+                "",
+                f"tiles to upload: {tiles_to_upload} ({humanize.naturalsize(bytes_to_upload)})",
+                f"estimated transfer time: {estimate}",
+            ]
+        )
+    )
+
+    return level_plans
@@ -1,7 +1,8 @@
 import json
 import os
+import time
 from pathlib import Path
-from typing import List, Literal, Optional, TypedDict, Union
+from typing import Any, List, Literal, Optional, TypedDict, Union
 
 from .config import config_folder
 
@@ -13,7 +14,23 @@ Properties = Literal[
     "caching_complete",
     "exploding_complete",
     "restart_times",
+    "upload_progress",
+    "grid_partitions",
 ]
+#: the most often that completed rows are written to the job file since the whole file is rewritten each time
+CHECKPOINT_SECONDS = 30
+
+
+class UploadProgress(TypedDict):
+    basemap: str
+    bucket: str
+    #: the prefix that the tiles are uploaded to (e.g. a version that hasn't been published yet)
+    prefix: str
+    completed_levels: List[str]
+    #: level/row units in levels that are not complete
+    completed_rows: List[str]
+    #: (level, rows, summary) for the completed levels and the completed rows of the other levels
+    level_summaries: List[Any]
 
 
 class Job(TypedDict):
@@ -24,6 +41,9 @@ class Job(TypedDict):
     caching_complete: bool
     exploding_complete: bool
     restart_times: List[str]
+    upload_progress: Optional[UploadProgress]
+    #: grid-scale keys to the areas of interest that the grid was partitioned into (see partition.py)
+    grid_partitions: dict[str, List[Any]]
 
 
 def cache_job_status(job: Job) -> None:
@@ -55,6 +75,8 @@ def start_new_job(
         "caching_complete": False,
         "exploding_complete": False,
         "restart_times": [],
+        "upload_progress": None,
+        "grid_partitions": {},
     }
 
     cache_job_status(job)
@@ -62,7 +84,7 @@ def start_new_job(
 
 def update_job(
     prop: Properties,
-    value: Union[str, bool],
+    value: Union[str, bool, UploadProgress, dict[str, Any], None],
 ) -> None:
     job: Optional[Job] = get_current_job()
 
@@ -70,7 +92,7 @@ def update_job(
         raise Exception("No job has been created!")
 
     # If the property is a list, append the value to it; otherwise, assign directly
-    if isinstance(job[prop], list):
+    if isinstance(job.get(prop), list):
         job[prop].append(value)  # type: ignore
     else:
         job[prop] = value  # type: ignore
@@ -89,3 +111,182 @@ def get_job_status(prop: Properties) -> Union[str, bool, List[str]]:
 
 def finish_job() -> None:
     os.remove(file_path)
+
+
+def get_upload_progress(basemap: str, bucket: str) -> Optional[UploadProgress]:
+    """
+    returns the progress of an interrupted upload of the base map to the bucket in the current job
+    """
+    job = get_current_job()
+    if job is None:
+        return None
+
+    progress = job.get("upload_progress")
+    if progress is None or (progress["basemap"], progress["bucket"]) != (
+        basemap,
+        bucket,
+    ):
+        return None
+
+    return progress
+
+
+def get_grid_partition(key: str) -> Optional[List[Any]]:
+    """
+    returns the areas of interest that the grid was partitioned into earlier in the current job or None
+    """
+    job = get_current_job()
+    if job is None:
+        return None
+
+    return (job.get("grid_partitions") or {}).get(key)
+
+
+def save_grid_partition(key: str, aois: List[Any]) -> None:
+    """
+    records the partition of a grid in the current job so that a resumed job caches the same areas of interest
+    """
+    job = get_current_job()
+    if job is None:
+        return
+
+    partitions = job.get("grid_partitions") or {}
+    partitions[key] = aois
+    update_job("grid_partitions", partitions)
+
+
+def _add_summaries(previous: dict[str, int], summary: dict[str, int]) -> dict[str, int]:
+    return {
+        key: previous.get(key, 0) + summary.get(key, 0)
+        for key in {**previous, **summary}
+    }
+
+
+class UploadCheckpoint(object):
+    """
+    Records the (level, row) units of an upload that are complete in the current job along with the
+    summaries of the tiles in them.
+
+    A resumed upload skips the completed levels and rows and adds its summaries to the ones that were
+    recorded before it was interrupted so that the job ends with one summary. Only the summaries of completed
+    levels and rows are recorded since the rest of the tiles are walked again when the upload is resumed.
+    Once a level is complete, its rows are replaced by the level to keep the job file small.
+    """
+
+    def __init__(self, progress: UploadProgress, resumed: bool = False):
+        self.progress = progress
+        self.resumed = resumed
+        self.completed_levels = set(progress["completed_levels"])
+        self.completed_rows = set(progress["completed_rows"])
+        #: level to [rows, summary] that was recorded before a resume
+        self.previous = {
+            level: [rows, summary]
+            for level, rows, summary in progress["level_summaries"]
+        }
+        #: level to [rows, summary] of the levels and the rows of unfinished levels that have been completed since
+        self.completed = {}
+        #: level to the live summary of the levels that are being uploaded
+        self.active = {}
+        self._last_save = time.monotonic()
+
+    @classmethod
+    def start(
+        cls, basemap: str, bucket: str, prefix: str
+    ) -> Optional["UploadCheckpoint"]:
+        """
+        returns a checkpoint that continues an interrupted upload in the current job, a new checkpoint or
+        None if there is no current job
+        """
+        if get_current_job() is None:
+            return None
+
+        progress = get_upload_progress(basemap, bucket)
+        if progress is not None:
+            return cls(progress, resumed=True)
+
+        checkpoint = cls(
+            {
+                "basemap": basemap,
+                "bucket": bucket,
+                "prefix": prefix,
+                "completed_levels": [],
+                "completed_rows": [],
+                "level_summaries": [],
+            }
+        )
+        checkpoint.save()
+
+        return checkpoint
+
+    def is_level_complete(self, level: str) -> bool:
+        return level in self.completed_levels
+
+    def is_row_complete(self, level: str, row: str) -> bool:
+        return f"{level}/{row}" in self.completed_rows
+
+    def start_level(self, level: str, summary: dict[str, int]) -> None:
+        self.active[level] = summary
+
+    def complete_row(self, level: str, row: str, summary: dict[str, int]) -> None:
+        """
+        summary: the summary of the tiles in the row
+        """
+        self.completed_rows.add(f"{level}/{row}")
+        rows, previous_summary = self.completed.get(level, [0, {}])
+        self.completed[level] = [rows + 1, _add_summaries(previous_summary, summary)]
+        if time.monotonic() - self._last_save > CHECKPOINT_SECONDS:
+            self.save()
+
+    def complete_level(self, level: str, rows: int, summary: dict[str, int]) -> None:
+        """
+        rows and summary are for all of the tiles in the level that were uploaded since a resume including
+        the ones in rows that were already recorded with complete_row
+        """
+        self.active.pop(level, None)
+        self.completed[level] = [rows, summary]
+        self.completed_levels.add(level)
+        self.completed_rows = {
+            unit for unit in self.completed_rows if not unit.startswith(f"{level}/")
+        }
+        self.save()
+
+    def get_level_summaries(self, include_active: bool = True) -> List[Any]:
+        """
+        returns (level, rows, summary) for every level including the ones that are still being uploaded unless
+        include_active is False, in which case only the tiles in completed rows are included for them
+        """
+        levels = set(self.previous) | set(self.completed)
+        if include_active:
+            levels |= set(self.active)
+
+        level_summaries = []
+        for level in sorted(levels, key=int):
+            rows, summary = self.previous.get(level, [0, {}])
+            if include_active and level in self.active:
+                #: the rows that were recorded before a resume are also in completed_rows
+                rows = sum(
+                    1 for unit in self.completed_rows if unit.startswith(f"{level}/")
+                )
+                summary = _add_summaries(summary, self.active[level])
+            elif level in self.completed:
+                completed_rows, completed_summary = self.completed[level]
+                rows += completed_rows
+                summary = _add_summaries(summary, completed_summary)
+            level_summaries.append((level, rows, summary))
+
+        return level_summaries
+
+    def save(self) -> None:
+        self.progress["completed_levels"] = sorted(self.completed_levels, key=int)
+        self.progress["completed_rows"] = sorted(self.completed_rows)
+        self.progress["level_summaries"] = self.get_level_summaries(
+            include_active=False
+        )
+        update_job("upload_progress", self.progress)
+        self._last_save = time.monotonic()
+
+    def finish(self) -> None:
+        """
+        clears the progress from the job once the upload is complete
+        """
+        update_job("upload_progress", None)
@@ -23,6 +23,47 @@ def get_basemap(basemap):
     return {"cache": {"start": 0, "runs": []}, "upload": {"start": 0, "runs": []}}
 
 
+def record_upload_throughput(basemap, tiles, bytes_uploaded, seconds):
+    """
+    records the throughput of the tiles that were actually uploaded (skipped tiles are not included)
+    so that future uploads can be estimated
+    """
+    #: very short runs round to zero seconds which can't be divided by in get_upload_throughput
+    seconds = round(seconds, 1)
+    if tiles == 0 or seconds <= 0:
+        return
+
+    basemap_stats = get_basemap(basemap)
+    basemap_stats["upload"].setdefault("throughput", []).append(
+        {
+            "tiles": tiles,
+            "bytes": bytes_uploaded,
+            "seconds": seconds,
+            "completionDate": datetime.datetime.now().isoformat(),
+        }
+    )
+    save_basemap(basemap, basemap_stats)
+
+
+def get_upload_throughput(basemap, recent_runs=5):
+    """
+    returns a tuple of (tiles_per_second, bytes_per_second) averaged over the most recent uploads
+    or None if no uploads have been recorded
+    """
+    runs = get_basemap(basemap)["upload"].get("throughput", [])[-recent_runs:]
+    if len(runs) == 0:
+        return None
+
+    seconds = sum(run["seconds"] for run in runs)
+    if seconds <= 0:
+        return None
+
+    return (
+        sum(run["tiles"] for run in runs) / seconds,
+        sum(run["bytes"] for run in runs) / seconds,
+    )
+
+
 def save_basemap(basemap, data):
     stats = json.loads(stats_file.read_text())
     stats["basemaps"][basemap] = data
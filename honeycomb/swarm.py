@@ -6,21 +6,79 @@ swarm.py
 A module that contains code for etl-ing tiles into WMTS format and uploading to GCP.
 """
 
+import asyncio
+import json
 import os
+import random
+import sqlite3
+import threading
+import time
 import traceback
-from base64 import b64encode
-from functools import partial
-from multiprocessing.pool import ThreadPool
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
 from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import NamedTuple
 
 import requests
-from google.api_core.retry import Retry
-from google_crc32c import Checksum
-from PIL import Image
+from google.api_core.exceptions import GoogleAPICallError, NotFound
+from google.api_core.retry import Retry, if_transient_error
+from google.auth.exceptions import GoogleAuthError
+from google.cloud.storage import transfer_manager
+from google.cloud.storage.exceptions import InvalidResponse
 
-from . import config, settings
+from . import bundles, config, encoding, manifest, settings, stats
+from .concurrency import AdaptiveConcurrency
+from .conversion_cache import ConversionCache
+from .journal import FailedTileJournal
 from .log import logger, logging_tqdm
 from .messaging import send_email
+from .metrics import Histogram
+from .resumable import CHECKPOINT_SECONDS, UploadCheckpoint
+
+TIMED_OPERATIONS = ["read", "blank", "convert", "checksum", "upload"]
+#: the maximum number of calls that GCS recommends in a single batch request
+DELETE_BATCH_SIZE = 100
+#: the errors that a request to the bucket or an update of the local manifest can fail with
+BUCKET_ERRORS = (
+    GoogleAPICallError,
+    GoogleAuthError,
+    requests.RequestException,
+    sqlite3.Error,
+)
+#: written to the exploded cache when an upload starts removing its tiles (followed by the shard, if any)
+CONSUMED_MARKER = ".upload_started"
+#: versioned uploads go to <name>/VERSIONS_FOLDER/<version>/<level>/<column>/<row>
+VERSIONS_FOLDER = "versions"
+#: the object that points the discover service at the published version
+POINTER_NAME = "current.json"
+#: the number of versions older than the published version that are kept for rolling back
+RETAINED_VERSIONS = 1
+UPLOAD_ORDERS = ["sorted", "spread"]
+#: the number of tiles that are read ahead and shuffled when spreading uploads across the key space
+SPREAD_WINDOW = 10000
+UPLOAD_ENGINES = ["async", "transfer-manager"]
+#: the transfer manager starts a new pool of worker processes for each batch so they need to be large
+TRANSFER_BATCH_SIZE = 5000
+#: the number of times that the tiles in the failed tile journal are retried at the end of a job
+RETRY_ATTEMPTS = 3
+#: the delay before the first retry pass which doubles for each pass after that
+RETRY_BACKOFF_SECONDS = 30
+#: the response codes that uploads are retried for (the same ones as the storage client's default retry)
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+
+def _is_retryable_error(error):
+    """
+    the predicate of the upload retry. Uploads fail with the storage client's InvalidResponse rather than an
+    api core error so the default predicate doesn't retry them.
+    """
+    if isinstance(error, InvalidResponse):
+        return error.response.status_code in RETRYABLE_STATUS_CODES
+
+    return if_transient_error(error)
 
 
 def _empty_upload_summary():
@@ -29,18 +87,26 @@ def _empty_upload_summary():
         "updated": 0,
         "skipped_same_crc": 0,
         "converted": 0,
+        #: the tiles that still failed after the retry passes
         "errors": 0,
+        #: the tiles that failed before they were retried
+        "first_pass_errors": 0,
         "logged_tiles": 0,
+        "deleted": 0,
+        "blank": 0,
+        #: the size in the cache of the blank tiles that were not uploaded (they are not converted)
+        "blank_bytes": 0,
     }
 
 
-def _merge_upload_summaries(summaries):
-    totals = _empty_upload_summary()
-    for summary in summaries:
-        for key in totals:
-            totals[key] += summary[key]
-
-    return totals
+def _count_tiles(summary):
+    return (
+        summary["created"]
+        + summary["updated"]
+        + summary["skipped_same_crc"]
+        + summary["errors"]
+        + summary["blank"]
+    )
 
 
 def _format_upload_summary(title, context, summary):
@@ -50,15 +116,16 @@ def _format_upload_summary(title, context, summary):
     return "\n".join([title, *context_lines, *summary_lines])
 
 
-def _format_cache_job_summary(bucket_name, name, level_summaries):
+def _format_cache_job_summary(bucket_name, name, level_summaries, tiles_per_second):
     totals = _empty_upload_summary()
     total_rows = 0
     lines = [
         "cache upload summary",
         f"  bucket: {bucket_name}",
         f"  prefix: {name}",
+        f"  tiles_per_second: {tiles_per_second}",
         "",
-        "  level  rows  created  updated  skipped_same_crc  converted  errors  logged_tiles",
+        "  level  rows  created  updated  skipped_same_crc  converted  errors  first_pass_errors  logged_tiles  deleted  blank",
     ]
 
     for level, rows, summary in level_summaries:
@@ -66,7 +133,7 @@ def _format_cache_job_summary(bucket_name, name, level_summaries):
         for key in totals:
             totals[key] += summary[key]
         lines.append(
-            "  {level:>5}  {rows:>4}  {created:>7}  {updated:>7}  {skipped_same_crc:>16}  {converted:>9}  {errors:>6}  {logged_tiles:>12}".format(
+            "  {level:>5}  {rows:>4}  {created:>7}  {updated:>7}  {skipped_same_crc:>16}  {converted:>9}  {errors:>6}  {first_pass_errors:>17}  {logged_tiles:>12}  {deleted:>7}  {blank:>5}".format(
                 level=level,
                 rows=rows,
                 **summary,
@@ -85,16 +152,161 @@ def _format_cache_job_summary(bucket_name, name, level_summaries):
     return "\n".join(lines)
 
 
-def swarm(name, bucket_name, image_type, is_test=False, preview_url=None):
+def _get_known_tiles(bucket_name, name, level, verify_remote):
     """
-    copies all tiles into WMTS format as a sibling folder to the cache folder
-    returns a list of all of the column folders
+    returns a dictionary of blob name to crc32c for all of the tiles in the level that are already in the bucket
+
+    The local upload manifest is used unless verify_remote is set or the manifest has no record of the level.
+    In those cases, the manifest for the level is rebuilt from a single paged listing of the bucket.
+    """
+    prefix = f"{name}/{level}/"
+    known_tiles = {} if verify_remote else manifest.get_tiles(bucket_name, prefix)
+    if len(known_tiles) == 0:
+        manifest.reconcile(bucket_name, prefix)
+        known_tiles = manifest.get_tiles(bucket_name, prefix)
+
+    return known_tiles
+
+
+class Tile(NamedTuple):
+    level: str
+    row: str
+    column: str
+    #: the exploded tile file or the bundle that contains the tile
+    file_path: Path
+    #: the tile bytes for tiles that are read directly from a bundle
+    data: bytes | None = None
+
+
+def swarm(
+    name,
+    bucket_name,
+    image_type,
+    is_test=False,
+    preview_url=None,
+    verify_remote=False,
+    from_bundles=False,
+    delete_orphans=False,
+    publish_versions=False,
+    upload_order=None,
+    upload_engine="async",
+    shard=None,
+    skip_blank_tiles=False,
+    retry_failed=False,
+    checkpoint=False,
+    spot_tiles=None,
+    notify=True,
+):
     """
-    base_folder = Path(settings.CACHES_DIR) / f"{name}_Exploded" / "_alllayers"
+    uploads all of the tiles in the cache to GCP in WMTS format
+
+    Tiles are read from the exploded cache folder unless from_bundles is set, in which case they are
+    read directly from the compact cache bundles and the cache does not need to be exploded.
+
+    If delete_orphans is set, tiles in the bucket that no longer exist in the cache are deleted.
+
+    If publish_versions is set, the tiles are uploaded to a new versioned prefix without checking the bucket
+    for existing tiles. Once every tile is uploaded, the pointer object is updated to the new version and
+    the older versions are deleted in the background.
+
+    upload_order is one of UPLOAD_ORDERS and defaults to the uploadOrder config value.
+
+    upload_engine is one of UPLOAD_ENGINES. transfer-manager uploads with the storage transfer manager's
+    worker processes rather than the threads in this process (see _transfer_levels).
+
+    shard is an (index, count) tuple (see parse_shard). Only the rows in the shard are uploaded and the
+    summary is written to a file for merge_shards rather than busting the discover cache.
 
+    If skip_blank_tiles is set, blank tiles (see encoding.is_blank) are not uploaded and any copies of them
+    in the bucket are deleted so that clients fall back to their missing tile behavior.
+
+    Tiles that fail to convert or upload are written to a journal (see FailedTileJournal) and retried with
+    an exponential backoff once the rest of the cache has been uploaded. If retry_failed is set, only the
+    tiles in the journal of the previous upload are uploaded rather than walking the cache.
+
+    If checkpoint is set, the completed levels and rows and the summaries so far are recorded in the current
+    job (see resumable.UploadCheckpoint). If the job is resumed, the upload continues where it left off.
+
+    If spot_tiles is set (see aoi.SpotTiles), only the tiles in the area of interest of a spot cache are
+    walked and uploaded.
+
+    If notify is False, the discover cache is not busted and no email is sent (e.g. for benchmark.benchmark_swarm).
+    """
     if is_test:
         bucket_name += "-test"
 
+    if shard is not None and publish_versions:
+        raise ValueError("versions can't be published from a sharded upload")
+
+    if upload_order is None:
+        upload_order = config.get_upload_order()
+
+    if spot_tiles is not None and publish_versions and not retry_failed:
+        #: a version of only the spot's tiles would replace the complete versions when it is published
+        logger.info(
+            "spot caches are uploaded in place rather than published as a new version"
+        )
+        publish_versions = False
+
+    journal = FailedTileJournal(get_journal_path(name, bucket_name, shard))
+    version = None
+    upload_prefix = name
+    if retry_failed:
+        failed_tiles = journal.read()
+        if len(failed_tiles) == 0:
+            logger.info(
+                f"there are no failed tiles to retry for {name} in {bucket_name}"
+            )
+
+            return
+
+        if shard is not None:
+            #: the retried tiles are folded into the summary of the shard's upload
+            shard_summary = _read_shard_summary(bucket_name, name, shard)
+
+        #: retry into the same prefix so that an unpublished version can still be published
+        upload_prefix = failed_tiles[0]["prefix"]
+        if upload_prefix.startswith(f"{name}/{VERSIONS_FOLDER}/"):
+            version = upload_prefix.rsplit("/", 1)[1]
+        publish_versions = version is not None
+        delete_orphans = False
+        logger.info(f"retrying {len(failed_tiles)} failed tiles in {upload_prefix}")
+    elif publish_versions:
+        version = new_version()
+        upload_prefix = get_version_prefix(name, version)
+        logger.info(f"uploading to versioned prefix: {upload_prefix}")
+        if delete_orphans:
+            logger.info(
+                "old versions are deleted rather than orphans when publishing versions"
+            )
+            delete_orphans = False
+
+    if spot_tiles is not None:
+        logger.info(f"uploading only the {spot_tiles.count()} tiles in the spot cache")
+        if delete_orphans:
+            logger.info("orphans are not deleted when uploading a spot cache")
+            delete_orphans = False
+
+    if delete_orphans and not from_bundles and is_exploded_cache_consumed(name, shard):
+        #: the tiles that an earlier upload removed from the exploded cache would look like orphans
+        logger.warning(
+            "orphans are not deleted because an earlier upload has already removed tiles from the exploded cache. Explode the cache again to delete orphans."
+        )
+        delete_orphans = False
+
+    upload_checkpoint = None
+    if checkpoint and not is_test and shard is None and not retry_failed:
+        upload_checkpoint = UploadCheckpoint.start(name, bucket_name, upload_prefix)
+    if upload_checkpoint is not None and upload_checkpoint.resumed:
+        upload_prefix = upload_checkpoint.progress["prefix"]
+        version = None
+        if upload_prefix.startswith(f"{name}/{VERSIONS_FOLDER}/"):
+            version = upload_prefix.rsplit("/", 1)[1]
+        publish_versions = version is not None
+        logger.info(
+            f"resuming the upload to {upload_prefix}. Skipping {len(upload_checkpoint.completed_levels)} completed levels and {len(upload_checkpoint.completed_rows)} completed rows."
+        )
+
     # Temporary upload diagnostics toggles.
     diagnostics_enabled = True
     log_all_tiles = False
@@ -103,200 +315,1629 @@ def swarm(name, bucket_name, image_type, is_test=False, preview_url=None):
         logger.info("upload diagnostics enabled")
     if log_all_tiles:
         logger.info("tile upload diagnostics enabled for all tiles")
+    if verify_remote:
+        logger.info("verifying the upload manifest against the bucket")
+    if from_bundles:
+        logger.info("reading tiles directly from the compact cache bundles")
+    if delete_orphans:
+        logger.info("deleting orphaned tiles from the bucket")
+    logger.info(f"upload order: {upload_order}")
+    logger.info(f"upload engine: {upload_engine}")
+    if shard is not None:
+        logger.info(f"uploading shard {format_shard(shard)}")
+    if skip_blank_tiles:
+        logger.info("skipping blank tiles")
 
-    level_summaries = []
+    #: a new version's prefix is empty unless the upload to it was interrupted
+    fresh_prefix = publish_versions and (
+        upload_checkpoint is None or not upload_checkpoint.resumed
+    )
+
+    def upload(levels, delete_orphans=delete_orphans, checkpoint=None):
+        upload_args = (
+            upload_prefix,
+            bucket_name,
+            image_type,
+            levels,
+            diagnostics_enabled,
+            log_all_tiles,
+            verify_remote,
+            delete_orphans,
+            fresh_prefix,
+            upload_order,
+            shard,
+            skip_blank_tiles,
+            journal,
+            checkpoint,
+        )
+        if upload_engine == "transfer-manager":
+            return _transfer_levels(*upload_args)
+
+        return asyncio.run(_upload_levels(*upload_args))
 
-    for level_folder in sorted(base_folder.iterdir()):
+    start = time.perf_counter()
+    if retry_failed:
+        levels = read_journal_levels(failed_tiles)
+    else:
+        if not from_bundles:
+            mark_exploded_cache_consumed(name, shard)
+        levels = read_levels(
+            get_level_folders(name, from_bundles),
+            from_bundles,
+            shard,
+            upload_checkpoint,
+            spot_tiles,
+        )
+    if upload_checkpoint is None or not upload_checkpoint.resumed:
+        #: the journal is rewritten with the tiles that fail this time
+        journal.clear()
+    level_summaries, level_metrics = upload(levels, checkpoint=upload_checkpoint)
+    if upload_checkpoint is not None:
+        #: include the levels and rows that were uploaded before the job was resumed
+        level_summaries = upload_checkpoint.get_level_summaries()
+    for _, _, summary in level_summaries:
+        summary["first_pass_errors"] = summary["errors"]
+    level_metrics.extend(
+        _retry_failed_tiles(
+            lambda levels: upload(levels, delete_orphans=False),
+            journal,
+            level_summaries,
+        )
+    )
+    if upload_checkpoint is not None:
+        upload_checkpoint.finish()
+    seconds = time.perf_counter() - start
+    total_tiles = sum(_count_tiles(summary) for _, _, summary in level_summaries)
+    tiles_per_second = _get_rate(total_tiles, seconds)
+
+    if diagnostics_enabled:
+        logger.info(
+            _format_cache_job_summary(
+                bucket_name, upload_prefix, level_summaries, tiles_per_second
+            )
+        )
+
+    try:
+        _write_job_metrics(bucket_name, name, tiles_per_second, level_metrics)
+        #: retries are too small to be a useful throughput sample
+        if not is_test and shard is None and not retry_failed:
+            stats.record_upload_throughput(
+                name,
+                sum(
+                    summary["created"] + summary["updated"]
+                    for _, _, summary in level_summaries
+                ),
+                sum(metrics["bytes_uploaded"] for metrics in level_metrics),
+                seconds,
+            )
+    except (OSError, ValueError, KeyError):
+        logger.error(traceback.format_exc())
+
+    errors = sum(summary["errors"] for _, _, summary in level_summaries)
+    if errors > 0:
+        logger.error(
+            f"{errors} tiles still failed after retrying. They are listed in {journal.path}. Run `honeycomb upload {name} --retry-failed` to retry them."
+        )
+
+    if shard is not None:
+        bytes_uploaded = sum(metrics["bytes_uploaded"] for metrics in level_metrics)
+        if retry_failed:
+            level_summaries = _merge_retry_summaries(
+                [tuple(level_summary) for level_summary in shard_summary["levels"]],
+                level_summaries,
+            )
+            bytes_uploaded += shard_summary["bytes_uploaded"]
+            seconds += shard_summary["seconds"]
+        _write_shard_summary(
+            bucket_name,
+            name,
+            shard,
+            level_summaries,
+            bytes_uploaded,
+            seconds,
+        )
+        logger.info(
+            f"shard {format_shard(shard)} is complete. Run `honeycomb merge-shards {name}` once all of the shards are complete."
+        )
+
+        return
+
+    collector = None
+    if publish_versions:
+        if errors > 0:
+            message = f"{errors} tiles failed to upload to {upload_prefix} so it was not published. The previously published version of {name} is still being served."
+            logger.error(message)
+            send_email("honeycomb update", message)
+
+            return
+
+        bucket = config.get_storage_client().bucket(bucket_name)
+        publish_version(bucket, name, version)
+        collector = threading.Thread(
+            target=collect_old_versions, args=(bucket, name, version)
+        )
+        collector.start()
+
+    if notify:
+        bust_discover_cache()
+
+        if is_test:
+            send_email(
+                "honeycomb update",
+                f"{name}-Test is ready for review.\n\n{preview_url}",
+            )
+        else:
+            send_email("honeycomb update", f"{name} has been pushed to production")
+
+    if collector is not None:
+        collector.join()
+
+
+def get_level_folders(name, from_bundles=False):
+    """
+    returns the level folders (e.g. L05) of the exploded cache or the compact cache if from_bundles is set
+    """
+    if from_bundles:
+        base_folder = Path(settings.CACHES_DIR) / name / name / "_alllayers"
+    else:
+        base_folder = Path(settings.CACHES_DIR) / f"{name}_Exploded" / "_alllayers"
+
+    return sorted(folder for folder in base_folder.iterdir() if folder.is_dir())
+
+
+def _get_consumed_marker(name, shard=None):
+    marker = CONSUMED_MARKER
+    if shard is not None:
+        marker += "_{}of{}".format(*shard)
+
+    return Path(settings.CACHES_DIR) / f"{name}_Exploded" / marker
+
+
+def is_exploded_cache_consumed(name, shard=None):
+    """
+    returns True if an earlier upload (of the shard) has started removing tiles from the exploded cache
+    the marker is removed along with the rest of the exploded cache when the cache is exploded again
+    """
+    if shard is None:
+        return any(_get_consumed_marker(name).parent.glob(f"{CONSUMED_MARKER}*"))
+
+    return (
+        _get_consumed_marker(name).exists()
+        or _get_consumed_marker(name, shard).exists()
+    )
+
+
+def mark_exploded_cache_consumed(name, shard=None):
+    marker = _get_consumed_marker(name, shard)
+    if marker.parent.exists():
+        marker.touch()
+
+
+def read_level_tiles(
+    level, level_folder, from_bundles=False, spot_tiles=None, include=None
+):
+    """
+    returns a tuple of (row_folders, tiles) where tiles is a generator of Tile
+    row_folders is empty for bundles and is empty if there are no tiles in the level
+    if spot_tiles is set, bundles that don't contain any of its tiles are not read
+    include is passed to bundles.read_bundle to skip tiles in bundles
+    """
+    if from_bundles:
+        return [], _read_bundle_tiles(level, level_folder, spot_tiles, include)
+
+    row_folders = sorted(level_folder.iterdir())
+
+    return row_folders, _read_exploded_tiles(level, row_folders)
+
+
+def read_levels(
+    level_folders, from_bundles=False, shard=None, checkpoint=None, spot_tiles=None
+):
+    """
+    yields (level, row_folders, tiles) for each of the level folders that contain tiles
+    if shard is set, only the rows in the shard are included
+    if checkpoint is set, the levels and rows that it has recorded as complete are skipped
+    if spot_tiles is set, only the tiles in the area of interest of the spot cache are included (see aoi.SpotTiles)
+    """
+    filtered = shard is not None or checkpoint is not None or spot_tiles is not None
+    for level_folder in level_folders:
         level = str(int(level_folder.name[1:]))
-        logger.info("uploading level: {}".format(level))
-
-        row_folders = [folder for folder in sorted(level_folder.iterdir())]
-        if len(row_folders) > 0:
-            with (
-                ThreadPool(config.pool_threads) as pool,
-                logging_tqdm(total=len(row_folders)) as progress_bar,
-            ):
-                summaries = pool.map(
-                    partial(
-                        process_row_folder,
-                        name,
-                        bucket_name,
+        if checkpoint is not None and checkpoint.is_level_complete(level):
+            continue
+        if spot_tiles is not None and not spot_tiles.has_level(level):
+            continue
+
+        if from_bundles:
+            if not any(level_folder.glob("*.bundle")):
+                continue
+            #: the tiles are filtered using each bundle's index so that the data of other shards' tiles,
+            #: completed rows and tiles outside of the spot are never read
+            row_folders, tiles = read_level_tiles(
+                level,
+                level_folder,
+                from_bundles,
+                spot_tiles,
+                _get_tile_filter(level, shard, checkpoint, spot_tiles)
+                if filtered
+                else None,
+            )
+        else:
+            row_folders, tiles = read_level_tiles(level, level_folder)
+            if filtered:
+                #: filter the row folders before they are listed so that other shards' rows, completed
+                #: rows and rows outside of the spot are never walked
+                row_folders = [
+                    row_folder
+                    for row_folder in row_folders
+                    if _include_row(
                         level,
-                        progress_bar,
-                        image_type,
-                        diagnostics_enabled,
-                        log_all_tiles,
-                    ),
-                    row_folders,
-                )
-                totals = _merge_upload_summaries(summaries)
-                level_summaries.append((level, len(row_folders), totals))
-
-                if diagnostics_enabled:
-                    logger.info(
-                        _format_upload_summary(
-                            "level upload summary",
-                            {
-                                "bucket": bucket_name,
-                                "prefix": name,
-                                "level": level,
-                                "rows": len(row_folders),
-                            },
-                            totals,
-                        )
+                        str(int(row_folder.name[1:], 16)),
+                        shard,
+                        checkpoint,
+                        spot_tiles,
                     )
-            # with logging_tqdm(total=len(row_folders)) as progress_bar:
-            #     map(partial(process_row_folder, name, bucket_name, level, progress_bar), row_folders)
+                ]
+                tiles = _read_exploded_tiles(level, row_folders)
+            if spot_tiles is not None:
+                tiles = (
+                    tile
+                    for tile in tiles
+                    if spot_tiles.contains(level, tile.row, tile.column)
+                )
+            if len(row_folders) == 0:
+                continue
 
-    if diagnostics_enabled:
-        logger.info(_format_cache_job_summary(bucket_name, name, level_summaries))
+        yield level, row_folders, tiles
+
+
+def get_journal_path(name, bucket_name, shard=None):
+    """
+    returns the path to the failed tile journal for an upload
+    the journal refers to local tile files so it is kept with the config rather than in the shared caches folder
+    """
+    suffix = "" if shard is None else "_{}of{}".format(*shard)
+
+    return (
+        Path(config.config_folder)
+        / "upload_journals"
+        / f"{name}_{bucket_name}{suffix}.jsonl"
+    )
+
+
+def read_journal_levels(failed_tiles):
+    """
+    yields (level, row_folders, tiles) for the tiles in a failed tile journal in the same form as read_levels
+    tiles from bundles are read from their bundle again and any tiles that no longer exist are skipped
+    """
+    levels = {}
+    for failed_tile in failed_tiles:
+        levels.setdefault(failed_tile["level"], []).append(failed_tile)
+
+    for level in sorted(levels, key=int):
+        tiles = []
+        row_folders = set()
+        bundle_tiles = {}
+        for failed_tile in levels[level]:
+            file_path = Path(failed_tile["file_path"])
+            if failed_tile["from_bundle"]:
+                bundle_tiles.setdefault(file_path, set()).add(
+                    (failed_tile["row"], failed_tile["column"])
+                )
+            elif file_path.exists():
+                row_folders.add(file_path.parent)
+                tiles.append(
+                    Tile(level, failed_tile["row"], failed_tile["column"], file_path)
+                )
+            else:
+                logger.warning(f"{file_path} no longer exists so it can't be retried")
+
+        for bundle_path, wanted in bundle_tiles.items():
+            if not bundle_path.exists():
+                logger.warning(f"{bundle_path} no longer exists so it can't be retried")
+                continue
+            for row, column, data in bundles.read_bundle(bundle_path):
+                if (str(row), str(column)) in wanted:
+                    tiles.append(Tile(level, str(row), str(column), bundle_path, data))
+
+        if len(tiles) > 0:
+            yield level, sorted(row_folders), tiles
+
+
+def _merge_retry_summaries(level_summaries, retry_summaries):
+    """
+    adds the tiles that were uploaded by a retry pass to the level summaries
+    the errors of each level are replaced by the tiles that are still failing after the retry
+    returns level_summaries
+    """
+    summaries = {level: summary for level, _, summary in level_summaries}
+    for level, rows, retry_summary in retry_summaries:
+        if level not in summaries:
+            level_summaries.append((level, rows, retry_summary))
+            continue
+
+        summary = summaries[level]
+        for key, value in retry_summary.items():
+            if key not in ("errors", "first_pass_errors"):
+                summary[key] += value
+        summary["errors"] = retry_summary["errors"]
+
+    return level_summaries
+
+
+def _retry_failed_tiles(upload, journal, level_summaries):
+    """
+    upload: a function that uploads an iterable of levels (see read_levels) and returns the same values as
+    _upload_levels
+
+    retries the tiles in the journal with an exponential backoff between passes until they all succeed or
+    RETRY_ATTEMPTS is reached and merges the results into level_summaries
+    returns the level metrics of the retry passes
+    """
+    retry_metrics = []
+    for attempt in range(RETRY_ATTEMPTS):
+        failed_tiles = journal.read()
+        if len(failed_tiles) == 0:
+            break
+
+        delay = RETRY_BACKOFF_SECONDS * 2**attempt
+        logger.info(
+            f"retrying {len(failed_tiles)} failed tiles in {delay} seconds (attempt {attempt + 1} of {RETRY_ATTEMPTS})"
+        )
+        time.sleep(delay)
+
+        journal.clear()
+        retry_summaries, level_metrics = upload(read_journal_levels(failed_tiles))
+        _merge_retry_summaries(level_summaries, retry_summaries)
+        retry_metrics.extend(
+            {**metrics, "retry_attempt": attempt + 1} for metrics in level_metrics
+        )
+
+    return retry_metrics
+
+
+def _get_tile_filter(level, shard=None, checkpoint=None, spot_tiles=None):
+    """
+    returns a function of (row, column) for bundles.read_bundle that is True for the tiles in the level that
+    read_levels includes
+    """
+    rows = {}
+
+    def include(row, column):
+        if row not in rows:
+            rows[row] = _include_row(level, str(row), shard, checkpoint, spot_tiles)
+
+        return rows[row] and (
+            spot_tiles is None or spot_tiles.contains(level, row, column)
+        )
+
+    return include
+
+
+def _include_row(level, row, shard=None, checkpoint=None, spot_tiles=None):
+    if shard is not None and not in_shard(level, row, shard):
+        return False
+    if spot_tiles is not None and not spot_tiles.has_row(level, row):
+        return False
+
+    return checkpoint is None or not checkpoint.is_row_complete(level, row)
+
+
+def parse_shard(value):
+    """
+    parses a shard like 2/4 (the second of four shards) into a tuple of (index, count)
+    """
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"{value} is not a valid shard. Shards look like 2/4.")
+
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(
+            f"{value} is not a valid shard. The index must be between 1 and {count}."
+        )
+
+    return index, count
+
+
+def format_shard(shard):
+    return "{}/{}".format(*shard)
+
+
+def in_shard(level, row, shard):
+    """
+    rows are assigned to shards by a hash that is the same on every machine so that the shards are disjoint
+    """
+    index, count = shard
+
+    return zlib.crc32(f"{level}/{row}".encode()) % count == index - 1
+
+
+def _get_orphan_candidates(known_tiles, shard=None, checkpoint=None):
+    """
+    returns the set of blob names in the bucket that belong to the shard or all of them if shard is None
+    the tiles in rows that a checkpoint has recorded as complete are not walked so they can't be orphans
+    """
+    if shard is None and checkpoint is None:
+        return set(known_tiles)
+
+    candidates = set()
+    for blob_name in known_tiles:
+        _, level, _, row = blob_name.rsplit("/", 3)
+        if _include_row(level, row, shard, checkpoint):
+            candidates.add(blob_name)
+
+    return candidates
+
+
+def _get_shard_folder():
+    #: the caches folder is shared by all of the machines that are uploading shards
+    return Path(settings.CACHES_DIR) / "_upload_shards"
+
+
+def _get_shard_file(bucket_name, name, shard):
+    index, count = shard
+
+    return _get_shard_folder() / f"{name}_{bucket_name}_{index}of{count}.json"
+
+
+def _read_shard_summary(bucket_name, name, shard):
+    shard_file = _get_shard_file(bucket_name, name, shard)
+    if not shard_file.exists():
+        raise ValueError(
+            f"there is no summary for shard {format_shard(shard)} of {name}. Has it already been merged?"
+        )
+
+    return json.loads(shard_file.read_text())
+
+
+def _write_shard_summary(
+    bucket_name, name, shard, level_summaries, bytes_uploaded, seconds
+):
+    """
+    writes the summary of a shard's upload to a JSON file in the shared caches folder
+    """
+    _get_shard_folder().mkdir(exist_ok=True)
+    shard_file = _get_shard_file(bucket_name, name, shard)
+    shard_file.write_text(
+        json.dumps(
+            {
+                "shard": format_shard(shard),
+                "completionDate": datetime.now().isoformat(),
+                "seconds": seconds,
+                "bytes_uploaded": bytes_uploaded,
+                "levels": level_summaries,
+            },
+            indent=2,
+        )
+    )
+    logger.info(f"shard summary written to {shard_file}")
+
+
+def merge_shards(name, bucket_name):
+    """
+    combines the summaries of all of the shards of an upload into a single job summary and busts the
+    discover cache once every shard is complete
+    returns the merged list of (level, rows, summary) tuples
+    """
+    shard_files = sorted(_get_shard_folder().glob(f"{name}_{bucket_name}_*of*.json"))
+    if len(shard_files) == 0:
+        raise ValueError(f"there are no shard summaries for {name} in {bucket_name}")
+
+    shard_summaries = [json.loads(shard_file.read_text()) for shard_file in shard_files]
+    counts = {int(summary["shard"].split("/")[1]) for summary in shard_summaries}
+    if len(counts) != 1:
+        raise ValueError(
+            f"the shard summaries for {name} have different shard counts: {sorted(counts)}"
+        )
+    [count] = counts
+    missing = set(range(1, count + 1)) - {
+        int(summary["shard"].split("/")[0]) for summary in shard_summaries
+    }
+    if len(missing) > 0:
+        raise ValueError(
+            f"shards {', '.join(f'{index}/{count}' for index in sorted(missing))} of {name} are not complete"
+        )
+
+    merged = {}
+    for shard_summary in shard_summaries:
+        for level, rows, summary in shard_summary["levels"]:
+            merged_rows, merged_summary = merged.setdefault(
+                level, [0, _empty_upload_summary()]
+            )
+            merged[level][0] = merged_rows + rows
+            for key in merged_summary:
+                merged_summary[key] += summary[key]
+
+    level_summaries = sorted(
+        [(level, rows, summary) for level, (rows, summary) in merged.items()],
+        key=lambda level_summary: int(level_summary[0]),
+    )
+    #: the shards run at the same time so the job takes as long as the slowest shard
+    seconds = max(shard_summary["seconds"] for shard_summary in shard_summaries)
+    total_tiles = sum(_count_tiles(summary) for _, _, summary in level_summaries)
+    logger.info(
+        _format_cache_job_summary(
+            bucket_name, name, level_summaries, _get_rate(total_tiles, seconds)
+        )
+    )
+
+    try:
+        stats.record_upload_throughput(
+            name,
+            sum(
+                summary["created"] + summary["updated"]
+                for _, _, summary in level_summaries
+            ),
+            sum(shard_summary["bytes_uploaded"] for shard_summary in shard_summaries),
+            seconds,
+        )
+    except (OSError, ValueError, KeyError):
+        logger.error(traceback.format_exc())
 
     bust_discover_cache()
+    send_email("honeycomb update", f"{name} has been pushed to production")
 
-    if is_test:
-        send_email(
-            "honeycomb update", f"{name}-Test is ready for review.\n\n{preview_url}"
+    for shard_file in shard_files:
+        shard_file.unlink()
+
+    return level_summaries
+
+
+def spread_tiles(tiles, window=SPREAD_WINDOW, seed=None):
+    """
+    yields the tiles in a random order that is drawn from a buffer of the next window tiles
+
+    Walking the cache in sorted order produces blob names that are nearly sequential which concentrates
+    the writes on a small range of keys in GCS. Shuffling within a bounded look-ahead spreads them across
+    many rows and columns while keeping the number of tiles held in memory at window.
+    """
+    generator = random.Random(seed)
+    buffer = []
+    for tile in tiles:
+        if len(buffer) < window:
+            buffer.append(tile)
+            continue
+
+        index = generator.randrange(window)
+        yield buffer[index]
+        buffer[index] = tile
+
+    generator.shuffle(buffer)
+    yield from buffer
+
+
+def _write_job_metrics(bucket_name, name, tiles_per_second, level_metrics):
+    """
+    writes the detailed metrics for an upload job to a JSON file so that runs can be compared
+    """
+    metrics_folder = Path(config.config_folder) / "upload_metrics"
+    metrics_folder.mkdir(exist_ok=True)
+    metrics_file = (
+        metrics_folder / f"{name}_{bucket_name}_{datetime.now():%Y%m%d_%H%M%S}.json"
+    )
+    metrics_file.write_text(
+        json.dumps(
+            {
+                "bucket": bucket_name,
+                "prefix": name,
+                "completionDate": datetime.now().isoformat(),
+                "tiles_per_second": tiles_per_second,
+                "levels": level_metrics,
+            },
+            indent=2,
         )
-    else:
-        send_email("honeycomb update", f"{name} has been pushed to production")
+    )
+    logger.info(f"upload metrics written to {metrics_file}")
+
+
+def _get_rate(count, seconds):
+    if seconds <= 0:
+        return 0
 
+    return round(count / seconds, 1)
 
-def convert_png_to_jpg(file_path) -> Path:
+
+def _new_level_state(level, row_folders, known_tiles, listing_start, orphans):
     """
-    This function exists because I was unable to get the ManageTileCache tool in worker_bee.py
-    to generate JPGs. No matter what tile cache scheme file I pointed it at, it stubbornly
-    generated PNGs.
+    returns the state that both upload engines keep for a level while its tiles are uploaded
+    orphans: the blob names in the bucket that can be orphans. Whatever is left after walking the level
+    does not exist locally.
     """
-    image = Image.open(file_path)
-    bands = image.split()
-    if len(bands) == 4:
-        new_image = Image.new("RGB", image.size, (255, 255, 255))
-        new_image.paste(image, mask=bands[3])  # 3 is the alpha channel
-    else:
-        #: handle PNGs with no alpha channel (blank white tiles)
-        new_image = image.convert("RGB")
-    new_file_path = file_path.with_suffix(".jpg")
-    new_image.save(new_file_path, "JPEG", quality=75)
-    file_path.unlink()
+    return {
+        "level": level,
+        "row_folders": row_folders,
+        "rows": 0,
+        "known_tiles": known_tiles,
+        "listing_seconds": round(time.perf_counter() - listing_start, 2),
+        "start": time.perf_counter(),
+        "stage_timings": {"upload": _empty_stage_timing()},
+        "timings": {operation: Histogram() for operation in TIMED_OPERATIONS},
+        "bytes_uploaded": 0,
+        "source_bytes": 0,
+        "encoded_bytes": 0,
+        "summary": _empty_upload_summary(),
+        "uploaded_tiles": [],
+        #: blank tiles that need to be deleted from the bucket
+        "blank_tiles": [],
+        "orphans": orphans,
+        "orphan_candidates": len(orphans),
+        "tiles": 0,
+    }
+
+
+def _count_tile(level_state, row, key, value=1):
+    """
+    adds to the summary of the level and to the summary of the tile's row if the rows are being checkpointed
+    """
+    level_state["summary"][key] += value
+    if "row_summaries" in level_state:
+        row_summary = level_state["row_summaries"].setdefault(row, {})
+        row_summary[key] = row_summary.get(key, 0) + value
+
+
+def _record_manifest(bucket_name, uploaded_tiles):
+    try:
+        manifest.record_tiles(bucket_name, uploaded_tiles)
+    except sqlite3.Error:
+        logger.error(traceback.format_exc())
+
+
+def _finish_level(
+    bucket,
+    bucket_name,
+    name,
+    level_state,
+    fresh_prefix,
+    delete_orphans,
+    diagnostics_enabled,
+):
+    """
+    records the uploaded tiles of a level in the manifest, deletes its orphans and blank tiles from the
+    bucket and removes its empty row folders once all of its tiles are done
+    returns the detailed metrics for the level
+    """
+    level = level_state["level"]
+    summary = level_state["summary"]
+    if not fresh_prefix:
+        _record_manifest(bucket_name, level_state["uploaded_tiles"])
+
+    if delete_orphans:
+        try:
+            summary["deleted"] = _delete_orphans(
+                bucket,
+                level,
+                level_state["orphans"],
+                level_state["orphan_candidates"],
+            )
+        except BUCKET_ERRORS:
+            logger.error(traceback.format_exc())
+
+    if len(level_state["blank_tiles"]) > 0:
+        try:
+            summary["deleted"] += _delete_blank_tiles(
+                bucket, level, level_state["blank_tiles"]
+            )
+        except BUCKET_ERRORS:
+            logger.error(traceback.format_exc())
+
+    for row_folder in level_state["row_folders"]:
+        try:
+            row_folder.rmdir()
+        except OSError:
+            logger.error(traceback.format_exc())
+
+    stage_timings = level_state["stage_timings"]
+    upload_timing = stage_timings["upload"]
+    context = {
+        "bucket": bucket_name,
+        "prefix": name,
+        "level": level,
+        "rows": level_state["rows"],
+        "remote_tiles": len(level_state["known_tiles"]),
+        "listing_seconds": level_state["listing_seconds"],
+        "tiles_per_second": _get_rate(
+            level_state["tiles"], time.perf_counter() - level_state["start"]
+        ),
+        "upload_tiles_per_second": _get_stage_rate(upload_timing),
+        "bytes_uploaded": level_state["bytes_uploaded"],
+        "bytes_per_second": _get_rate(
+            level_state["bytes_uploaded"],
+            upload_timing["end"] - upload_timing["start"],
+        ),
+        "bytes_before_encoding": level_state["source_bytes"],
+        "bytes_after_encoding": level_state["encoded_bytes"],
+    }
+    if "convert" in stage_timings:
+        #: only _upload_levels converts tiles one at a time through the conversion cache
+        cache_lookups = level_state["cache_hits"] + level_state["cache_misses"]
+        context.update(
+            {
+                "convert_tiles_per_second": _get_stage_rate(stage_timings["convert"]),
+                "conversion_cache_hit_rate": (
+                    round(level_state["cache_hits"] / cache_lookups, 3)
+                    if cache_lookups > 0
+                    else 0
+                ),
+                "conversion_seconds_saved": round(
+                    level_state["cache_seconds_saved"], 2
+                ),
+            }
+        )
+    timings = level_state["timings"]
+
+    if diagnostics_enabled:
+        logger.info(
+            _format_upload_summary(
+                "level upload summary",
+                {
+                    **context,
+                    **{
+                        f"{operation}_timing": str(histogram)
+                        for operation, histogram in timings.items()
+                    },
+                },
+                summary,
+            )
+        )
 
-    return new_file_path
+    return {
+        **context,
+        "summary": summary,
+        "timings": {
+            operation: histogram.to_dict() for operation, histogram in timings.items()
+        },
+    }
 
 
-def process_row_folder(
+async def _upload_levels(
     name,
     bucket_name,
-    level,
-    progress_bar,
     image_type,
+    levels,
     diagnostics_enabled,
     log_all_tiles,
-    row_folder,
+    verify_remote,
+    delete_orphans,
+    fresh_prefix=False,
+    upload_order="sorted",
+    shard=None,
+    skip_blank_tiles=False,
+    journal=None,
+    checkpoint=None,
 ):
-    retry = Retry()
+    """
+    Uploads individual tiles from a single bounded queue that spans all of the levels so that the number
+    of in-flight requests is independent of how the tiles are distributed across row folders. The number
+    of in-flight requests is adjusted within the configured uploadConcurrency range based on the observed
+    latency and retryable errors. The blocking storage client calls run in a thread pool that is sized to
+    match the client's connection pool so that every request reuses the same HTTP session.
+
+    Reading, converting and checksumming tiles is CPU-bound so it is done in a separate pool of processes
+    that hands the encoded bytes to the upload workers through a second bounded queue. This keeps it from
+    competing with the upload threads for the GIL and caps the number of encoded tiles held in memory.
+
+    When deleting orphans, each level is compared against a fresh listing of the bucket rather than the
+    manifest and anything that was not found in the cache is deleted once the level is uploaded.
+
+    If fresh_prefix is set, the prefix is known to be empty so the bucket is not listed and the uploaded
+    tiles are not recorded in the manifest.
+
+    levels is an iterable of (level, row_folders, tiles) tuples (see read_levels). If upload_order is spread,
+    the tiles within each level are shuffled within a bounded look-ahead (see spread_tiles).
+
+    When uploading a shard, only the tiles in the bucket that belong to the shard can be orphans.
+
+    If skip_blank_tiles is set, blank tiles are not uploaded and their copies in the bucket are deleted once
+    the level is uploaded.
+
+    When tiles are converted, the results are kept in a ConversionCache that is sized by the
+    conversionCacheMegabytes config value so that byte-identical tiles are only converted once. The tiles are
+    read in this process so that they can be looked up in the cache before they are sent to a conversion
+    process.
+
+    Tiles that fail to convert or upload are recorded in journal if it is set (see FailedTileJournal).
+
+    If checkpoint is set, each level is recorded in it once it is uploaded (see resumable.UploadCheckpoint).
+    When the rows are walked in sorted order from the exploded cache, each row is also recorded once all of
+    its tiles are done.
+
+    returns a list of (level, rows, summary) tuples and a list of detailed metrics for each level
+    """
+    upload_concurrency = config.get_upload_concurrency()
+    limiter = AdaptiveConcurrency(
+        upload_concurrency["min"],
+        upload_concurrency["max"],
+        upload_concurrency["initial"],
+    )
+    logger.info(f"upload concurrency: {upload_concurrency}")
+    retry = Retry(
+        predicate=_is_retryable_error, on_error=limiter.record_retryable_error
+    )
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(upload_concurrency["max"]))
     bucket = config.get_storage_client().bucket(bucket_name)
-    row = str(int(row_folder.name[1:], 16))
-    upload_errors = []
-    summary = _empty_upload_summary()
-    for file_path in row_folder.iterdir():
-        column = "unknown"
-        blob_name = "unknown"
-        local_checksum = None
-        remote_checksum = None
-        action = "unknown"
-        source_file_path = file_path
-        converted = False
+    convert_queue = asyncio.Queue(maxsize=config.conversion_processes * 4)
+    upload_queue = asyncio.Queue(maxsize=upload_concurrency["max"] * 2)
+    conversion_cache = None
+    cache_bytes = config.get_conversion_cache_bytes()
+    if encoding.get_encoder(image_type) is not None and cache_bytes > 0:
+        conversion_cache = ConversionCache(cache_bytes)
+    level_summaries = []
+    level_metrics = []
+
+    async def finish_level(level_state):
+        summary = level_state["summary"]
+        #: the level is in the job summary even if it can't be finished
+        level_summaries.append((level_state["level"], level_state["rows"], summary))
         try:
-            column = str(int(file_path.name[1:-4], 16))
-            #: set the content type explicitly in case it ever changes for a particular tile
-            #: if you pass none then the content type of the existing blob object is used
-            if file_path.suffix == ".png":
-                if image_type and image_type.upper() == "JPEG":
-                    file_path = convert_png_to_jpg(file_path)
-                    content_type = "image/jpeg"
-                    converted = True
-                    summary["converted"] += 1
-                else:
-                    content_type = "image/png"
-            else:
-                content_type = "image/jpeg"
-
-            blob_name = f"{name}/{level}/{column}/{row}"
-            log_tile = log_all_tiles
-            if log_tile:
-                summary["logged_tiles"] += 1
-
-            blob = bucket.blob(blob_name)
-            if blob.exists(retry=retry):
-                blob.reload()  #: required to get the checksum
-                remote_checksum = blob.crc32c
-                local_checksum = b64encode(
-                    Checksum(file_path.read_bytes()).digest()
-                ).decode("utf-8")
-                if remote_checksum != local_checksum:
-                    blob.upload_from_filename(
-                        file_path, retry=retry, content_type=content_type
+            level_metrics.append(
+                await asyncio.to_thread(
+                    _finish_level,
+                    bucket,
+                    bucket_name,
+                    name,
+                    level_state,
+                    fresh_prefix,
+                    delete_orphans,
+                    diagnostics_enabled,
+                )
+            )
+            if checkpoint is not None:
+                checkpoint.complete_level(
+                    level_state["level"], level_state["rows"], summary
+                )
+        except Exception:
+            logger.exception(f"level {level_state['level']} could not be finished")
+
+    def finish_row(level_state, row):
+        level_state["walked_rows"].discard(row)
+        del level_state["row_pending"][row]
+        checkpoint.complete_row(
+            level_state["level"], row, level_state["row_summaries"].pop(row, {})
+        )
+
+    def walk_row(level_state, row):
+        if level_state["row_pending"][row] == 0:
+            finish_row(level_state, row)
+        else:
+            level_state["walked_rows"].add(row)
+
+    async def checkpoint_tile(level_state, tile):
+        if (
+            not fresh_prefix
+            and time.monotonic() - level_state["manifest_recorded"] > CHECKPOINT_SECONDS
+        ):
+            #: a resumed upload walks the unfinished rows again and compares them to the manifest
+            level_state["manifest_recorded"] = time.monotonic()
+            uploaded_tiles = level_state["uploaded_tiles"]
+            level_state["uploaded_tiles"] = []
+            await asyncio.to_thread(_record_manifest, bucket_name, uploaded_tiles)
+        level_state["row_pending"][tile.row] -= 1
+        if (
+            level_state["row_pending"][tile.row] == 0
+            and tile.row in level_state["walked_rows"]
+        ):
+            finish_row(level_state, tile.row)
+
+    async def finish_tile(level_state, progress_bar, tile):
+        progress_bar.update()
+        level_state["pending"] -= 1
+        if checkpoint is not None:
+            try:
+                await checkpoint_tile(level_state, tile)
+            except Exception:
+                logger.exception("the tile could not be checkpointed")
+        if level_state["walked"] and level_state["pending"] == 0:
+            await finish_level(level_state)
+
+    async def encode(tile, level_state):
+        """
+        returns the encoded tile from the conversion cache or a conversion process
+        """
+        if conversion_cache is None:
+            return await loop.run_in_executor(
+                process_pool,
+                encoding.encode_tile,
+                tile.file_path,
+                image_type,
+                tile.data,
+                skip_blank_tiles,
+            )
+
+        data = tile.data
+        if data is None:
+            start = time.perf_counter()
+            data = await asyncio.to_thread(tile.file_path.read_bytes)
+            level_state["timings"]["read"].record(time.perf_counter() - start)
+
+        key = conversion_cache.get_key(data)
+        cached = conversion_cache.get(key)
+        if cached is not None:
+            encoded, seconds = cached
+            level_state["cache_hits"] += 1
+            level_state["cache_seconds_saved"] += seconds
+
+            return encoded
+
+        level_state["cache_misses"] += 1
+        encoded = await loop.run_in_executor(
+            process_pool,
+            encoding.encode_tile,
+            tile.file_path,
+            image_type,
+            data,
+            skip_blank_tiles,
+        )
+        if encoded.converted or encoded.blank:
+            conversion_cache.put(
+                key, encoded._replace(timings={}), sum(encoded.timings.values())
+            )
+
+        return encoded
+
+    async def convert_worker(progress_bar):
+        while True:
+            tile, level_state = await convert_queue.get()
+            #: the tile is finished here unless it makes it to the upload queue
+            queued = False
+            try:
+                stage_start = time.perf_counter()
+                try:
+                    encoded = await encode(tile, level_state)
+                except Exception as error:
+                    _count_tile(level_state, tile.row, "errors")
+                    logger.exception(
+                        f"Converting error. Level: {tile.level}, row: {tile.row}, column: {tile.column}"
                     )
-                    action = "updated"
-                    summary["updated"] += 1
-                else:
-                    action = "skipped_same_crc"
-                    summary["skipped_same_crc"] += 1
-            else:
-                if log_tile:
-                    local_checksum = b64encode(
-                        Checksum(file_path.read_bytes()).digest()
-                    ).decode("utf-8")
-                blob.upload_from_filename(
-                    file_path, retry=retry, content_type=content_type
+                    if journal is not None:
+                        journal.record(name, tile, "convert", error)
+                    continue
+                _record_stage_timing(level_state, "convert", stage_start)
+                for operation, seconds in encoded.timings.items():
+                    level_state["timings"][operation].record(seconds)
+                level_state["source_bytes"] += encoded.source_size
+                level_state["encoded_bytes"] += len(encoded.data)
+
+                await upload_queue.put((tile, encoded, level_state))
+                queued = True
+            except Exception:
+                _count_tile(level_state, tile.row, "errors")
+                logger.exception("the tile could not be converted")
+            finally:
+                if not queued:
+                    await finish_tile(level_state, progress_bar, tile)
+                convert_queue.task_done()
+
+    async def upload_worker(progress_bar):
+        while True:
+            tile, encoded, level_state = await upload_queue.get()
+            acquired = False
+            latency = None
+            try:
+                await limiter.acquire()
+                acquired = True
+                stage_start = time.perf_counter()
+                action, uploaded_tile = await asyncio.to_thread(
+                    upload_tile,
+                    bucket,
+                    name,
+                    log_all_tiles,
+                    level_state["known_tiles"],
+                    tile,
+                    encoded,
+                    retry,
+                    journal,
                 )
-                action = "created"
-                summary["created"] += 1
+                #: only tiles that were uploaded tell us anything about request latency
+                if uploaded_tile is not None:
+                    latency = time.perf_counter() - stage_start
+                    level_state["timings"]["upload"].record(latency)
+                    level_state["bytes_uploaded"] += len(encoded.data)
+                _record_stage_timing(level_state, "upload", stage_start)
+
+                _count_tile(level_state, tile.row, action)
+                if action == "blank":
+                    _count_tile(level_state, tile.row, "blank_bytes", len(encoded.data))
+                    blob_name = get_blob_name(name, tile)
+                    if blob_name in level_state["known_tiles"]:
+                        level_state["blank_tiles"].append(blob_name)
+                if encoded.converted:
+                    _count_tile(level_state, tile.row, "converted")
+                if log_all_tiles:
+                    _count_tile(level_state, tile.row, "logged_tiles")
+                if uploaded_tile is not None:
+                    level_state["uploaded_tiles"].append(uploaded_tile)
+            except Exception:
+                logger.exception("the tile could not be uploaded")
+            finally:
+                #: the slot and the tile are always given back so that the level can still finish
+                if acquired:
+                    await limiter.release(latency)
+                await finish_tile(level_state, progress_bar, tile)
+                upload_queue.task_done()
+
+    with (
+        ProcessPoolExecutor(config.conversion_processes) as process_pool,
+        logging_tqdm(total=0, unit="tiles") as progress_bar,
+    ):
+        workers = [
+            asyncio.create_task(convert_worker(progress_bar))
+            for _ in range(config.conversion_processes)
+        ] + [
+            asyncio.create_task(upload_worker(progress_bar))
+            for _ in range(upload_concurrency["max"])
+        ]
+
+        for level, row_folders, tiles in levels:
+            if upload_order == "spread":
+                tiles = spread_tiles(tiles)
 
-            if log_tile:
-                logger.info(
-                    "tile upload decision: bucket=%s blob=%s action=%s remote_crc32c=%s local_crc32c=%s generation=%s metageneration=%s updated=%s size=%s content_type=%s converted=%s source=%s upload_file=%s",
+            logger.info("uploading level: {}".format(level))
+
+            #: list the next level while the previous level's tiles are still uploading
+            listing_start = time.perf_counter()
+            if fresh_prefix:
+                known_tiles = {}
+            else:
+                known_tiles = await asyncio.to_thread(
+                    _get_known_tiles,
                     bucket_name,
+                    name,
+                    level,
+                    verify_remote or delete_orphans,
+                )
+            level_state = _new_level_state(
+                level,
+                row_folders,
+                known_tiles,
+                listing_start,
+                _get_orphan_candidates(known_tiles, shard, checkpoint)
+                if delete_orphans
+                else set(),
+            )
+            level_state["stage_timings"]["convert"] = _empty_stage_timing()
+            level_state.update(
+                {
+                    "cache_hits": 0,
+                    "cache_misses": 0,
+                    "cache_seconds_saved": 0.0,
+                    "pending": 0,
+                    "walked": False,
+                    #: row to the number of its tiles that are not done
+                    "row_pending": {},
+                    #: rows that have been walked but still have tiles that are not done
+                    "walked_rows": set(),
+                }
+            )
+            if checkpoint is not None:
+                level_state["row_summaries"] = {}
+                level_state["manifest_recorded"] = time.monotonic()
+                checkpoint.start_level(level, level_state["summary"])
+            #: rows are only known to be walked before the end of the level if they are contiguous
+            contiguous_rows = upload_order == "sorted" and len(row_folders) > 0
+
+            rows = set()
+            previous_row = None
+            for tile in tiles:
+                if checkpoint is not None:
+                    if contiguous_rows and previous_row not in (None, tile.row):
+                        walk_row(level_state, previous_row)
+                    row_pending = level_state["row_pending"]
+                    row_pending[tile.row] = row_pending.get(tile.row, 0) + 1
+                    previous_row = tile.row
+                rows.add(tile.row)
+                if delete_orphans:
+                    level_state["orphans"].discard(get_blob_name(name, tile))
+                level_state["tiles"] += 1
+                level_state["pending"] += 1
+                progress_bar.total += 1
+                await convert_queue.put((tile, level_state))
+
+            level_state["rows"] = len(rows)
+            level_state["walked"] = True
+            if level_state["pending"] == 0:
+                await finish_level(level_state)
+
+        #: all converted tiles are in the upload queue before they are marked as done
+        await convert_queue.join()
+        await upload_queue.join()
+
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    return (
+        sorted(level_summaries, key=lambda level_summary: int(level_summary[0])),
+        sorted(level_metrics, key=lambda metrics: int(metrics["level"])),
+    )
+
+
+def _transfer_levels(
+    name,
+    bucket_name,
+    image_type,
+    levels,
+    diagnostics_enabled,
+    log_all_tiles,
+    verify_remote,
+    delete_orphans,
+    fresh_prefix=False,
+    upload_order="sorted",
+    shard=None,
+    skip_blank_tiles=False,
+    journal=None,
+    checkpoint=None,
+):
+    """
+    An alternative to _upload_levels that hands the uploads to the storage transfer manager's pool of worker
+    processes so that building and sending requests is not limited by the GIL of this process.
+
+    Tiles are encoded and compared against the bucket in batches in a separate pool of processes. The next
+    batch is encoded while the current batch is uploading. The transfer manager uploads by file name so
+    encoded tiles that are different than the tile file (converted or read from a bundle) are written to a
+    staging folder first.
+
+    The arguments and return value are the same as _upload_levels except that rows are recorded in
+    checkpoint once they are uploaded in batches. The transfer manager does not report the
+    duration of each request so there are no upload timings.
+    """
+    bucket = config.get_storage_client().bucket(bucket_name)
+    level_summaries = []
+    level_metrics = []
+
+    with (
+        ProcessPoolExecutor(config.conversion_processes) as process_pool,
+        TemporaryDirectory(dir=settings.CACHES_DIR) as staging_folder,
+        logging_tqdm(total=0, unit="tiles") as progress_bar,
+    ):
+
+        def stage_batch(batch, known_tiles):
+            return [
+                (
+                    tile,
+                    process_pool.submit(
+                        encoding.stage_tile,
+                        tile.file_path,
+                        image_type,
+                        Path(staging_folder) / f"{tile.level}_{tile.column}_{tile.row}",
+                        tile.data,
+                        known_tiles.get(get_blob_name(name, tile)),
+                        skip_blank_tiles,
+                    ),
+                )
+                for tile in batch
+            ]
+
+        def upload_batch(staged_batch, level_state):
+            uploads = {}
+            for tile, future in staged_batch:
+                progress_bar.update()
+                try:
+                    upload_path, size, encoded = future.result()
+                except Exception as error:
+                    _count_tile(level_state, tile.row, "errors")
+                    logger.exception(
+                        f"Converting error. Level: {tile.level}, row: {tile.row}, column: {tile.column}"
+                    )
+                    if journal is not None:
+                        journal.record(name, tile, "convert", error)
+                    continue
+                for operation, seconds in encoded.timings.items():
+                    level_state["timings"][operation].record(seconds)
+                level_state["source_bytes"] += encoded.source_size
+                level_state["encoded_bytes"] += size
+                if encoded.converted:
+                    _count_tile(level_state, tile.row, "converted")
+                if log_all_tiles:
+                    _count_tile(level_state, tile.row, "logged_tiles")
+
+                blob_name = get_blob_name(name, tile)
+                remote_checksum = level_state["known_tiles"].get(blob_name)
+                if encoded.blank:
+                    _count_tile(level_state, tile.row, "blank")
+                    _count_tile(level_state, tile.row, "blank_bytes", size)
+                    if remote_checksum is not None:
+                        level_state["blank_tiles"].append(blob_name)
+                    if tile.data is None:
+                        tile.file_path.unlink()
+                    continue
+                if remote_checksum == encoded.checksum:
+                    _count_tile(level_state, tile.row, "skipped_same_crc")
+                    if tile.data is None:
+                        tile.file_path.unlink()
+                    continue
+
+                action = "created" if remote_checksum is None else "updated"
+                uploads.setdefault(encoded.content_type, []).append(
+                    (tile, upload_path, blob_name, action, encoded.checksum, size)
+                )
+
+            for content_type, pending_uploads in uploads.items():
+                stage_start = time.perf_counter()
+                results = transfer_manager.upload_many(
+                    [
+                        (upload_path, bucket.blob(blob_name))
+                        for _, upload_path, blob_name, _, _, _ in pending_uploads
+                    ],
+                    upload_kwargs={"content_type": content_type},
+                    worker_type=transfer_manager.PROCESS,
+                    max_workers=config.transfer_processes,
+                )
+                for (
+                    tile,
+                    upload_path,
                     blob_name,
                     action,
-                    remote_checksum,
-                    local_checksum,
-                    getattr(blob, "generation", None),
-                    getattr(blob, "metageneration", None),
-                    getattr(blob, "updated", None),
-                    getattr(blob, "size", None),
-                    content_type,
-                    converted,
-                    source_file_path,
-                    file_path,
+                    checksum,
+                    size,
+                ), result in zip(pending_uploads, results):
+                    if isinstance(result, Exception):
+                        _count_tile(level_state, tile.row, "errors")
+                        logger.error(
+                            f"Uploading error. Level: {tile.level}, row: {tile.row}, column: {tile.column}\n\n{result!r}"
+                        )
+                        if journal is not None:
+                            journal.record(name, tile, "upload", result)
+                        continue
+
+                    _count_tile(level_state, tile.row, action)
+                    level_state["bytes_uploaded"] += size
+                    level_state["uploaded_tiles"].append(
+                        (blob_name, checksum, size, None)
+                    )
+                    if tile.data is None:
+                        tile.file_path.unlink()
+                    if upload_path != str(tile.file_path):
+                        Path(upload_path).unlink()
+                upload_timing = level_state["stage_timings"]["upload"]
+                upload_timing["tiles"] += len(pending_uploads)
+                upload_timing["start"] = min(upload_timing["start"], stage_start)
+                upload_timing["end"] = time.perf_counter()
+
+        for level, row_folders, tiles in levels:
+            if upload_order == "spread":
+                tiles = spread_tiles(tiles)
+            tiles = iter(tiles)
+
+            logger.info("uploading level: {}".format(level))
+
+            listing_start = time.perf_counter()
+            if fresh_prefix:
+                known_tiles = {}
+            else:
+                known_tiles = _get_known_tiles(
+                    bucket_name, name, level, verify_remote or delete_orphans
                 )
-            file_path.unlink()
-        except Exception:
-            summary["errors"] += 1
-            trace = traceback.format_exc()
-            upload_errors.append(
-                f"Uploading error. Level: {level}, row: {row}, column: {column}\n\n{trace}"
+            level_state = _new_level_state(
+                level,
+                row_folders,
+                known_tiles,
+                listing_start,
+                _get_orphan_candidates(known_tiles, shard, checkpoint)
+                if delete_orphans
+                else set(),
             )
-            if log_all_tiles:
-                logger.error(
-                    "tile upload decision failed: bucket=%s blob=%s action=%s remote_crc32c=%s local_crc32c=%s source=%s upload_file=%s",
+            rows = set()
+            if checkpoint is not None:
+                level_state["row_summaries"] = {}
+                checkpoint.start_level(level, level_state["summary"])
+            #: rows are only known to be walked before the end of the level if they are contiguous
+            contiguous_rows = upload_order == "sorted" and len(row_folders) > 0
+
+            staged_batch = None
+            while batch := list(islice(tiles, TRANSFER_BATCH_SIZE)):
+                for tile in batch:
+                    rows.add(tile.row)
+                    level_state["orphans"].discard(get_blob_name(name, tile))
+                level_state["tiles"] += len(batch)
+                progress_bar.total += len(batch)
+                next_batch = stage_batch(batch, known_tiles)
+                if staged_batch is not None:
+                    upload_batch(staged_batch, level_state)
+                    if checkpoint is not None and not fresh_prefix:
+                        #: a resumed upload walks the unfinished rows again and compares them to the manifest
+                        _record_manifest(bucket_name, level_state["uploaded_tiles"])
+                        level_state["uploaded_tiles"] = []
+                    if checkpoint is not None and contiguous_rows:
+                        #: the rows that don't continue into the next batch are done
+                        for row in {tile.row for tile, _ in staged_batch} - {
+                            tile.row for tile in batch
+                        }:
+                            checkpoint.complete_row(
+                                level, row, level_state["row_summaries"].pop(row, {})
+                            )
+                staged_batch = next_batch
+            if staged_batch is not None:
+                upload_batch(staged_batch, level_state)
+
+            level_state["rows"] = len(rows)
+            summary = level_state["summary"]
+            level_summaries.append((level, len(rows), summary))
+            level_metrics.append(
+                _finish_level(
+                    bucket,
                     bucket_name,
-                    blob_name,
-                    action,
-                    remote_checksum,
-                    local_checksum,
-                    source_file_path,
-                    file_path,
+                    name,
+                    level_state,
+                    fresh_prefix,
+                    delete_orphans,
+                    diagnostics_enabled,
                 )
-            logger.error(trace)
+            )
+            if checkpoint is not None:
+                checkpoint.complete_level(level, len(rows), summary)
+
+    return level_summaries, level_metrics
+
+
+def get_blob_name(name, tile):
+    return f"{name}/{tile.level}/{tile.column}/{tile.row}"
+
+
+def new_version():
+    """
+    returns a version name that sorts in the order that the versions were created
+    """
+    return f"{datetime.now():%Y%m%d%H%M%S}"
+
+
+def get_version_prefix(name, version):
+    return f"{name}/{VERSIONS_FOLDER}/{version}"
+
+
+def publish_version(bucket, name, version):
+    """
+    points the discover service at the tiles in a version by overwriting the pointer object
+    a single object write is atomic so clients switch from one complete version to the next
+    """
+    blob = bucket.blob(f"{name}/{POINTER_NAME}")
+    blob.cache_control = "no-cache"
+    blob.upload_from_string(
+        json.dumps(
+            {
+                "version": version,
+                "prefix": get_version_prefix(name, version),
+                "published": datetime.now().isoformat(),
+            }
+        ),
+        content_type="application/json",
+    )
+    logger.info(f"published {get_version_prefix(name, version)}")
+
+
+def get_published_version(bucket, name):
+    """
+    returns the version that the pointer object points to or None if a version has not been published
+    """
+    blob = bucket.get_blob(f"{name}/{POINTER_NAME}")
+    if blob is None:
+        return None
+
+    return json.loads(blob.download_as_bytes())["version"]
+
+
+def get_versions(bucket, name):
+    """
+    returns a sorted list of all of the versions in the bucket including unpublished ones
+    """
+    blobs = config.get_storage_client().list_blobs(
+        bucket.name, prefix=f"{name}/{VERSIONS_FOLDER}/", delimiter="/"
+    )
+    versions = set()
+    for page in blobs.pages:
+        versions.update(prefix.rstrip("/").split("/")[-1] for prefix in page.prefixes)
+
+    return sorted(versions)
+
+
+def collect_old_versions(bucket, name, published_version):
+    """
+    deletes the tiles for all of the versions that are older than the published version except for
+    the most recent RETAINED_VERSIONS of them
+    newer versions are left alone since they may still be uploading
+    """
     try:
-        row_folder.rmdir()
-    except Exception:
-        trace = traceback.format_exc()
-        logger.error(trace)
+        older_versions = [
+            version
+            for version in get_versions(bucket, name)
+            if version < published_version
+        ]
+        for version in older_versions[
+            : max(len(older_versions) - RETAINED_VERSIONS, 0)
+        ]:
+            prefix = get_version_prefix(name, version)
+            logger.info(f"deleting old version: {prefix}")
+            deleted = 0
+            for page in manifest.list_bucket(bucket.name, f"{prefix}/").pages:
+                deleted += len(delete_blobs(bucket, [blob.name for blob in page]))
+            logger.info(f"deleted {deleted} tiles from {prefix}")
+    except BUCKET_ERRORS:
+        logger.error(traceback.format_exc())
+
+
+def _delete_blank_tiles(bucket, level, blob_names):
+    """
+    deletes the copies of blank tiles from the bucket
+    returns the number of tiles that were deleted
+    """
+    logger.info(f"deleting {len(blob_names)} blank tiles from level {level}")
+    deleted_tiles = delete_blobs(bucket, blob_names)
+    manifest.delete_tiles(bucket.name, deleted_tiles)
+
+    return len(deleted_tiles)
+
+
+def _delete_orphans(bucket, level, orphans, remote_tiles):
+    """
+    deletes the orphaned tiles for a level unless they make up a suspiciously large share of the tiles
+    in the bucket (e.g. an incomplete cache or the wrong levels)
+    returns the number of tiles that were deleted
+    """
+    if len(orphans) == 0:
+        return 0
 
-    progress_bar.update()
+    threshold = config.get_orphan_ratio_threshold()
+    ratio = len(orphans) / remote_tiles
+    if ratio > threshold:
+        logger.error(
+            f"not deleting orphans for level {level}: {len(orphans)} of the {remote_tiles} tiles in the bucket ({ratio:.1%}) are not in the cache which is more than the {threshold:.1%} threshold"
+        )
+
+        return 0
+
+    logger.info(f"deleting {len(orphans)} orphaned tiles from level {level}")
+    deleted_tiles = delete_blobs(bucket, sorted(orphans))
+    manifest.delete_tiles(bucket.name, deleted_tiles)
+
+    return len(deleted_tiles)
+
+
+def delete_blobs(bucket, blob_names):
+    """
+    deletes blobs using batch requests of DELETE_BATCH_SIZE deletes each
+    returns a list of the blob names that were deleted (including blobs that were already gone)
+    """
+    deleted = []
+    for start in range(0, len(blob_names), DELETE_BATCH_SIZE):
+        batch_names = blob_names[start : start + DELETE_BATCH_SIZE]
+        try:
+            with config.get_storage_client().batch():
+                for blob_name in batch_names:
+                    bucket.delete_blob(blob_name)
+            deleted.extend(batch_names)
+        except GoogleAPICallError:
+            #: a batch only raises for one of the deletes that failed (e.g. a blob that was already gone) so
+            #: each blob is deleted again on its own to find out which ones failed
+            deleted.extend(_delete_each_blob(bucket, batch_names))
+        except requests.RequestException:
+            logger.error(traceback.format_exc())
+
+    return deleted
+
+
+def _delete_each_blob(bucket, blob_names):
+    """
+    returns a list of the blob names that were deleted or were already gone
+    """
+    deleted = []
+    for blob_name in blob_names:
+        try:
+            bucket.delete_blob(blob_name)
+        except NotFound:
+            pass
+        except (GoogleAPICallError, requests.RequestException) as error:
+            logger.error(f"could not delete {blob_name}: {error}")
+            continue
+        deleted.append(blob_name)
+
+    return deleted
+
+
+def _read_exploded_tiles(level, row_folders):
+    for row_folder in row_folders:
+        row = str(int(row_folder.name[1:], 16))
+        for file_path in row_folder.iterdir():
+            yield Tile(level, row, str(int(file_path.name[1:-4], 16)), file_path)
+
+
+def _read_bundle_tiles(level, level_folder, spot_tiles=None, include=None):
+    for bundle_path in sorted(level_folder.glob("*.bundle")):
+        if spot_tiles is not None and not spot_tiles.intersects_bundle(
+            level, *bundles.parse_bundle_name(bundle_path)
+        ):
+            continue
+        for row, column, data in bundles.read_bundle(bundle_path, include):
+            yield Tile(level, str(row), str(column), bundle_path, data)
+
+
+def _empty_stage_timing():
+    return {"tiles": 0, "start": float("inf"), "end": 0}
+
+
+def _record_stage_timing(level_state, stage, stage_start):
+    stage_timing = level_state["stage_timings"][stage]
+    stage_timing["tiles"] += 1
+    stage_timing["start"] = min(stage_timing["start"], stage_start)
+    stage_timing["end"] = time.perf_counter()
+
+
+def _get_stage_rate(stage_timing):
+    return _get_rate(stage_timing["tiles"], stage_timing["end"] - stage_timing["start"])
+
+
+def upload_tile(
+    bucket, name, log_all_tiles, remote_tiles, tile, encoded, retry, journal=None
+):
+    """
+    uploads the encoded bytes for a single tile if they are different than the tile in the bucket and
+    the tile is not blank
+    tiles that fail are recorded in journal if it is set
+    returns a tuple of (action, uploaded_tile) where uploaded_tile is a manifest record or None
+    """
+    level, row, column, file_path, _ = tile
+    data, content_type, local_checksum, converted, _, blank, _ = encoded
+    blob_name = "unknown"
+    remote_checksum = None
+    action = "unknown"
+    try:
+        blob_name = get_blob_name(name, tile)
+
+        blob = bucket.blob(blob_name)
+        if blank:
+            action = "blank"
+        elif blob_name in remote_tiles:
+            remote_checksum = remote_tiles[blob_name]
+            if remote_checksum != local_checksum:
+                blob.upload_from_string(data, content_type=content_type, retry=retry)
+                action = "updated"
+            else:
+                action = "skipped_same_crc"
+        else:
+            blob.upload_from_string(data, content_type=content_type, retry=retry)
+            action = "created"
+
+        uploaded_tile = None
+        if action not in ("skipped_same_crc", "blank"):
+            uploaded_tile = (blob_name, local_checksum, blob.size, blob.generation)
+
+        if log_all_tiles:
+            logger.info(
+                "tile upload decision: bucket=%s blob=%s action=%s remote_crc32c=%s local_crc32c=%s generation=%s metageneration=%s updated=%s size=%s content_type=%s converted=%s source=%s",
+                bucket.name,
+                blob_name,
+                action,
+                remote_checksum,
+                local_checksum,
+                getattr(blob, "generation", None),
+                getattr(blob, "metageneration", None),
+                getattr(blob, "updated", None),
+                getattr(blob, "size", None),
+                content_type,
+                converted,
+                file_path,
+            )
+        if tile.data is None:
+            file_path.unlink()
+
+        return action, uploaded_tile
+    except Exception as error:
+        if log_all_tiles:
+            logger.error(
+                "tile upload decision failed: bucket=%s blob=%s action=%s remote_crc32c=%s local_crc32c=%s source=%s",
+                bucket.name,
+                blob_name,
+                action,
+                remote_checksum,
+                local_checksum,
+                file_path,
+            )
+        logger.exception(
+            f"Uploading error. Level: {level}, row: {row}, column: {column}"
+        )
+        if journal is not None:
+            journal.record(name, tile, "upload", error)
 
-    return summary
+        return "errors", None
 
 
 def bust_discover_cache():
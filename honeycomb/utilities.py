@@ -1,3 +1,4 @@
+import time
 from shutil import copy
 
 import arcpy
@@ -6,14 +7,110 @@ from . import settings
 from .log import logger
 
 
-def get_pro_map(basemap: str) -> arcpy._mp.Map:
+class ProMapCache(object):
+    """
+    A per-process cache of the maps in copies of the Pro project.
+
+    Copying the project from the share and opening it takes a while and ManageTileCache is run for every grid
+    cell so the copy is made once per base map and reused until the project on the share is modified. The
+    open map can be released (see release) to drop its schema locks without throwing away the copy.
+    """
+
+    def __init__(self, suffix: str = ""):
+        #: appended to the names of the copies so that several processes can each have their own
+        self.suffix = suffix
+        #: basemap to {"mtime", "path", "project", "map", "copy_seconds", "open_seconds"}
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+        #: the copy and open time that was skipped because of hits
+        self.seconds_saved = 0.0
+        #: the seconds that were saved by the most recent call to get
+        self.last_seconds_saved = 0.0
+
+    def get(self, basemap: str) -> arcpy._mp.Map:
+        source_mtime = settings.PRO_PROJECT.stat().st_mtime
+        entry = self._entries.get(basemap)
+        if entry is not None and entry["mtime"] != source_mtime:
+            logger.info(f"{settings.PRO_PROJECT} has changed. Copying it again.")
+            self.release(basemap)
+            entry = None
+
+        if entry is not None and entry["map"] is not None:
+            self.hits += 1
+            self.last_seconds_saved = entry["copy_seconds"] + entry["open_seconds"]
+            self.seconds_saved += self.last_seconds_saved
+
+            return entry["map"]
+
+        self.misses += 1
+        self.last_seconds_saved = 0.0
+        if entry is None:
+            temp_project_path, copy_seconds = _copy_project(basemap, self.suffix)
+            entry = {
+                "mtime": source_mtime,
+                "path": temp_project_path,
+                "project": None,
+                "map": None,
+                "copy_seconds": copy_seconds,
+                "open_seconds": 0.0,
+            }
+            self._entries[basemap] = entry
+        else:
+            #: the map was released but the copy is still current
+            self.last_seconds_saved = entry["copy_seconds"]
+            self.seconds_saved += self.last_seconds_saved
+
+        start = time.perf_counter()
+        entry["project"], entry["map"] = _open_map(entry["path"], basemap)
+        entry["open_seconds"] = time.perf_counter() - start
+
+        return entry["map"]
+
+    def release(self, basemap: str | None = None) -> None:
+        """
+        drops the references to the open project and map of the base map (or all of them if basemap is None)
+        so that their schema locks are released
+        """
+        for name, entry in self._entries.items():
+            if basemap is None or name == basemap:
+                entry["project"] = None
+                entry["map"] = None
+
+    def remove_copies(self) -> None:
+        """
+        releases all of the maps and deletes the copies of the project (e.g. when a worker process exits)
+        """
+        self.release()
+        for entry in self._entries.values():
+            try:
+                entry["path"].unlink(missing_ok=True)
+            except OSError as error:
+                logger.warning(f"could not delete {entry['path']}: {error}")
+        self._entries = {}
+
+
+def _copy_project(basemap: str, suffix: str = ""):
+    """
+    returns a tuple of (temp_project_path, seconds)
+    """
+    start = time.perf_counter()
     #: make a copy of the pro project so that we don't keep a lock on it
     #: append the name of the cache so that we can run multiple caches at once without lock issues
-    temp_project_path = settings.CACHES_DIR / "TempProjects" / f"Maps_{basemap}.aprx"
+    temp_project_path = (
+        settings.CACHES_DIR / "TempProjects" / f"Maps_{basemap}{suffix}.aprx"
+    )
     temp_project_path.unlink(missing_ok=True)
     temp_project_path.parent.mkdir(parents=True, exist_ok=True)
     copy(settings.PRO_PROJECT, temp_project_path)
 
+    return temp_project_path, time.perf_counter() - start
+
+
+def _open_map(temp_project_path, basemap: str):
+    """
+    returns a tuple of (project, map)
+    """
     project = arcpy.mp.ArcGISProject(str(temp_project_path))
     maps = project.listMaps(basemap)
     if not maps:
@@ -31,10 +128,18 @@ def get_pro_map(basemap: str) -> arcpy._mp.Map:
         )
     )
 
-    if not pro_map:
-        raise Exception(f"Map '{basemap}' not found in project.")
+    return project, pro_map
+
+
+pro_maps = ProMapCache()
+
+
+def get_pro_map(basemap: str) -> arcpy._mp.Map:
+    return pro_maps.get(basemap)
+
 
-    return pro_map
+def release_pro_map(basemap: str | None = None) -> None:
+    pro_maps.release(basemap)
 
 
 def validate_map_layers(basemap: str) -> None:
@@ -51,5 +156,7 @@ def validate_map_layers(basemap: str) -> None:
         )
     logger.info(f'All layers in the "{pro_map.name}" map are valid.')
 
-    #: release schema lock so that we can update data in a future step
+    #: release schema locks (including those of other base maps' maps) so that we can update data in a future step
+    #: the copies of the project are kept for the rest of the job
     del pro_map
+    release_pro_map()
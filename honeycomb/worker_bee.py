@@ -6,13 +6,11 @@ worker_bee.py
 A module that contains logic for building traditional image-based caches.
 """
 
-import os
 import shutil
 import subprocess
 import tempfile
 import time
 from datetime import date
-from os.path import join
 from pathlib import Path
 from typing import Union, cast
 
@@ -20,7 +18,17 @@ import arcpy
 import google.auth
 import pygsheets
 
-from . import config, settings, update_data, utilities
+from . import (
+    aoi,
+    cache_pool,
+    config,
+    history,
+    partition,
+    settings,
+    update_data,
+    utilities,
+)
+from .bundles import BundleInventory
 from .log import logger, logging_tqdm
 from .messaging import send_email
 from .resumable import get_job_status, update_job
@@ -110,6 +118,15 @@ def intersect_scales(scales: list[float], restrict_scales: list[float]) -> list[
     return list(intersection)
 
 
+def get_aoi_bundles(geometry, level: int) -> frozenset:
+    #: the bundles that the area of interest writes tiles to at the level (see cache_pool.get_bundles)
+    extent = geometry.projectAs(arcpy.SpatialReference(aoi.WEB_MERCATOR)).extent
+
+    return cache_pool.get_bundles(
+        (extent.XMin, extent.YMin, extent.XMax, extent.YMax), [level]
+    )
+
+
 class WorkerBee(object):
     def __init__(
         self,
@@ -132,6 +149,24 @@ class WorkerBee(object):
             self.image_type = basemap_config["imageType"]
         except KeyError:
             self.image_type = None
+        #: upload tiles directly from the compact cache bundles rather than exploding the cache
+        self.from_bundles = basemap_config.get("uploadFromBundles", False)
+        self.publish_versions = basemap_config.get("publishVersions", False)
+        self.upload_engine = basemap_config.get("uploadEngine", "async")
+        self.skip_blank_tiles = basemap_config.get("skipBlankTiles", False)
+        #: the number of ManageTileCache processes that the cells of the level 18-19 grids are cached in
+        self.cache_processes = basemap_config.get("cacheProcesses", 1)
+        #: merge sparse and split dense cells of the level 18-19 grids (see partition.py)
+        self.partition_grids = basemap_config.get("partitionGrids", False)
+        name = self.basemap.replace("/", "_")
+        self.bundle_inventory = BundleInventory(
+            Path(settings.CACHES_DIR) / name / name / "_alllayers"
+        )
+        #: how long each area of interest took in past jobs (see history.py)
+        self.cache_history = history.get_cache_history(basemap)
+        self.eta = history.EtaModel(self.cache_history)
+        #: job key to the PlannedAoi of each area of interest that cache has left (see plan_aois)
+        self.pending = {}
 
         utilities.validate_map_layers(basemap)
 
@@ -160,7 +195,8 @@ class WorkerBee(object):
         else:
             self.cache_test_extent()
 
-            explode_cache(basemap)
+            if not self.from_bundles:
+                explode_cache(basemap)
 
             swarm(
                 basemap,
@@ -168,6 +204,10 @@ class WorkerBee(object):
                 self.image_type,
                 is_test=True,
                 preview_url=self.preview_url,
+                from_bundles=self.from_bundles,
+                publish_versions=self.publish_versions,
+                upload_engine=self.upload_engine,
+                skip_blank_tiles=self.skip_blank_tiles,
             )
 
         update_job("test_cache_complete", True)
@@ -198,17 +238,15 @@ class WorkerBee(object):
             logger.info(
                 "intersecting spot cache polygon with level 18-19 cache extent..."
             )
-            intersect = arcpy.analysis.Intersect(
-                [spot_path, join(settings.EXTENTSFGDB, settings.EXTENT_18_19)],
-                "in_memory/spot_cache_intersect",
-                join_attributes="ONLY_FID",
-            )
+            intersect = aoi.intersect_18_19_extent(spot_path)
             logger.info("spot caching levels 18-19...")
-            self.cache_extent(settings.SCALES[18:20], str(intersect), SPOT_CACHE_NAME)
+            self.cache_extent(settings.SCALES[18:20], intersect, SPOT_CACHE_NAME)
 
             self.recache_errors()
 
-            explode_cache(basemap)
+            if not self.from_bundles:
+                #: only export the tiles in the spot rather than the entire statewide cache
+                explode_cache(basemap, spot_path)
 
     def cache_extent(
         self,
@@ -229,28 +267,177 @@ class WorkerBee(object):
         if len(cache_scales) == 0:
             return
 
-        logging_tqdm.write("caching {} at {}".format(name, cache_scales))
+        pro_map = utilities.get_pro_map(self.basemap)
+        logging_tqdm.write(
+            "caching {} at {} ({:.1f}s saved by reusing the project, {:.0f}s this job)".format(
+                name,
+                cache_scales,
+                utilities.pro_maps.last_seconds_saved,
+                utilities.pro_maps.seconds_saved,
+            )
+        )
 
         if config.is_dev() and name != SPOT_CACHE_NAME:
             aoi = settings.TEST_EXTENT
 
         try:
+            start = time.time()
             #: this takes 8-10 minutes to start for some reason
             arcpy.management.ManageTileCache(
                 str(settings.CACHES_DIR),
                 "RECREATE_EMPTY_TILES",
                 in_cache_name=self.basemap,
-                in_datasource=utilities.get_pro_map(self.basemap),
+                in_datasource=pro_map,
                 tiling_scheme=AGOL_SCHEME_NAME,
                 scales=cache_scales,
                 area_of_interest=aoi,
             )
 
             update_job("cache_extents_completed", cache_job_key)
+            self.record_duration(cache_job_key, time.time() - start)
         except arcpy.ExecuteError:
             self.errors.append([cache_scales, aoi, name])
             logger.error(arcpy.GetMessages())
 
+    def plan_aois(self, grids: list, grids_aois: list, dont_skip: bool = False) -> None:
+        """
+        grids: the (grid, scale) items of settings.GRIDS that are cached
+        grids_aois: the areas of interest of each of the grids (see get_grid_aois)
+        records the areas of interest that cache has left in pending so that get_progress can estimate how
+        long they will take and sorts the areas of interest of each grid so that the longest are cached first
+        """
+        completed = (
+            [] if dont_skip else cast(list, get_job_status("cache_extents_completed"))
+        )
+        planned = []
+        for fc_name, scales in settings.CACHE_EXTENTS:
+            cache_scales = intersect_scales(scales, self.restrict_scales)
+            if len(cache_scales) == 0:
+                continue
+
+            levels = tuple(
+                sorted(settings.SCALES.index(scale) for scale in cache_scales)
+            )
+            planned.append(
+                history.PlannedAoi(fc_name, f"{fc_name}-{scales}", levels, None)
+            )
+
+        if self.cache_processes > 1 and not config.is_dev():
+            processes = self.cache_processes
+        else:
+            processes = 1
+        for (grid, scale), grid_aois in zip(grids, grids_aois):
+            level = settings.SCALES.index(scale)
+            grid_planned = {
+                name: history.PlannedAoi(
+                    name,
+                    f"{name}-{[scale]}",
+                    (level,),
+                    len(get_aoi_bundles(geometry, level)),
+                    processes,
+                )
+                for name, geometry in grid_aois
+            }
+            planned.extend(grid_planned.values())
+
+            #: start the longest areas first so that the end of the level isn't left waiting on a slow one
+            grid_aois.sort(
+                key=lambda grid_aoi: self.eta.estimate(grid_planned[grid_aoi[0]]) or 0,
+                reverse=True,
+            )
+
+        self.pending = {
+            planned_aoi.job_key: planned_aoi
+            for planned_aoi in planned
+            if planned_aoi.job_key not in completed
+        }
+
+    def record_duration(self, job_key: str, seconds: float) -> None:
+        """
+        records how long a planned area of interest took in the history and the ETA model
+        areas of interest that were not planned (e.g. spot caches) are not recorded
+        """
+        planned = self.pending.pop(job_key, None)
+        if planned is None:
+            return
+
+        self.eta.add(planned, seconds)
+        #: dev caches the test extent rather than the area of interest
+        if not config.is_dev():
+            self.cache_history.record(
+                planned.name, planned.levels, seconds, planned.bundles
+            )
+
+    def get_grid_aois(self, grid: str, scale: float) -> list:
+        """
+        returns a list of (name, geometry) for the areas of interest that the grid is cached in
+        these are the grid's cells unless partitionGrids is set for the base map (see partition.py)
+        """
+        if self.partition_grids and not config.is_dev():
+            return partition.get_grid_aois(self.basemap, grid, scale)
+
+        with arcpy.da.SearchCursor(grid, ["SHAPE@", "OID@"]) as cursor:
+            return [
+                ("{}: OBJECTID: {}".format(grid, oid), shape) for shape, oid in cursor
+            ]
+
+    def cache_grid_cells(
+        self, grid: str, scale: float, grid_aois: list, dont_skip: bool = False
+    ) -> None:
+        """
+        caches the areas of interest of the grid (see get_grid_aois) at the scale in cache_processes worker
+        processes (see cache_pool) in the order that plan_aois sorted them
+        completed areas are recorded in the job the same way as cache_extent and failed areas are added to
+        errors to be recached one at a time by recache_errors
+        """
+        cache_scales = intersect_scales([scale], self.restrict_scales)
+        if len(cache_scales) == 0:
+            return
+
+        level = settings.SCALES.index(scale)
+        completed = cast(list, get_job_status("cache_extents_completed"))
+        cells = []
+        for name, geometry in grid_aois:
+            job_key = f"{name}-{[scale]}"
+            if dont_skip is False and job_key in completed:
+                continue
+
+            cells.append(
+                cache_pool.GridCell(
+                    name,
+                    job_key,
+                    geometry,
+                    cache_scales,
+                    get_aoi_bundles(geometry, level),
+                )
+            )
+
+        logger.info(
+            f"caching {len(cells)} cells of {grid} at {cache_scales} in {self.cache_processes} processes"
+        )
+        progress_bar = logging_tqdm(
+            total=len(cells), position=1, desc=f"Level {level} ({grid})"
+        )
+
+        def on_complete(cell, messages, seconds):
+            if messages is None:
+                update_job("cache_extents_completed", cell.job_key)
+                self.record_duration(cell.job_key, seconds)
+            else:
+                self.errors.append([cell.scales, cell.geometry, cell.name])
+                logger.error(f"{cell.name} failed:\n{messages}")
+            progress_bar.update(1)
+            logger.info(self.get_progress())
+
+        cache_pool.cache_cells(
+            self.basemap,
+            AGOL_SCHEME_NAME,
+            cells,
+            self.cache_processes,
+            on_complete,
+        )
+        progress_bar.close()
+
     def get_progress(self) -> str:
         total_bundles = self.get_bundles_count()
 
@@ -273,23 +460,29 @@ class WorkerBee(object):
         else:
             self.start_time = time.time()
             hours_remaining = "??"
+
+        #: the areas of interest that are left are estimated from how long they took in past jobs
+        remaining = self.eta.get_remaining(self.pending.values())
+        if len(remaining) > 0 and all(
+            seconds is not None for _, _, seconds in remaining
+        ):
+            hours_remaining = round(
+                sum(seconds for _, _, seconds in remaining) / 60 / 60, 1
+            )
         percent = int(round(float(total_bundles) / self.complete_num_bundles * 100.00))
         msg = "{} of {} ({}%) bundle files created.\nEstimated hours remaining: {}".format(
             total_bundles, self.complete_num_bundles, percent, hours_remaining
         )
+        for label, areas, seconds in remaining:
+            msg += "\n{}: {} areas of interest left, {} hours".format(
+                label, areas, "??" if seconds is None else round(seconds / 60 / 60, 1)
+            )
 
         return msg
 
     def get_bundles_count(self) -> int:
-        total_files = 0
-        name = self.basemap.replace("/", "_")
-        base_folder = Path(settings.CACHES_DIR) / name / name / "_alllayers"
-        if base_folder.exists():
-            for d in os.listdir(base_folder):
-                if d != "missing.jpg":
-                    total_files += len(os.listdir(os.path.join(base_folder, d)))
-
-        return total_files
+        #: only the levels that have changed since the last count are scanned (see BundleInventory)
+        return self.bundle_inventory.count()
 
     def cache_test_extent(self) -> None:
         cache_scales = intersect_scales(settings.SCALES, self.restrict_scales)
@@ -330,6 +523,15 @@ class WorkerBee(object):
     def cache(self, run_all_levels: bool, dont_skip: bool = False) -> None:
         arcpy.env.workspace = settings.EXTENTSFGDB
 
+        #: the grids at levels that were not requested are not read (or partitioned)
+        grids = [
+            grid
+            for grid in settings.GRIDS
+            if len(intersect_scales([grid[1]], self.restrict_scales)) > 0
+        ]
+        grids_aois = [self.get_grid_aois(grid[0], grid[1]) for grid in grids]
+        self.plan_aois(grids, grids_aois, dont_skip)
+
         for fc_name, scales in settings.CACHE_EXTENTS:
             self.cache_extent(scales, fc_name, fc_name, dont_skip)
             logger.info(self.get_progress())
@@ -341,18 +543,17 @@ class WorkerBee(object):
             ),
         )
 
-        for grid in settings.GRIDS:
-            total_grids = int(arcpy.management.GetCount(grid[0])[0])
-            with arcpy.da.SearchCursor(grid[0], ["SHAPE@", "OID@"]) as cur:
-                for row in logging_tqdm(
-                    cur, total=total_grids, position=1, desc=f"Level {grid[0]}"
+        for grid, grid_aois in zip(grids, grids_aois):
+            if self.cache_processes > 1 and not config.is_dev():
+                self.cache_grid_cells(grid[0], grid[1], grid_aois, dont_skip)
+            else:
+                for name, geometry in logging_tqdm(
+                    grid_aois,
+                    total=len(grid_aois),
+                    position=1,
+                    desc=f"Level {grid[0]}",
                 ):
-                    self.cache_extent(
-                        [grid[1]],
-                        row[0],
-                        "{}: OBJECTID: {}".format(grid[0], row[1]),
-                        dont_skip,
-                    )
+                    self.cache_extent([grid[1]], geometry, name, dont_skip)
                     logger.info(self.get_progress())
             send_email(
                 self.email_subject,
@@ -362,6 +563,9 @@ class WorkerBee(object):
             )
 
         self.recache_errors()
+        logger.info(
+            f"reused the project for {utilities.pro_maps.hits} extents which saved {utilities.pro_maps.seconds_saved / 60:.1f} minutes"
+        )
 
         bundles = self.get_bundles_count()
         if bundles < self.complete_num_bundles and run_all_levels:
@@ -415,7 +619,11 @@ class WorkerBee(object):
 
         base_maps_worksheet.update_value((cell.row + 1, cell.col), this_month)  # type: ignore
 
-        if not get_job_status("exploding_complete"):
+        if self.from_bundles:
+            logger.info(
+                "skipping exploding cache since tiles are uploaded from the bundles"
+            )
+        elif not get_job_status("exploding_complete"):
             explode_cache(self.basemap)
             update_job("exploding_complete", True)
             send_email(self.email_subject, "Exploding complete.")
@@ -435,10 +643,12 @@ def delete_exploded_cache(basemap) -> None:
         fast_delete_robocopy(exploded_directory)
 
 
-def explode_cache(basemap) -> None:
+def explode_cache(basemap, area_of_interest: str | None = None) -> None:
     delete_exploded_cache(basemap)
 
     logger.info("exploding cache for {}".format(basemap))
+    if area_of_interest is not None:
+        logger.info(f"exploding only the tiles in {area_of_interest}")
     try:
         arcpy.management.ExportTileCache(
             str(settings.CACHES_DIR / basemap / basemap),
@@ -446,6 +656,7 @@ def explode_cache(basemap) -> None:
             f"{basemap}_Exploded",
             export_cache_type="TILE_CACHE",
             storage_format_type="EXPLODED",
+            area_of_interest=area_of_interest,
         )
     except arcpy.ExecuteError:
         logger.error(arcpy.GetMessages())
@@ -1,21 +1,34 @@
+import json
+import os
 import sys
 from os import path, remove
+from pathlib import Path
 from shutil import rmtree
 
 import pytest
 
 #: mock arcpy
 sys.path.insert(0, path.join(path.dirname(__file__), "mocks"))
-from honeycomb import config  # NOQA
+from honeycomb import config, manifest, stats  # NOQA
 
 
 config.config_location = path.join(path.abspath(path.dirname(__file__)), "config.json")
+manifest.manifest_location = path.join(
+    path.abspath(path.dirname(__file__)), "upload_manifest.sqlite"
+)
+#: keep the upload throughput that swarm records out of the real stats file
+stats.stats_file = Path(path.abspath(path.dirname(__file__))) / "stats.json"
 test_data_folder = path.join(path.dirname(__file__), "data")
 temp_folder = path.join(test_data_folder, "temp")
 
 
 def cleanup():
-    for clean_path in [config.config_location, temp_folder]:
+    for clean_path in [
+        config.config_location,
+        manifest.manifest_location,
+        str(stats.stats_file),
+        temp_folder,
+    ]:
         if path.exists(clean_path):
             try:
                 remove(clean_path)
@@ -26,5 +39,32 @@ def cleanup():
 @pytest.fixture(scope="function", autouse=True)
 def setup_teardown():
     cleanup()
+    stats.stats_file.write_text(json.dumps({"basemaps": {}}))
     yield
     cleanup()
+
+
+def write_bundle(bundle_path, tiles):
+    """
+    tiles: dictionary of (row, column) relative to the bundle origin to tile bytes
+
+    writes a synthetic compact cache V2 bundle
+    """
+    header_size = 64
+    index_size = 128 * 128 * 8
+    index = bytearray(index_size)
+    body = bytearray()
+    for (row, column), data in tiles.items():
+        offset = header_size + index_size + len(body) + 4
+        record = (len(data) << 40) | offset
+        index[(row * 128 + column) * 8 : (row * 128 + column + 1) * 8] = (
+            record.to_bytes(8, "little")
+        )
+        body += len(data).to_bytes(4, "little") + data
+
+    header = bytearray(header_size)
+    header[0:8] = (3).to_bytes(4, "little") + (128 * 128).to_bytes(4, "little")
+
+    os.makedirs(path.dirname(bundle_path), exist_ok=True)
+    with open(bundle_path, "wb") as bundle_file:
+        bundle_file.write(header + index + body)
@@ -73,3 +73,18 @@ def GetMessages():
 
 def ExecuteError(Exception):
     pass
+
+
+class Extent(object):
+    def __init__(
+        self, XMin=None, YMin=None, XMax=None, YMax=None, spatial_reference=None
+    ):
+        self.XMin = XMin
+        self.YMin = YMin
+        self.XMax = XMax
+        self.YMax = YMax
+
+
+class _mp(object):
+    class Map(object):
+        pass
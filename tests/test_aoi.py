@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+test_aoi.py
+
+A module that contains tests for aoi.py
+"""
+
+from honeycomb import aoi
+
+
+class Box(object):
+    """
+    a rectangular stand-in for an arcpy polygon
+    """
+
+    def __init__(self, xmin, ymin, xmax, ymax):
+        self.extent = aoi.arcpy.Extent(xmin, ymin, xmax, ymax)
+        self.area = max(xmax - xmin, 0) * max(ymax - ymin, 0)
+
+    def clip(self, envelope):
+        return Box(
+            max(self.extent.XMin, envelope.XMin),
+            max(self.extent.YMin, envelope.YMin),
+            min(self.extent.XMax, envelope.XMax),
+            min(self.extent.YMax, envelope.YMax),
+        )
+
+
+def test_get_tile_range():
+    #: the whole world is a single tile at level 0
+    assert aoi.get_tile_range((-1e7, -1e7, 1e7, 1e7), 0) == (0, 0, 0, 0)
+
+    #: salt lake city
+    min_row, max_row, min_column, max_column = aoi.get_tile_range(
+        (-12460000, 4970000, -12450000, 4980000), 12
+    )
+    assert (min_row, max_row) == (1539, 1540)
+    assert (min_column, max_column) == (774, 775)
+
+    #: extents outside of the world are clamped
+    assert aoi.get_tile_range((-3e7, -3e7, 3e7, 3e7), 1) == (0, 1, 0, 1)
+
+
+def test_spot_tiles_add_geometry():
+    span = aoi.get_tile_span(10)
+    #: two tiles wide and one tile tall starting at row 100, column 200
+    left = aoi.ORIGIN_X + 200 * span + 1
+    top = aoi.ORIGIN_Y - 100 * span - 1
+    spot_tiles = aoi.SpotTiles()
+
+    spot_tiles.add_geometry(Box(left, top - span + 2, left + span * 1.5, top), [10])
+
+    assert spot_tiles.levels == {10: {100: (200, 201)}}
+    assert spot_tiles.count() == 2
+
+
+def test_spot_tiles():
+    spot_tiles = aoi.SpotTiles()
+    spot_tiles.add_range(18, 1000, 500, 510)
+    spot_tiles.add_range(18, 1000, 490, 495)
+    spot_tiles.add_range("18", "1001", 505, 505)
+
+    assert spot_tiles.has_level("18")
+    assert not spot_tiles.has_level("17")
+    assert spot_tiles.has_row("18", "1001")
+    assert not spot_tiles.has_row("18", "999")
+    assert spot_tiles.contains("18", "1000", "490")
+    assert not spot_tiles.contains("18", "1001", "504")
+    assert spot_tiles.count() == 22
+    assert spot_tiles.intersects_bundle(18, 896, 384)
+    assert not spot_tiles.intersects_bundle(18, 896, 512)
+    assert not spot_tiles.intersects_bundle(18, 1024, 384)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+test_benchmark.py
+
+A module that contains tests for benchmark.py
+"""
+
+import shutil
+from os.path import join
+from pathlib import Path
+
+from mock import patch
+
+from honeycomb import benchmark, config, manifest, settings
+
+from . import conftest
+
+
+def copy_exploded_level():
+    exploded = Path(conftest.temp_folder) / "Terrain_Exploded" / "_alllayers"
+    shutil.copytree(
+        join(conftest.test_data_folder, "JPG_Service", "Layers", "_alllayers", "L05"),
+        exploded / "L05",
+    )
+
+    return exploded
+
+
+def test_read_sample_reads_tiles_into_memory():
+    exploded = copy_exploded_level()
+
+    with patch.object(settings, "CACHES_DIR", conftest.temp_folder):
+        level, tiles = benchmark.read_sample("Terrain", sample_size=5)
+
+    assert level == "5"
+    assert len(tiles) == 5
+    assert all(tile.data == tile.file_path.read_bytes() for tile in tiles)
+    assert len(list((exploded / "L05").glob("*/*.jpg"))) == 16
+
+
+@patch("honeycomb.benchmark.manifest.list_bucket")
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_benchmark_upload_order(client_mock, list_bucket_mock):
+    exploded = copy_exploded_level()
+    bucket = client_mock.return_value.bucket.return_value
+
+    with patch.object(settings, "CACHES_DIR", conftest.temp_folder):
+        results = benchmark.benchmark_upload_order("Terrain", "bucket", "jpeg")
+
+    assert list(results) == ["sorted", "spread"]
+    assert all(len(rates) == benchmark.ROUNDS for rates in results.values())
+    assert bucket.blob.return_value.upload_from_string.call_count == 16 * 4
+    assert client_mock.return_value.bucket.call_args[0][0] == "bucket-test"
+    assert list_bucket_mock.call_args[0][1] == "Terrain/_benchmark/spread1/"
+    #: the local tiles are left in place
+    assert len(list((exploded / "L05").glob("*/*.jpg"))) == 16
+
+
+def test_generate_exploded_cache():
+    exploded = Path(conftest.temp_folder) / "Synthetic_Exploded"
+
+    count = benchmark.generate_exploded_cache(exploded, [5, 6], 10, blank_ratio=0)
+
+    assert count == 20
+    assert len(list((exploded / "_alllayers" / "L05").glob("*/*.png"))) == 10
+    #: 4 columns per row
+    assert (exploded / "_alllayers" / "L06" / "R00000002" / "C00000001.png").exists()
+
+
+@patch("honeycomb.swarm.send_email")
+@patch("honeycomb.swarm.bust_discover_cache")
+def test_benchmark_swarm(bust_mock, send_email_mock):
+    storage_client = config.storage_client
+    caches_dir = settings.CACHES_DIR
+    Path(conftest.temp_folder).mkdir(parents=True)
+
+    with patch.object(config, "config_folder", conftest.temp_folder):
+        results = benchmark.benchmark_swarm(levels=[5], tiles_per_level=9)
+
+    assert results["tiles"] == 9
+    assert results["uploaded"] == 9
+    assert results["injected_errors"] == 0
+    bust_mock.assert_not_called()
+    send_email_mock.assert_not_called()
+    #: the real client and cache folder are restored and the synthetic tiles are not left in the manifest
+    assert config.storage_client is storage_client
+    assert settings.CACHES_DIR == caches_dir
+    assert (
+        manifest.get_tiles(f"{benchmark.SYNTHETIC_BUCKET}-test", "SwarmBenchmark/")
+        == {}
+    )
+
+
+@patch("honeycomb.swarm.RETRY_BACKOFF_SECONDS", 0)
+def test_benchmark_swarm_with_errors():
+    Path(conftest.temp_folder).mkdir(parents=True)
+
+    with patch.object(config, "config_folder", conftest.temp_folder):
+        results = benchmark.benchmark_swarm(
+            error_rate=0.5, levels=[5], tiles_per_level=4, upload_engine="async"
+        )
+
+    assert results["uploaded"] == 4
+    assert results["injected_errors"] > 0
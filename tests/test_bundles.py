@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+test_bundles.py
+
+A module that contains tests for bundles.py
+"""
+
+import os
+import shutil
+from os.path import join
+from pathlib import Path
+
+from pytest import raises
+
+from honeycomb import bundles
+
+from . import conftest
+
+
+def test_parse_bundle_name():
+    assert bundles.parse_bundle_name("R0080C0100.bundle") == (128, 256)
+
+
+def test_read_bundle():
+    bundle_path = join(conftest.temp_folder, "L05", "R0080C0100.bundle")
+    conftest.write_bundle(bundle_path, {(0, 0): b"first", (2, 127): b"second tile"})
+
+    assert list(bundles.read_bundle(bundle_path)) == [
+        (128, 256, b"first"),
+        (130, 383, b"second tile"),
+    ]
+
+    assert list(bundles.read_bundle(bundle_path, lambda row, column: row == 130)) == [
+        (130, 383, b"second tile")
+    ]
+
+
+def test_read_tiles():
+    alllayers = join(conftest.temp_folder, "_alllayers")
+    conftest.write_bundle(join(alllayers, "L05", "R0000C0000.bundle"), {(10, 4): b"a"})
+    conftest.write_bundle(join(alllayers, "L06", "R0000C0000.bundle"), {(21, 9): b"b"})
+    conftest.write_bundle(join(alllayers, "L06", "R0080C0000.bundle"), {(0, 0): b"c"})
+
+    assert list(bundles.read_tiles(alllayers)) == [
+        (5, 10, 4, b"a"),
+        (6, 21, 9, b"b"),
+        (6, 128, 0, b"c"),
+    ]
+
+
+def test_read_bundle_raises_for_invalid_bundles():
+    bundle_path = join(conftest.temp_folder, "R0000C0000.bundle")
+    conftest.write_bundle(bundle_path, {})
+    with open(bundle_path, "r+b") as bundle_file:
+        bundle_file.write((1).to_bytes(4, "little"))
+
+    with raises(ValueError):
+        list(bundles.read_bundle(bundle_path))
+
+
+def test_bundle_inventory_only_rescans_modified_levels():
+    alllayers = Path(conftest.temp_folder) / "_alllayers"
+    for level, name in [
+        ("L05", "R0000C0000"),
+        ("L06", "R0000C0000"),
+        ("L06", "R0080C0000"),
+    ]:
+        conftest.write_bundle(join(alllayers, level, f"{name}.bundle"), {(0, 0): b"a"})
+    (alllayers / "missing.jpg").write_bytes(b"jpg")
+    #: pretend that the levels were last modified long ago
+    for level_folder in alllayers.iterdir():
+        os.utime(level_folder, (0, 0))
+    inventory = bundles.BundleInventory(alllayers)
+
+    assert inventory.count() == 3
+    assert inventory.get_level_counts() == {"L05": 1, "L06": 2}
+    assert inventory.scanned_levels == 2
+
+    assert inventory.count() == 3
+    assert inventory.scanned_levels == 0
+
+    conftest.write_bundle(join(alllayers, "L06", "R0100C0000.bundle"), {(0, 0): b"a"})
+
+    assert inventory.count() == 4
+    assert inventory.scanned_levels == 1
+
+
+def test_bundle_inventory_rescans_recently_modified_levels():
+    alllayers = Path(conftest.temp_folder) / "_alllayers"
+    conftest.write_bundle(join(alllayers, "L05", "R0000C0000.bundle"), {(0, 0): b"a"})
+    inventory = bundles.BundleInventory(alllayers)
+
+    inventory.count()
+    inventory.count()
+
+    #: a bundle could have been added within the resolution of the modification time
+    assert inventory.scanned_levels == 1
+
+
+def test_bundle_inventory_handles_deleted_caches():
+    alllayers = Path(conftest.temp_folder) / "_alllayers"
+    conftest.write_bundle(join(alllayers, "L05", "R0000C0000.bundle"), {(0, 0): b"a"})
+    inventory = bundles.BundleInventory(alllayers)
+    inventory.count()
+
+    shutil.rmtree(alllayers)
+
+    assert inventory.count() == 0
+    assert inventory.get_level_counts() == {}
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+test_cache_pool.py
+
+A module that contains tests for cache_pool.py
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from mock import Mock, patch
+
+from honeycomb import aoi, cache_pool
+
+
+def test_get_bundles():
+    span = aoi.get_tile_span(18)
+    #: the top left tile of the world and the tile to its right which is in the same bundle
+    extent = (
+        aoi.ORIGIN_X + 1,
+        aoi.ORIGIN_Y - span + 1,
+        aoi.ORIGIN_X + span + 1,
+        aoi.ORIGIN_Y - 1,
+    )
+
+    assert cache_pool.get_bundles(extent, [18]) == frozenset({(18, 0, 0)})
+
+    #: extend the extent into the next bundle to the right
+    extent = (extent[0], extent[1], aoi.ORIGIN_X + 128 * span + 1, extent[3])
+
+    assert cache_pool.get_bundles(extent, [18, 19]) == frozenset(
+        {(18, 0, 0), (18, 0, 1), (19, 0, 0), (19, 0, 1), (19, 0, 2)}
+    )
+
+
+def make_cell(name, bundles):
+    geometry = Mock()
+    geometry.JSON = name
+
+    return cache_pool.GridCell(name, f"{name}-[1]", geometry, [1], frozenset(bundles))
+
+
+@patch("honeycomb.cache_pool._start_worker")
+@patch("honeycomb.cache_pool.ProcessPoolExecutor", ThreadPoolExecutor)
+def test_cache_cells_never_runs_cells_that_share_bundles_at_once(start_worker_mock):
+    lock = threading.Lock()
+    running = set()
+    overlaps = []
+
+    def cache_cell(basemap, tiling_scheme, scales, geometry_json):
+        with lock:
+            running.add(geometry_json)
+            overlaps.append(set(running))
+        time.sleep(0.05)
+        with lock:
+            running.discard(geometry_json)
+
+        return "failed" if geometry_json == "c" else None
+
+    cells = [
+        make_cell("a", [(18, 0, 0)]),
+        make_cell("b", [(18, 0, 0), (18, 0, 1)]),
+        make_cell("c", [(18, 5, 5)]),
+        make_cell("d", [(18, 6, 6)]),
+    ]
+    on_complete = Mock()
+
+    with patch("honeycomb.cache_pool._cache_cell", cache_cell):
+        cache_pool.cache_cells("Terrain", "scheme", cells, 2, on_complete)
+
+    assert all(not {"a", "b"} <= overlap for overlap in overlaps)
+    assert max(len(overlap) for overlap in overlaps) == 2
+    completed = {call[0][0].name: call[0][1] for call in on_complete.call_args_list}
+    assert completed == {"a": None, "b": None, "c": "failed", "d": None}
+
+
+@patch("honeycomb.cache_pool._start_worker")
+@patch("honeycomb.cache_pool.ProcessPoolExecutor", ThreadPoolExecutor)
+def test_cache_cells_reports_exceptions_as_failures(start_worker_mock):
+    on_complete = Mock()
+
+    with patch("honeycomb.cache_pool._cache_cell", side_effect=ValueError("boom")):
+        cache_pool.cache_cells(
+            "Terrain", "scheme", [make_cell("a", [])], 2, on_complete
+        )
+
+    cell, messages, seconds = on_complete.call_args[0]
+    assert cell.name == "a"
+    assert seconds >= 0
+    assert "ValueError: boom" in messages
+
+
+@patch("honeycomb.cache_pool._start_worker")
+@patch("honeycomb.cache_pool.ProcessPoolExecutor", ThreadPoolExecutor)
+def test_cache_cells_reports_missing_maps_as_failures(start_worker_mock):
+    on_complete = Mock()
+
+    #: utilities raises a bare Exception when the map is not in the project
+    with patch(
+        "honeycomb.cache_pool._cache_cell",
+        side_effect=Exception("Map 'Terrain' not found in project."),
+    ):
+        cache_pool.cache_cells(
+            "Terrain",
+            "scheme",
+            [make_cell("a", []), make_cell("b", [])],
+            2,
+            on_complete,
+        )
+
+    assert {call[0][0].name for call in on_complete.call_args_list} == {"a", "b"}
+    assert all(
+        "not found in project" in call[0][1] for call in on_complete.call_args_list
+    )
+
+
+def test_get_parallel_processing_factor():
+    assert cache_pool.get_parallel_processing_factor(1) == "90%"
+    assert cache_pool.get_parallel_processing_factor(4) == "22%"
+    assert cache_pool.get_parallel_processing_factor(200) == "1%"
+
+
+@patch("honeycomb.cache_pool.Finalize")
+@patch("honeycomb.cache_pool.utilities.ProMapCache")
+def test_start_worker_splits_the_cores(pro_map_cache_mock, finalize_mock):
+    with patch.object(cache_pool.arcpy.env, "parallelProcessingFactor", "90%"):
+        cache_pool._start_worker(3)
+
+        finalize_mock.assert_called_once_with(
+            None, pro_map_cache_mock.return_value.remove_copies, exitpriority=10
+        )
+
+        assert cache_pool.arcpy.env.parallelProcessingFactor == "30%"
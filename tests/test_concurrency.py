@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+test_concurrency.py
+
+A module that contains tests for concurrency.py
+"""
+
+import asyncio
+
+from honeycomb.concurrency import AdaptiveConcurrency
+
+
+def run_window(limiter, latency, errors=0):
+    async def run():
+        for _ in range(errors):
+            limiter.record_retryable_error(Exception("503"))
+        for _ in range(max(limiter.limit, 20)):
+            await limiter.acquire()
+            await limiter.release(latency)
+
+    asyncio.run(run())
+
+
+def test_initial_is_clamped():
+    assert AdaptiveConcurrency(8, 150, 200).limit == 150
+    assert AdaptiveConcurrency(8, 150, 2).limit == 8
+
+
+def test_increases_when_healthy():
+    limiter = AdaptiveConcurrency(8, 150, 75)
+
+    run_window(limiter, 0.1)
+    run_window(limiter, 0.1)
+
+    assert limiter.limit == 77
+
+
+def test_backs_off_on_retryable_errors():
+    limiter = AdaptiveConcurrency(8, 150, 75)
+
+    run_window(limiter, 0.1, errors=5)
+
+    assert limiter.limit == 52
+
+
+def test_backs_off_when_latency_climbs():
+    limiter = AdaptiveConcurrency(8, 150, 20)
+
+    run_window(limiter, 0.1)
+    run_window(limiter, 0.5)
+
+    assert limiter.limit == 14
+
+
+def test_never_goes_below_minimum():
+    limiter = AdaptiveConcurrency(8, 150, 10)
+
+    run_window(limiter, 0.1, errors=20)
+
+    assert limiter.limit == 8
+
+
+def test_skipped_tiles_do_not_count():
+    limiter = AdaptiveConcurrency(8, 150, 20)
+
+    async def run():
+        for _ in range(100):
+            await limiter.acquire()
+            await limiter.release()
+
+    asyncio.run(run())
+
+    assert limiter.limit == 20
+    assert limiter.in_flight == 0
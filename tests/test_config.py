@@ -7,6 +7,7 @@ A module that contains tests for config.py
 
 import arcpy
 import pytest
+from google.auth.credentials import AnonymousCredentials
 from mock import patch
 
 from honeycomb import config
@@ -103,7 +104,9 @@ def test_get_storage_client_configures_retry_strategy(
     # Mock the storage client
     mock_client_instance = mock_storage_client.return_value
     mock_client_instance._http.mount = lambda protocol, adapter: None
-    mock_client_instance._http._auth_request.session.mount = lambda protocol, adapter: None
+    mock_client_instance._http._auth_request.session.mount = lambda protocol, adapter: (
+        None
+    )
 
     # Call get_storage_client
     config.get_storage_client()
@@ -120,7 +123,8 @@ def test_get_storage_client_configures_retry_strategy(
     assert isinstance(retry_strategy, Retry)
     assert retry_strategy.total == 5
     assert retry_strategy.backoff_factor == 1
-    assert retry_strategy.status_forcelist == [500, 502, 503, 504]
+    #: 5xx responses are retried by the google Retry of each request
+    assert not retry_strategy.status_forcelist
     assert retry_strategy.raise_on_status is False
 
     # Verify the client is stored globally
@@ -128,3 +132,28 @@ def test_get_storage_client_configures_retry_strategy(
 
     # Reset for next test
     config.storage_client = None
+
+
+@patch("honeycomb.config.storage.Client")
+def test_get_storage_client_uses_gcs_endpoint(mock_storage_client):
+    config.storage_client = None
+    config.set_config_prop("gcsEndpoint", "http://localhost:4443")
+
+    config.get_storage_client()
+
+    _, kwargs = mock_storage_client.call_args
+    assert kwargs["client_options"] == {"api_endpoint": "http://localhost:4443"}
+    assert isinstance(kwargs["credentials"], AnonymousCredentials)
+    mounted = [
+        call[0][0]
+        for call in mock_storage_client.return_value._http.mount.call_args_list
+    ]
+    assert mounted == ["https://", "http://"]
+
+    config.storage_client = None
+
+
+def test_get_upload_concurrency_fills_in_defaults():
+    config.set_config_prop("uploadConcurrency", {"max": 40})
+
+    assert config.get_upload_concurrency() == {"initial": 75, "max": 40, "min": 8}
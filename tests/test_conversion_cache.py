@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+test_conversion_cache.py
+
+A module that contains tests for conversion_cache.py
+"""
+
+from honeycomb.conversion_cache import ENTRY_OVERHEAD, ConversionCache
+
+
+def get_encoded(size):
+    return (b"x" * size, "image/jpeg", "abc==", True, {}, False)
+
+
+def test_get_counts_hits_and_seconds_saved():
+    cache = ConversionCache(10000)
+    key = cache.get_key(b"png")
+
+    assert cache.get(key) is None
+    cache.put(key, get_encoded(10), 0.5)
+    assert cache.get(key) == (get_encoded(10), 0.5)
+    cache.get(key)
+
+    assert cache.hits == 2
+    assert cache.misses == 1
+    assert cache.seconds_saved == 1.0
+    assert cache.get_hit_rate() == 0.667
+
+
+def test_put_evicts_least_recently_used():
+    cache = ConversionCache(2 * (100 + ENTRY_OVERHEAD))
+    cache.put("a", get_encoded(100), 0.1)
+    cache.put("b", get_encoded(100), 0.1)
+    cache.get("a")
+    cache.put("c", get_encoded(100), 0.1)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.size == 2 * (100 + ENTRY_OVERHEAD)
+
+
+def test_put_ignores_tiles_larger_than_the_cache():
+    cache = ConversionCache(100)
+    cache.put("a", get_encoded(1000), 0.1)
+
+    assert cache.size == 0
+    assert cache.get("a") is None
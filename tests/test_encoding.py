@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+test_encoding.py
+
+A module that contains tests for encoding.py
+"""
+
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+from honeycomb import encoding
+
+from . import conftest
+
+
+def write_png(file_name, mode, color):
+    folder = Path(conftest.temp_folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    file_path = folder / file_name
+    Image.new(mode, (256, 256), color).save(file_path, "PNG")
+
+    return file_path
+
+
+def test_encode_tile_converts_png_to_jpg():
+    file_path = write_png("C00000004.png", "RGBA", (0, 0, 0, 0))
+
+    data, content_type, checksum, converted, timings, blank, source_size = (
+        encoding.encode_tile(file_path, "jpeg")
+    )
+
+    assert content_type == "image/jpeg"
+    assert converted
+    assert checksum == encoding.get_checksum(data)
+    image = Image.open(BytesIO(data))
+    assert image.format == "JPEG"
+    #: transparent pixels are composited onto white
+    assert image.getpixel((0, 0)) == (255, 255, 255)
+    assert file_path.exists()
+    assert list(timings) == ["read", "convert", "checksum"]
+    assert not blank
+    assert source_size == file_path.stat().st_size
+
+
+def test_encode_tile_passes_png_through():
+    file_path = write_png("C00000004.png", "RGB", (255, 255, 255))
+
+    data, content_type, _, converted, timings, *_ = encoding.encode_tile(
+        file_path, "png"
+    )
+
+    assert content_type == "image/png"
+    assert not converted
+    assert data == file_path.read_bytes()
+    assert "convert" not in timings
+
+
+def test_stage_tile_writes_converted_tiles():
+    file_path = write_png("C00000004.png", "RGBA", (0, 0, 0, 0))
+    staging_path = Path(conftest.temp_folder) / "5_4_10"
+
+    upload_path, size, encoded = encoding.stage_tile(file_path, "jpeg", staging_path)
+
+    assert upload_path == str(staging_path)
+    assert encoded.content_type == "image/jpeg"
+    assert encoded.converted
+    #: the encoded bytes are not sent back from the worker process
+    assert encoded.data == b""
+    assert encoding.get_checksum(staging_path.read_bytes()) == encoded.checksum
+    assert size == staging_path.stat().st_size
+
+    staging_path.unlink()
+    upload_path, *_ = encoding.stage_tile(
+        file_path, "jpeg", staging_path, None, encoded.checksum
+    )
+
+    #: tiles that are going to be skipped are not written
+    assert not staging_path.exists()
+
+
+def test_stage_tile_uploads_unchanged_tiles_from_the_tile_file():
+    file_path = write_png("C00000004.png", "RGB", (255, 255, 255))
+
+    upload_path, *_ = encoding.stage_tile(
+        file_path, "png", Path(conftest.temp_folder) / "staged"
+    )
+
+    assert upload_path == str(file_path)
+
+
+def test_is_blank():
+    transparent = write_png("transparent.png", "RGBA", (10, 20, 30, 0))
+    white = write_png("white.png", "RGB", (255, 255, 255))
+    water = write_png("water.png", "RGB", (0, 0, 255))
+    image = Image.new("RGBA", (256, 256), (0, 0, 0, 0))
+    image.putpixel((10, 10), (0, 0, 0, 255))
+    line_work = Path(conftest.temp_folder) / "line_work.png"
+    image.save(line_work, "PNG")
+
+    assert encoding.is_blank(transparent.read_bytes())
+    assert encoding.is_blank(white.read_bytes())
+    assert not encoding.is_blank(water.read_bytes())
+    assert not encoding.is_blank(line_work.read_bytes())
+    assert encoding.get_checksum(white.read_bytes()) in encoding._blank_checksums
+
+
+def test_encode_tile_does_not_convert_blank_tiles():
+    file_path = write_png("C00000004.png", "RGBA", (0, 0, 0, 0))
+
+    data, content_type, _, converted, timings, blank, _ = encoding.encode_tile(
+        file_path, "jpeg", detect_blank=True
+    )
+
+    assert blank
+    assert not converted
+    assert content_type == "image/png"
+    assert data == file_path.read_bytes()
+    assert "blank" in timings
+
+
+def write_noisy_png(file_name):
+    #: a tile with plenty of colors so that the encoders have something to compress
+    folder = Path(conftest.temp_folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    file_path = folder / file_name
+    image = Image.new("RGBA", (256, 256))
+    image.putdata(
+        [
+            ((x * 7) % 256, (y * 3) % 256, (x * y) % 256, 255)
+            for y in range(256)
+            for x in range(256)
+        ]
+    )
+    image.save(file_path, "PNG")
+
+    return file_path
+
+
+def test_encode_tile_converts_png_to_webp():
+    file_path = write_noisy_png("C00000004.png")
+
+    for image_type in ["webp", "webp-lossless"]:
+        encoded = encoding.encode_tile(file_path, image_type)
+
+        assert encoded.content_type == "image/webp"
+        assert encoded.converted
+        assert Image.open(BytesIO(encoded.data)).format == "WEBP"
+
+    lossless = Image.open(
+        BytesIO(encoding.encode_tile(file_path, "webp-lossless").data)
+    )
+    assert lossless.convert("RGBA").tobytes() == Image.open(file_path).tobytes()
+
+
+def test_encode_tile_quantizes_png8():
+    file_path = write_noisy_png("C00000004.png")
+
+    encoded = encoding.encode_tile(file_path, "PNG8")
+
+    assert encoded.content_type == "image/png"
+    assert encoded.converted
+    assert Image.open(BytesIO(encoded.data)).mode == "P"
+
+
+def test_optimize_png_never_grows_tiles():
+    data = write_noisy_png("C00000004.png").read_bytes()
+
+    optimized = encoding.optimize_png(data)
+
+    assert len(optimized) <= len(data)
+    assert (
+        Image.open(BytesIO(optimized)).tobytes() == Image.open(BytesIO(data)).tobytes()
+    )
+
+
+def test_get_encoder():
+    assert encoding.get_encoder("jpeg") == (encoding.convert_png_to_jpg, "image/jpeg")
+    assert encoding.get_encoder("png") is None
+    assert encoding.get_encoder(None) is None
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+test_fake_gcs.py
+
+A module that contains tests for fake_gcs.py
+"""
+
+import pytest
+from google.api_core.exceptions import NotFound, RetryError, ServiceUnavailable
+from google.api_core.retry import Retry
+
+from honeycomb import config, encoding, fake_gcs, swarm
+
+
+@pytest.fixture
+def server():
+    with fake_gcs.FakeStorageServer() as fake_server:
+        yield fake_server
+
+
+def test_upload_and_download(server):
+    bucket = config.create_storage_client(server.endpoint).bucket("bucket")
+    blob = bucket.blob("Terrain/5/4/10")
+    blob.cache_control = "no-cache"
+
+    blob.upload_from_string(b"tile", content_type="image/png")
+
+    assert blob.size == 4
+    assert blob.crc32c == encoding.get_checksum(b"tile")
+    assert blob.generation == 1
+    fake_object = server.get_objects("bucket")["Terrain/5/4/10"]
+    assert fake_object.content_type == "image/png"
+    assert fake_object.cache_control == "no-cache"
+    assert bucket.get_blob("Terrain/5/4/10").download_as_bytes() == b"tile"
+    assert bucket.get_blob("Terrain/5/4/11") is None
+
+
+def test_list_pages_and_prefixes(server):
+    client = config.create_storage_client(server.endpoint)
+    bucket = client.bucket("bucket")
+    for name in ["Terrain/5/4/10", "Terrain/5/4/11", "Terrain/6/8/20", "Lite/5/4/10"]:
+        bucket.blob(name).upload_from_string(b"tile")
+
+    blobs = client.list_blobs("bucket", prefix="Terrain/", page_size=1)
+
+    assert [blob.name for blob in blobs] == [
+        "Terrain/5/4/10",
+        "Terrain/5/4/11",
+        "Terrain/6/8/20",
+    ]
+
+    blobs = client.list_blobs("bucket", prefix="Terrain/", delimiter="/")
+    list(blobs)
+
+    assert blobs.prefixes == {"Terrain/5/", "Terrain/6/"}
+
+
+def test_batch_delete(server):
+    client = config.create_storage_client(server.endpoint)
+    bucket = client.bucket("bucket")
+    for name in ["a", "b", "c"]:
+        bucket.blob(name).upload_from_string(b"tile")
+
+    with client.batch():
+        bucket.delete_blob("a")
+        bucket.delete_blob("b")
+
+    assert list(server.get_objects("bucket")) == ["c"]
+    assert server.requests["batch"] == 1
+
+    with pytest.raises(NotFound):
+        bucket.delete_blob("a")
+
+
+def test_injected_errors():
+    with fake_gcs.FakeStorageServer(error_rate=1) as server:
+        client = config.create_storage_client(server.endpoint)
+
+        with pytest.raises(ServiceUnavailable):
+            client.bucket("bucket").blob("a").upload_from_string(b"tile", retry=None)
+
+    assert server.injected_errors > 0
+    assert server.get_objects("bucket") == {}
+
+
+def test_injected_errors_reach_the_upload_retry():
+    errors = []
+    with fake_gcs.FakeStorageServer(error_rate=1) as server:
+        client = config.create_storage_client(server.endpoint)
+
+        with pytest.raises(RetryError):
+            client.bucket("bucket").blob("a").upload_from_string(
+                b"tile",
+                retry=Retry(
+                    predicate=swarm._is_retryable_error,
+                    initial=0.01,
+                    maximum=0.01,
+                    timeout=0.2,
+                    on_error=errors.append,
+                ),
+            )
+
+    #: the 503s are retried by the retry of the upload (and so reach the upload concurrency limiter) rather
+    #: than the http adapter
+    assert len(errors) > 1
+    assert {error.response.status_code for error in errors} == {503}
+
+
+def test_injected_errors_are_repeatable():
+    def get_failures():
+        with fake_gcs.FakeStorageServer(error_rate=0.5, seed=1) as server:
+            return [server.should_fail() for _ in range(20)]
+
+    assert get_failures() == get_failures()
+    assert 0 < sum(get_failures()) < 20
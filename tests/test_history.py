@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+test_history.py
+
+A module that contains tests for history.py
+"""
+
+from pathlib import Path
+
+from honeycomb.history import CacheHistory, EtaModel, PlannedAoi, get_label
+
+from . import conftest
+
+
+def make_history():
+    return CacheHistory(Path(conftest.temp_folder) / "cache_history" / "Terrain.jsonl")
+
+
+def test_cache_history_keeps_the_most_recent_duration():
+    history = make_history()
+
+    assert history.read() == []
+    assert history.get_durations() == {}
+
+    history.record("grid: OBJECTID: 1", (18,), 100, 2)
+    history.record("grid: OBJECTID: 1", (18,), 60, 2)
+    history.record("grid: OBJECTID: 2", (19,), 30, 1)
+    history.record("CacheExtent_0_7", (0, 1, 2, 3, 4, 5, 6, 7), 500, None)
+
+    assert len(history.read()) == 4
+    assert history.get_durations() == {
+        ("grid: OBJECTID: 1", (18,)): 60,
+        ("grid: OBJECTID: 2", (19,)): 30,
+        ("CacheExtent_0_7", (0, 1, 2, 3, 4, 5, 6, 7)): 500,
+    }
+    #: (100 + 60) / (2 + 2) at level 18
+    assert history.get_level_rates() == {18: 40, 19: 30}
+
+
+def test_get_label():
+    assert get_label((18,)) == "Level 18"
+    assert get_label((0, 1, 2, 3, 4, 5, 6, 7)) == "Levels 0-7"
+
+
+def test_eta_model_estimate():
+    history = make_history()
+    history.record("grid: OBJECTID: 1", (18,), 100, 4)
+    model = EtaModel(history)
+
+    #: the last duration of the same area of interest
+    assert model.estimate(PlannedAoi("grid: OBJECTID: 1", "key", (18,), 1)) == 100
+    #: the seconds per bundle of the level
+    assert model.estimate(PlannedAoi("grid: OBJECTID: 2", "key", (18,), 2)) == 50
+    #: nothing is known about level 19 yet
+    assert model.estimate(PlannedAoi("grid: OBJECTID: 3", "key", (19,), 2)) is None
+
+    model.add(PlannedAoi("grid: OBJECTID: 4", "key", (19,), 2), 10)
+    model.add(PlannedAoi("grid: OBJECTID: 5", "key", (19,), 2), 20)
+
+    #: the mean of the level in this job
+    assert model.estimate(PlannedAoi("grid: OBJECTID: 3", "key", (19,), 2)) == 15
+
+
+def test_eta_model_get_remaining():
+    history = make_history()
+    history.record("a", (18,), 100, 1)
+    history.record("b", (18,), 300, 1)
+    history.record("c", (0, 1), 50, None)
+    model = EtaModel(history)
+
+    pending = [
+        PlannedAoi("a", "a-key", (18,), 1, 2),
+        PlannedAoi("b", "b-key", (18,), 1, 2),
+        PlannedAoi("c", "c-key", (0, 1), None),
+        PlannedAoi("d", "d-key", (19,), 1),
+    ]
+
+    assert model.get_remaining(pending) == [
+        ("Levels 0-1", 1, 50),
+        #: split across two processes
+        ("Level 18", 2, 200),
+        ("Level 19", 1, None),
+    ]
+
+
+def test_eta_model_estimates_the_same_cell_at_each_level():
+    history = make_history()
+    history.record("grid: OBJECTID: 1", (18,), 600, 1)
+    history.record("grid: OBJECTID: 1", (19,), 2400, 1)
+    model = EtaModel(history)
+
+    assert model.estimate(PlannedAoi("grid: OBJECTID: 1", "key", (18,), 1)) == 600
+    assert model.estimate(PlannedAoi("grid: OBJECTID: 1", "key", (19,), 1)) == 2400
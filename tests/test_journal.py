@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+test_journal.py
+
+A module that contains tests for journal.py
+"""
+
+from pathlib import Path
+
+from honeycomb.journal import FailedTileJournal
+from honeycomb.swarm import Tile
+
+from . import conftest
+
+
+def test_journal_records_failed_tiles():
+    journal = FailedTileJournal(
+        Path(conftest.temp_folder) / "journals" / "Terrain.jsonl"
+    )
+
+    assert journal.read() == []
+
+    exploded_tile = Tile("5", "10", "4", Path("C00000004.png"))
+    bundle_tile = Tile("5", "10", "5", Path("R0000C0000.bundle"), b"data")
+    journal.record("Terrain", exploded_tile, "upload", TimeoutError("slow"))
+    journal.record("Terrain", bundle_tile, "convert", ValueError())
+
+    first, second = journal.read()
+    assert (first["level"], first["row"], first["column"]) == ("5", "10", "4")
+    assert first["stage"] == "upload"
+    assert first["error"] == "TimeoutError"
+    assert first["message"] == "slow"
+    assert not first["from_bundle"]
+    assert second["from_bundle"]
+    assert second["error"] == "ValueError"
+
+    journal.clear()
+
+    assert journal.read() == []
+    journal.clear()
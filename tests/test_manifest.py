@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+test_manifest.py
+
+A module that contains tests for manifest.py
+"""
+
+from mock import Mock, patch
+
+from honeycomb import manifest
+
+
+def test_record_tiles_and_get_tiles():
+    manifest.record_tiles(
+        "bucket",
+        [
+            ("Terrain/5/4/10", "abc==", 10, 1),
+            ("Terrain/5/4/11", "def==", 10, 1),
+            ("Terrain/15/4/11", "ghi==", 10, 1),
+        ],
+    )
+    manifest.record_tiles("bucket", [("Terrain/5/4/10", "xyz==", 12, 2)])
+    manifest.record_tiles("other-bucket", [("Terrain/5/4/12", "abc==", 10, 1)])
+
+    assert manifest.get_tiles("bucket", "Terrain/5/") == {
+        "Terrain/5/4/10": "xyz==",
+        "Terrain/5/4/11": "def==",
+    }
+
+
+@patch("honeycomb.manifest.config.get_storage_client")
+def test_reconcile_replaces_prefix(client_mock):
+    manifest.record_tiles(
+        "bucket",
+        [("Terrain/5/4/10", "stale==", 10, 1), ("Terrain/6/4/10", "keep==", 10, 1)],
+    )
+    blob = Mock(crc32c="abc==", size=10, generation=2)
+    blob.name = "Terrain/5/4/11"
+    client_mock.return_value.list_blobs.return_value = [blob]
+
+    assert manifest.reconcile("bucket", "Terrain/5/") == 1
+    assert manifest.get_tiles("bucket", "Terrain/") == {
+        "Terrain/5/4/11": "abc==",
+        "Terrain/6/4/10": "keep==",
+    }
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+test_metrics.py
+
+A module that contains tests for metrics.py
+"""
+
+from pytest import approx
+
+from honeycomb.metrics import Histogram
+
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+    for milliseconds in range(1, 101):
+        histogram.record(milliseconds / 1000)
+
+    assert histogram.count == 100
+    assert histogram.percentile(50) == approx(0.050, rel=0.1)
+    assert histogram.percentile(90) == approx(0.090, rel=0.1)
+    assert histogram.percentile(99) == approx(0.099, rel=0.1)
+    assert histogram.percentile(100) == 0.1
+
+
+def test_histogram_to_dict_and_str():
+    histogram = Histogram()
+
+    assert str(histogram) == "n/a"
+
+    histogram.record(0)
+    histogram.record(0.25)
+
+    assert histogram.to_dict()["count"] == 2
+    assert histogram.to_dict()["max_ms"] == 250.0
+    assert str(histogram).endswith("(n=2)")
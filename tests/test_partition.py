@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+test_partition.py
+
+A module that contains tests for partition.py
+"""
+
+from collections import Counter
+
+from mock import MagicMock, Mock, patch
+
+from honeycomb import partition, settings
+from honeycomb.partition import Cell, PartitionAoi
+
+
+def make_grid(costs, size=10):
+    """
+    costs: rows of cell costs where None is a missing cell
+    returns a list of Cells with oids numbered in row-major order from 1
+    """
+    cells = []
+    oid = 0
+    for row, row_costs in enumerate(costs):
+        for column, cost in enumerate(row_costs):
+            oid += 1
+            if cost is None:
+                continue
+            xmin = column * size
+            ymax = -row * size
+            cells.append(Cell(oid, (xmin, ymax - size, xmin + size, ymax), cost))
+
+    return cells
+
+
+def test_partition_cells_merges_sparse_blocks():
+    cells = make_grid(
+        [
+            [0, 0, 0, 10],
+            [0, 0, 0, 10],
+            [0, 0, 10, 10],
+        ]
+    )
+
+    aois = partition.partition_cells(cells, target_cost=10)
+
+    assert aois == [
+        PartitionAoi((1, 2, 3, 5, 6, 7, 9, 10, 11), 0, 1, 10),
+        PartitionAoi((4,), 0, 1, 10),
+        PartitionAoi((8,), 0, 1, 10),
+        PartitionAoi((12,), 0, 1, 10),
+    ]
+
+
+def test_partition_cells_limits_merged_blocks():
+    cells = make_grid([[0] * 6])
+
+    aois = partition.partition_cells(cells, target_cost=10)
+
+    assert [aoi.oids for aoi in aois] == [(1, 2, 3, 4), (5, 6)]
+
+
+def test_partition_cells_splits_dense_cells():
+    cells = make_grid([[1, 40, 1000]])
+
+    aois = partition.partition_cells(cells, target_cost=10)
+
+    assert aois[0] == PartitionAoi((1,), 0, 1, 1)
+    assert aois[1:5] == [PartitionAoi((2,), part, 4, 10) for part in range(4)]
+    #: split into at most MAX_SPLITS along each side
+    assert len(aois[5:]) == 16
+    assert {aoi.oids for aoi in aois[5:]} == {(3,)}
+
+
+def test_partition_cells_does_not_merge_around_missing_cells():
+    cells = make_grid(
+        [
+            [0, None],
+            [0, 0],
+        ]
+    )
+
+    aois = partition.partition_cells(cells, target_cost=10)
+
+    assert [aoi.oids for aoi in aois] == [(1, 3), (4,)]
+
+
+def test_partition_cells_uses_clipped_cells_grid_positions():
+    cells = make_grid([[0, 0, 0]])
+    #: the first cell is clipped on its left side
+    cells[0] = cells[0]._replace(extent=(6, -10, 10, 0))
+
+    indexes = partition._get_grid_indexes(cells)
+
+    assert indexes[2] == (indexes[1][0], indexes[1][1] + 1)
+    assert indexes[3] == (indexes[1][0], indexes[1][1] + 2)
+
+
+def test_partition_cells_leaves_cells_without_costs():
+    cells = make_grid([[0, 0], [0, 0]])
+
+    aois = partition.partition_cells(cells)
+
+    assert [aoi.oids for aoi in aois] == [(1,), (2,), (3,), (4,)]
+
+
+def test_get_aoi_name():
+    assert (
+        partition.get_aoi_name("grid", PartitionAoi((5,), 0, 1, 0))
+        == "grid: OBJECTID: 5"
+    )
+    assert (
+        partition.get_aoi_name("grid", PartitionAoi((5, 6), 0, 1, 0))
+        == "grid: OBJECTIDS: 5, 6"
+    )
+    assert (
+        partition.get_aoi_name("grid", PartitionAoi((5,), 2, 4, 0))
+        == "grid: OBJECTID: 5 (3 of 4)"
+    )
+
+
+def test_build_geometry():
+    first = MagicMock()
+    second = Mock()
+    shapes = {1: first, 2: second}
+
+    assert (
+        partition.build_geometry(PartitionAoi((1, 2), 0, 1, 0), shapes)
+        == first.union.return_value
+    )
+    first.union.assert_called_once_with(second)
+
+    first.extent = Mock(XMin=0, YMin=0, XMax=20, YMax=20)
+    with patch.object(partition.arcpy, "Extent") as extent_mock:
+        partition.build_geometry(PartitionAoi((1,), 3, 4, 0), shapes)
+
+    #: the bottom right quarter
+    extent_mock.assert_called_once_with(10, 0, 20, 10)
+    first.clip.assert_called_once_with(extent_mock.return_value)
+
+
+def make_shape(xmin, ymin, xmax, ymax):
+    shape = MagicMock()
+    shape.extent = Mock(XMin=xmin, YMin=ymin, XMax=xmax, YMax=ymax)
+
+    return shape
+
+
+@patch("honeycomb.partition.resumable.save_grid_partition")
+@patch("honeycomb.partition.resumable.get_grid_partition", return_value=None)
+@patch("honeycomb.partition.get_feature_counts")
+@patch("honeycomb.partition.arcpy.da.SearchCursor")
+def test_get_grid_aois(
+    cursor_mock, counts_mock, get_partition_mock, save_partition_mock
+):
+    shapes = [
+        make_shape(0, 0, 10, 10),
+        make_shape(10, 0, 20, 10),
+        make_shape(20, 0, 30, 10),
+    ]
+    cursor_mock.return_value.__enter__.return_value = [
+        (shape, oid) for oid, shape in enumerate(shapes, start=1)
+    ]
+    counts_mock.return_value = Counter({1: 1, 2: 1, 3: 4})
+
+    aois = partition.get_grid_aois("Terrain", "grid", settings.SCALES[18])
+
+    assert [name for name, _ in aois] == ["grid: OBJECTIDS: 1, 2", "grid: OBJECTID: 3"]
+    assert aois[0][1] == shapes[0].union.return_value
+    save_partition_mock.assert_called_once_with(
+        f"grid-{settings.SCALES[18]}", [[(1, 2), 0, 1, 2], [(3,), 0, 1, 4]]
+    )
+
+
+@patch("honeycomb.partition.resumable.get_grid_partition")
+@patch("honeycomb.partition.get_feature_counts")
+@patch("honeycomb.partition.arcpy.da.SearchCursor")
+def test_get_grid_aois_uses_the_recorded_partition(
+    cursor_mock, counts_mock, get_partition_mock
+):
+    shapes = [make_shape(0, 0, 10, 10), make_shape(10, 0, 20, 10)]
+    cursor_mock.return_value.__enter__.return_value = [
+        (shape, oid) for oid, shape in enumerate(shapes, start=1)
+    ]
+    get_partition_mock.return_value = [[[1], 0, 1, 0], [[2], 0, 1, 0]]
+
+    aois = partition.get_grid_aois("Terrain", "grid", settings.SCALES[18])
+
+    assert [name for name, _ in aois] == ["grid: OBJECTID: 1", "grid: OBJECTID: 2"]
+    counts_mock.assert_not_called()
+
+
+def test_get_feature_counts_skips_hidden_layers():
+    layers = [
+        Mock(isFeatureLayer=True, visible=True, minThreshold=0, maxThreshold=0),
+        Mock(isFeatureLayer=True, visible=False, minThreshold=0, maxThreshold=0),
+        #: only visible at smaller scales
+        Mock(isFeatureLayer=True, visible=True, minThreshold=100000, maxThreshold=5000),
+        Mock(isFeatureLayer=False, visible=True, minThreshold=0, maxThreshold=0),
+    ]
+    pro_map = Mock()
+    pro_map.listLayers.return_value = layers
+    cursor = MagicMock()
+    cursor.__enter__.return_value = [(1, 2), (2, 0)]
+
+    with (
+        patch("honeycomb.partition.utilities.get_pro_map", return_value=pro_map),
+        patch(
+            "honeycomb.partition.arcpy.analysis.SpatialJoin", create=True
+        ) as join_mock,
+        patch("honeycomb.partition.arcpy.da.SearchCursor", return_value=cursor),
+    ):
+        counts = partition.get_feature_counts("Terrain", "grid", 1128)
+
+    assert counts == Counter({1: 2, 2: 0})
+    assert join_mock.call_count == 1
+    assert join_mock.call_args[0][1] is layers[0]
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+test_plan.py
+
+A module that contains tests for plan.py
+"""
+
+import json
+import shutil
+from os.path import join
+from pathlib import Path
+
+from mock import Mock, patch
+
+from honeycomb import encoding, plan, settings, stats
+
+from . import conftest
+
+
+def get_blob(name, crc32c, size=10):
+    blob = Mock(crc32c=crc32c, size=size)
+    blob.name = name
+
+    return blob
+
+
+@patch("honeycomb.plan.manifest.list_bucket")
+def test_plan(list_bucket_mock):
+    exploded = Path(conftest.temp_folder) / "Terrain_Exploded" / "_alllayers"
+    shutil.copytree(
+        join(conftest.test_data_folder, "JPG_Service", "Layers", "_alllayers", "L05"),
+        exploded / "L05",
+    )
+    same_tile = exploded / "L05" / "R0000000a" / "C00000004.jpg"
+    list_bucket_mock.return_value = [
+        get_blob("Terrain/5/4/10", encoding.get_checksum(same_tile.read_bytes())),
+        get_blob("Terrain/5/5/10", "different=="),
+        get_blob("Terrain/5/99/99", "orphan==", 25),
+    ]
+
+    with patch.object(settings, "CACHES_DIR", conftest.temp_folder):
+        [(level, level_plan)] = plan.plan("Terrain", "bucket", "jpeg")
+
+    assert level == "5"
+    assert level_plan["create"] == 14
+    assert level_plan["update"] == 1
+    assert level_plan["skip"] == 1
+    assert level_plan["skip_bytes"] == same_tile.stat().st_size
+    assert level_plan["orphan"] == 1
+    assert level_plan["orphan_bytes"] == 25
+    list_bucket_mock.assert_called_once_with("bucket", "Terrain/5/")
+    assert len(list(exploded.glob("**/*.jpg"))) == 16
+
+
+@patch("honeycomb.plan.swarm.get_published_version", return_value="20240102030405")
+@patch("honeycomb.plan.config.get_storage_client")
+@patch("honeycomb.plan.manifest.list_bucket")
+def test_plan_compares_versions_with_the_published_version(
+    list_bucket_mock, client_mock, version_mock
+):
+    exploded = Path(conftest.temp_folder) / "Terrain_Exploded" / "_alllayers"
+    shutil.copytree(
+        join(conftest.test_data_folder, "JPG_Service", "Layers", "_alllayers", "L05"),
+        exploded / "L05",
+    )
+    same_tile = exploded / "L05" / "R0000000a" / "C00000004.jpg"
+    list_bucket_mock.return_value = [
+        get_blob(
+            "Terrain/versions/20240102030405/5/4/10",
+            encoding.get_checksum(same_tile.read_bytes()),
+        ),
+    ]
+
+    with patch.object(settings, "CACHES_DIR", conftest.temp_folder):
+        [(_, level_plan)] = plan.plan(
+            "Terrain", "bucket", "jpeg", publish_versions=True
+        )
+
+    assert level_plan["create"] == 15
+    assert level_plan["skip"] == 1
+    list_bucket_mock.assert_called_once_with(
+        "bucket", "Terrain/versions/20240102030405/5/"
+    )
+
+
+@patch("honeycomb.plan.swarm.get_published_version", return_value=None)
+@patch("honeycomb.plan.config.get_storage_client")
+def test_get_prefix(client_mock, version_mock):
+    assert plan.get_prefix("Terrain", "bucket") == "Terrain"
+    client_mock.assert_not_called()
+
+    #: nothing has been published yet
+    assert plan.get_prefix("Terrain", "bucket", publish_versions=True) == "Terrain"
+
+
+def test_estimate_seconds():
+    stats_file = Path(conftest.temp_folder) / "stats.json"
+    stats_file.parent.mkdir(parents=True)
+    stats_file.write_text(json.dumps({"basemaps": {}}))
+
+    with patch.object(stats, "stats_file", stats_file):
+        assert plan.estimate_seconds("Terrain", 100, 100) is None
+
+        stats.record_upload_throughput("Terrain", 100, 1000, 10)
+        stats.record_upload_throughput("Terrain", 300, 3000, 30)
+
+        #: 10 tiles/s and 100 bytes/s
+        assert plan.estimate_seconds("Terrain", 100, 500) == 10
+        assert plan.estimate_seconds("Terrain", 10, 5000) == 50
+
+
+def test_estimate_seconds_without_a_byte_rate():
+    with patch("honeycomb.plan.stats.get_upload_throughput", return_value=(10, 0)):
+        assert plan.estimate_seconds("Terrain", 100, 500) is None
+
+
+def test_estimate_seconds_ignores_runs_that_round_to_zero_seconds():
+    stats.record_upload_throughput("Terrain", 100, 1000, 0.01)
+
+    assert stats.get_basemap("Terrain")["upload"].get("throughput", []) == []
+    assert plan.estimate_seconds("Terrain", 100, 100) is None
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+test_resumable.py
+
+A module that contains tests for resumable.py
+"""
+
+from pathlib import Path
+
+from mock import patch
+
+from honeycomb import resumable
+
+from . import conftest
+
+
+def start_job():
+    Path(conftest.temp_folder).mkdir(parents=True, exist_ok=True)
+    resumable.start_new_job("Terrain", False, False, False, None, None)
+
+
+@patch.object(resumable, "file_path", Path(conftest.temp_folder) / "current_job.json")
+def test_upload_checkpoint_requires_a_job():
+    assert resumable.UploadCheckpoint.start("Terrain", "bucket", "Terrain") is None
+
+
+@patch.object(resumable, "file_path", Path(conftest.temp_folder) / "current_job.json")
+def test_upload_checkpoint_resumes_with_one_summary():
+    start_job()
+    checkpoint = resumable.UploadCheckpoint.start("Terrain", "bucket", "Terrain")
+    assert not checkpoint.resumed
+
+    checkpoint.complete_level("5", 4, {"created": 16, "errors": 0})
+    checkpoint.start_level("6", {"created": 3, "errors": 1})
+    checkpoint.complete_row("6", "20", {"created": 2, "errors": 1})
+    checkpoint.save()
+
+    #: the tile that is not in a completed row is walked again when the upload is resumed
+    assert resumable.get_current_job()["upload_progress"]["level_summaries"] == [
+        ["5", 4, {"created": 16, "errors": 0}],
+        ["6", 1, {"created": 2, "errors": 1}],
+    ]
+
+    #: a different bucket is a different upload
+    assert resumable.get_upload_progress("Terrain", "other") is None
+
+    resumed = resumable.UploadCheckpoint.start("Terrain", "bucket", "Terrain")
+    assert resumed.resumed
+    assert resumed.is_level_complete("5")
+    assert resumed.is_row_complete("6", "20")
+    assert not resumed.is_row_complete("6", "21")
+
+    resumed.start_level("6", {"created": 2, "errors": 0})
+    resumed.complete_level("6", 1, {"created": 2, "errors": 0})
+
+    assert resumed.get_level_summaries() == [
+        ("5", 4, {"created": 16, "errors": 0}),
+        ("6", 2, {"created": 4, "errors": 1}),
+    ]
+    #: the rows of completed levels are dropped
+    assert resumable.get_current_job()["upload_progress"]["completed_rows"] == []
+
+    resumed.finish()
+
+    assert resumable.get_upload_progress("Terrain", "bucket") is None
+
+
+@patch.object(resumable, "file_path", Path(conftest.temp_folder) / "current_job.json")
+def test_grid_partitions():
+    assert resumable.get_grid_partition("grid-1") is None
+    #: there is no job to record it in
+    resumable.save_grid_partition("grid-1", [[[1], 0, 1, 5]])
+
+    start_job()
+    resumable.save_grid_partition("grid-1", [[[1, 2], 0, 1, 5]])
+    resumable.save_grid_partition("grid-2", [[[3], 1, 4, 2]])
+
+    assert resumable.get_grid_partition("grid-1") == [[[1, 2], 0, 1, 5]]
+    assert resumable.get_grid_partition("grid-2") == [[[3], 1, 4, 2]]
+    assert resumable.get_grid_partition("grid-3") is None
@@ -6,15 +6,32 @@ test_swarm.py
 A module that contains tests for the swarm module
 """
 
+import json
 import shutil
+from base64 import b64encode
 from os import walk
 from os.path import exists, join
+from pathlib import Path
 
 import requests_mock
-from mock import patch
+from google.api_core.exceptions import NotFound, ServiceUnavailable
+from google.cloud.storage.exceptions import InvalidResponse
+from google_crc32c import Checksum
+from mock import ANY, Mock, patch
+from PIL import Image
 from pytest import raises
 
-from honeycomb import config, settings, swarm
+from honeycomb import (
+    aoi,
+    config,
+    encoding,
+    fake_gcs,
+    manifest,
+    resumable,
+    settings,
+    swarm,
+)
+from honeycomb.journal import FailedTileJournal
 
 from . import conftest
 
@@ -83,3 +100,1066 @@ def test_bust_discover_cache(mock):
 
     with raises(Exception):
         swarm.bust_discover_cache()
+
+
+@patch("honeycomb.swarm.manifest.reconcile")
+def test_get_known_tiles_uses_manifest(reconcile_mock):
+    manifest.record_tiles("bucket", [("Terrain/5/4/10", "abc==", 10, 1)])
+
+    assert swarm._get_known_tiles("bucket", "Terrain", "5", False) == {
+        "Terrain/5/4/10": "abc=="
+    }
+    reconcile_mock.assert_not_called()
+
+
+@patch("honeycomb.swarm.manifest.reconcile")
+def test_get_known_tiles_reconciles_empty_levels_and_verify_remote(reconcile_mock):
+    swarm._get_known_tiles("bucket", "Terrain", "6", False)
+
+    reconcile_mock.assert_called_once_with("bucket", "Terrain/6/")
+
+    manifest.record_tiles("bucket", [("Terrain/5/4/10", "abc==", 10, 1)])
+    swarm._get_known_tiles("bucket", "Terrain", "5", True)
+
+    reconcile_mock.assert_called_with("bucket", "Terrain/5/")
+
+
+def copy_exploded_levels(name, levels):
+    for level in levels:
+        shutil.copytree(
+            join(
+                conftest.test_data_folder, "JPG_Service", "Layers", "_alllayers", level
+            ),
+            join(conftest.temp_folder, f"{name}_Exploded", "_alllayers", level),
+        )
+
+    return Path(conftest.temp_folder) / f"{name}_Exploded" / "_alllayers"
+
+
+def get_checksum(file_path):
+    return b64encode(Checksum(file_path.read_bytes()).digest()).decode("utf-8")
+
+
+def test_upload_tile_uses_remote_tiles():
+    base_folder = copy_exploded_levels("Terrain", ["L05"])
+    row_folder = base_folder / "L05" / "R0000000a"
+    remote_tiles = {
+        "Terrain/5/4/10": get_checksum(row_folder / "C00000004.jpg"),
+        "Terrain/5/5/10": "different==",
+    }
+    bucket = Mock()
+    bucket.blob.return_value.size = 100
+    bucket.blob.return_value.generation = 1
+
+    results = [
+        swarm.upload_tile(
+            bucket,
+            "Terrain",
+            False,
+            remote_tiles,
+            swarm.Tile("5", "10", str(column), row_folder / file_name),
+            encoding.encode_tile(row_folder / file_name, "jpeg"),
+            Mock(),
+        )
+        for column, file_name in [
+            (4, "C00000004.jpg"),
+            (5, "C00000005.jpg"),
+            (6, "C00000006.jpg"),
+        ]
+    ]
+
+    assert results == [
+        ("skipped_same_crc", None),
+        ("updated", ("Terrain/5/5/10", ANY, 100, 1)),
+        ("created", ("Terrain/5/6/10", ANY, 100, 1)),
+    ]
+    bucket.blob.return_value.exists.assert_not_called()
+    bucket.blob.return_value.reload.assert_not_called()
+    assert bucket.blob.return_value.upload_from_string.call_count == 2
+    assert list(row_folder.iterdir()) == [row_folder / "C00000007.jpg"]
+
+
+def test_upload_tile_returns_errors():
+    bucket = Mock()
+    bucket.blob.return_value.upload_from_string.side_effect = Exception("boom")
+    base_folder = copy_exploded_levels("Terrain", ["L05"])
+    file_path = base_folder / "L05" / "R0000000a" / "C00000004.jpg"
+
+    assert swarm.upload_tile(
+        bucket,
+        "Terrain",
+        False,
+        {},
+        swarm.Tile("5", "10", "4", file_path),
+        encoding.encode_tile(file_path, "jpeg"),
+        Mock(),
+    ) == ("errors", None)
+    assert file_path.exists()
+
+
+@patch("honeycomb.swarm.send_email")
+@patch("honeycomb.swarm.bust_discover_cache")
+@patch("honeycomb.swarm._get_known_tiles")
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_swarm_uploads_all_levels(client_mock, known_tiles_mock, bust_mock, email_mock):
+    base_folder = copy_exploded_levels("Terrain", ["L05", "L06"])
+    known_tiles_mock.return_value = {
+        "Terrain/5/4/10": get_checksum(
+            base_folder / "L05" / "R0000000a" / "C00000004.jpg"
+        )
+    }
+    bucket = client_mock.return_value.bucket.return_value
+    bucket.blob.return_value.size = 100
+    bucket.blob.return_value.generation = 1
+
+    with (
+        patch.object(settings, "CACHES_DIR", conftest.temp_folder),
+        patch.object(config, "config_folder", conftest.temp_folder),
+        patch.object(
+            swarm, "_format_cache_job_summary", wraps=swarm._format_cache_job_summary
+        ) as summary_mock,
+    ):
+        swarm.swarm("Terrain", "bucket", "jpeg")
+
+    level_summaries = summary_mock.call_args[0][2]
+    assert [(level, rows) for level, rows, _ in level_summaries] == [("5", 4), ("6", 6)]
+    assert level_summaries[0][2]["skipped_same_crc"] == 1
+    assert level_summaries[0][2]["created"] == 15
+    assert level_summaries[1][2]["created"] == 36
+    assert bucket.blob.return_value.upload_from_string.call_count == 51
+    assert list((base_folder / "L05").iterdir()) == []
+    assert len(manifest.get_tiles("bucket", "Terrain/")) == 51
+    bust_mock.assert_called_once()
+
+    [metrics_file] = (Path(conftest.temp_folder) / "upload_metrics").iterdir()
+    job_metrics = json.loads(metrics_file.read_text())
+    assert [level["level"] for level in job_metrics["levels"]] == ["5", "6"]
+    assert job_metrics["levels"][0]["timings"]["upload"]["count"] == 15
+    assert job_metrics["levels"][0]["timings"]["checksum"]["count"] == 16
+    assert job_metrics["levels"][0]["bytes_uploaded"] > 0
+
+
+@patch("honeycomb.swarm.send_email")
+@patch("honeycomb.swarm.bust_discover_cache")
+@patch("honeycomb.swarm._get_known_tiles", return_value={})
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_swarm_reports_levels_that_fail_to_finish(
+    client_mock, known_tiles_mock, bust_mock, email_mock
+):
+    copy_exploded_levels("Terrain", ["L05", "L06"])
+    limiters = []
+    adaptive_concurrency = swarm.AdaptiveConcurrency
+
+    def make_limiter(*args):
+        limiters.append(adaptive_concurrency(*args))
+
+        return limiters[-1]
+
+    failed_stages = set()
+    original_record_stage_timing = swarm._record_stage_timing
+
+    def record_stage_timing(level_state, stage, stage_start):
+        #: fail the first tile of each stage after it has been taken off its queue
+        if stage not in failed_stages:
+            failed_stages.add(stage)
+
+            raise RuntimeError("boom")
+
+        original_record_stage_timing(level_state, stage, stage_start)
+
+    with (
+        patch.object(settings, "CACHES_DIR", conftest.temp_folder),
+        patch.object(config, "config_folder", conftest.temp_folder),
+        patch.object(swarm, "AdaptiveConcurrency", side_effect=make_limiter),
+        patch.object(swarm, "_record_stage_timing", side_effect=record_stage_timing),
+        patch.object(
+            swarm.manifest, "record_tiles", side_effect=[RuntimeError("boom"), None]
+        ),
+        patch.object(
+            swarm, "_format_cache_job_summary", wraps=swarm._format_cache_job_summary
+        ) as summary_mock,
+    ):
+        swarm.swarm("Terrain", "bucket", "jpeg")
+
+    #: both levels finished and are in the summary even though the first one failed part way
+    level_summaries = summary_mock.call_args[0][2]
+    assert [(level, rows) for level, rows, _ in level_summaries] == [("5", 4), ("6", 6)]
+    assert failed_stages == {"convert", "upload"}
+    assert limiters[0].in_flight == 0
+
+
+@patch("honeycomb.swarm.send_email")
+@patch("honeycomb.swarm.bust_discover_cache")
+@patch("honeycomb.swarm._get_known_tiles", return_value={})
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_swarm_uploads_from_bundles(
+    client_mock, known_tiles_mock, bust_mock, email_mock
+):
+    tile = (
+        Path(conftest.test_data_folder)
+        / "JPG_Service"
+        / "Layers"
+        / "_alllayers"
+        / "L05"
+        / "R0000000a"
+        / "C00000004.jpg"
+    ).read_bytes()
+    bundle_path = join(
+        conftest.temp_folder,
+        "Terrain",
+        "Terrain",
+        "_alllayers",
+        "L05",
+        "R0000C0000.bundle",
+    )
+    conftest.write_bundle(bundle_path, {(10, 4): tile, (10, 5): tile})
+    bucket = client_mock.return_value.bucket.return_value
+
+    with (
+        patch.object(settings, "CACHES_DIR", conftest.temp_folder),
+        patch.object(config, "config_folder", conftest.temp_folder),
+    ):
+        swarm.swarm("Terrain", "bucket", "jpeg", from_bundles=True)
+
+    assert [upload_call[0][0] for upload_call in bucket.blob.call_args_list] == [
+        "Terrain/5/4/10",
+        "Terrain/5/5/10",
+    ]
+    bucket.blob.return_value.upload_from_string.assert_called_with(
+        tile, content_type="image/jpeg", retry=ANY
+    )
+    assert exists(bundle_path)
+
+
+def test_is_retryable_error():
+    assert swarm._is_retryable_error(InvalidResponse(Mock(status_code=503)))
+    assert swarm._is_retryable_error(InvalidResponse(Mock(status_code=429)))
+    assert not swarm._is_retryable_error(InvalidResponse(Mock(status_code=404)))
+    assert swarm._is_retryable_error(ServiceUnavailable("busy"))
+    assert not swarm._is_retryable_error(NotFound("missing"))
+
+
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_delete_blobs_batches_deletes(client_mock):
+    bucket = Mock()
+    blob_names = [f"Terrain/5/{column}/10" for column in range(250)]
+
+    assert swarm.delete_blobs(bucket, blob_names) == blob_names
+    assert client_mock.return_value.batch.call_count == 3
+    assert bucket.delete_blob.call_count == 250
+
+
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_delete_blobs_checks_each_blob_of_failed_batches(client_mock):
+    client_mock.return_value.batch.return_value.__exit__.side_effect = [
+        ServiceUnavailable("unavailable"),
+        None,
+    ]
+    bucket = Mock()
+    #: the batch, then a, already gone and unavailable on their own and then the second batch
+    bucket.delete_blob.side_effect = [
+        None,
+        None,
+        None,
+        None,
+        NotFound("already gone"),
+        ServiceUnavailable("unavailable"),
+        None,
+    ]
+
+    with patch.object(swarm, "DELETE_BATCH_SIZE", 3):
+        assert swarm.delete_blobs(bucket, ["a", "b", "c", "d"]) == ["a", "b", "d"]
+
+
+def test_delete_blobs_with_missing_blobs():
+    with fake_gcs.FakeStorageServer() as server:
+        client = config.create_storage_client(server.endpoint)
+        bucket = client.bucket("bucket")
+        for name in ["a", "b"]:
+            bucket.blob(name).upload_from_string(b"tile")
+
+        with patch("honeycomb.swarm.config.get_storage_client", return_value=client):
+            assert swarm.delete_blobs(bucket, ["a", "missing", "b"]) == [
+                "a",
+                "missing",
+                "b",
+            ]
+
+        assert server.get_objects("bucket") == {}
+
+
+@patch("honeycomb.swarm.delete_blobs", side_effect=lambda bucket, names: names)
+def test_delete_orphans_respects_threshold(delete_blobs_mock):
+    bucket = Mock()
+    bucket.name = "bucket"
+    manifest.record_tiles(
+        "bucket",
+        [("Terrain/5/4/10", "abc==", 10, 1), ("Terrain/5/4/11", "abc==", 10, 1)],
+    )
+
+    assert swarm._delete_orphans(bucket, "5", {"Terrain/5/4/10"}, 2) == 0
+    delete_blobs_mock.assert_not_called()
+
+    assert swarm._delete_orphans(bucket, "5", {"Terrain/5/4/10"}, 20) == 1
+    delete_blobs_mock.assert_called_once_with(bucket, ["Terrain/5/4/10"])
+    assert manifest.get_tiles("bucket", "Terrain/5/") == {"Terrain/5/4/11": "abc=="}
+
+
+@patch("honeycomb.swarm.send_email")
+@patch("honeycomb.swarm.bust_discover_cache")
+@patch("honeycomb.swarm._delete_orphans", return_value=1)
+@patch("honeycomb.swarm._get_known_tiles")
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_swarm_deletes_orphans(
+    client_mock, known_tiles_mock, delete_orphans_mock, bust_mock, email_mock
+):
+    copy_exploded_levels("Terrain", ["L05"])
+    known_tiles_mock.return_value = {
+        "Terrain/5/4/10": "abc==",
+        "Terrain/5/99/99": "abc==",
+    }
+
+    with (
+        patch.object(settings, "CACHES_DIR", conftest.temp_folder),
+        patch.object(config, "config_folder", conftest.temp_folder),
+        patch.object(
+            swarm, "_format_cache_job_summary", wraps=swarm._format_cache_job_summary
+        ) as summary_mock,
+    ):
+        swarm.swarm("Terrain", "bucket", "jpeg", delete_orphans=True)
+
+    known_tiles_mock.assert_called_once_with("bucket", "Terrain", "5", True)
+    assert delete_orphans_mock.call_args[0][1:] == ("5", {"Terrain/5/99/99"}, 2)
+    assert summary_mock.call_args[0][2][0][2]["deleted"] == 1
+    assert (
+        Path(conftest.temp_folder) / "Terrain_Exploded" / swarm.CONSUMED_MARKER
+    ).exists()
+
+
+@patch("honeycomb.swarm.send_email")
+@patch("honeycomb.swarm.bust_discover_cache")
+@patch("honeycomb.swarm._delete_orphans", return_value=1)
+@patch("honeycomb.swarm._get_known_tiles")
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_swarm_does_not_delete_orphans_from_a_consumed_exploded_cache(
+    client_mock, known_tiles_mock, delete_orphans_mock, bust_mock, email_mock
+):
+    copy_exploded_levels("Terrain", ["L05"])
+    #: an earlier upload crashed after uploading (and removing) Terrain/5/99/99
+    known_tiles_mock.return_value = {
+        "Terrain/5/4/10": "abc==",
+        "Terrain/5/99/99": "abc==",
+    }
+
+    with (
+        patch.object(settings, "CACHES_DIR", conftest.temp_folder),
+        patch.object(config, "config_folder", conftest.temp_folder),
+    ):
+        swarm.mark_exploded_cache_consumed("Terrain")
+        swarm.swarm("Terrain", "bucket", "jpeg", delete_orphans=True)
+
+    delete_orphans_mock.assert_not_called()
+
+
+def test_is_exploded_cache_consumed():
+    (Path(conftest.temp_folder) / "Terrain_Exploded").mkdir(parents=True)
+
+    with patch.object(settings, "CACHES_DIR", conftest.temp_folder):
+        assert not swarm.is_exploded_cache_consumed("Terrain")
+        assert not swarm.is_exploded_cache_consumed("Terrain", (1, 2))
+
+        swarm.mark_exploded_cache_consumed("Terrain", (2, 2))
+
+        #: shards only remove their own tiles
+        assert not swarm.is_exploded_cache_consumed("Terrain", (1, 2))
+        assert swarm.is_exploded_cache_consumed("Terrain", (2, 2))
+        assert swarm.is_exploded_cache_consumed("Terrain")
+
+
+@patch("honeycomb.swarm.send_email")
+@patch("honeycomb.swarm.bust_discover_cache")
+@patch("honeycomb.swarm.collect_old_versions")
+@patch("honeycomb.swarm.publish_version")
+@patch("honeycomb.swarm.new_version", return_value="20240101000000")
+@patch("honeycomb.swarm._get_known_tiles")
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_swarm_publishes_versions(
+    client_mock,
+    known_tiles_mock,
+    version_mock,
+    publish_mock,
+    collect_mock,
+    bust_mock,
+    email_mock,
+):
+    copy_exploded_levels("Terrain", ["L05"])
+    bucket = client_mock.return_value.bucket.return_value
+
+    with (
+        patch.object(settings, "CACHES_DIR", conftest.temp_folder),
+        patch.object(config, "config_folder", conftest.temp_folder),
+    ):
+        swarm.swarm("Terrain", "bucket", "jpeg", publish_versions=True)
+
+    known_tiles_mock.assert_not_called()
+    assert bucket.blob.call_args_list[0][0][0].startswith(
+        "Terrain/versions/20240101000000/5/"
+    )
+    assert bucket.blob.return_value.upload_from_string.call_count == 16
+    assert manifest.get_tiles("bucket", "Terrain/") == {}
+    publish_mock.assert_called_once_with(bucket, "Terrain", "20240101000000")
+    collect_mock.assert_called_once_with(bucket, "Terrain", "20240101000000")
+    bust_mock.assert_called_once()
+
+
+@patch("honeycomb.swarm.send_email")
+@patch("honeycomb.swarm.bust_discover_cache")
+@patch("honeycomb.swarm.publish_version")
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_swarm_does_not_publish_incomplete_versions(
+    client_mock, publish_mock, bust_mock, email_mock
+):
+    copy_exploded_levels("Terrain", ["L05"])
+    bucket = client_mock.return_value.bucket.return_value
+    bucket.blob.return_value.upload_from_string.side_effect = Exception("boom")
+
+    with (
+        patch.object(settings, "CACHES_DIR", conftest.temp_folder),
+        patch.object(config, "config_folder", conftest.temp_folder),
+        patch.object(swarm, "RETRY_BACKOFF_SECONDS", 0),
+    ):
+        swarm.swarm("Terrain", "bucket", "jpeg", publish_versions=True)
+
+    publish_mock.assert_not_called()
+    bust_mock.assert_not_called()
+    assert "was not published" in email_mock.call_args[0][1]
+
+
+@patch("honeycomb.swarm.delete_blobs", side_effect=lambda bucket, names: names)
+@patch("honeycomb.swarm.manifest.list_bucket")
+@patch("honeycomb.swarm.get_versions")
+def test_collect_old_versions(versions_mock, list_mock, delete_blobs_mock):
+    bucket = Mock()
+    bucket.name = "bucket"
+    versions_mock.return_value = ["1", "2", "3", "4", "5"]
+    blob = Mock()
+    blob.name = "tile"
+    list_mock.return_value.pages = [[blob]]
+
+    swarm.collect_old_versions(bucket, "Terrain", "4")
+
+    #: 3 is kept for rolling back and 5 may still be uploading
+    assert [call[0][1] for call in list_mock.call_args_list] == [
+        "Terrain/versions/1/",
+        "Terrain/versions/2/",
+    ]
+    assert delete_blobs_mock.call_count == 2
+
+
+def test_spread_tiles_shuffles_within_window():
+    tiles = list(range(100))
+
+    spread = list(swarm.spread_tiles(tiles, window=10, seed=1))
+
+    assert sorted(spread) == tiles
+    assert spread != tiles
+    #: a tile can't be yielded before the window has reached it
+    assert all(tile < index + 10 for index, tile in enumerate(spread))
+
+
+@patch("honeycomb.swarm.send_email")
+@patch("honeycomb.swarm.bust_discover_cache")
+@patch("honeycomb.swarm._get_known_tiles", return_value={})
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_swarm_uploads_in_spread_order(
+    client_mock, known_tiles_mock, bust_mock, email_mock
+):
+    base_folder = copy_exploded_levels("Terrain", ["L05"])
+    bucket = client_mock.return_value.bucket.return_value
+
+    with (
+        patch.object(settings, "CACHES_DIR", conftest.temp_folder),
+        patch.object(config, "config_folder", conftest.temp_folder),
+    ):
+        swarm.swarm("Terrain", "bucket", "jpeg", upload_order="spread")
+
+    assert bucket.blob.return_value.upload_from_string.call_count == 16
+    assert list((base_folder / "L05").iterdir()) == []
+
+
+@patch("honeycomb.swarm.send_email")
+@patch("honeycomb.swarm.bust_discover_cache")
+@patch("honeycomb.swarm.transfer_manager.upload_many")
+@patch("honeycomb.swarm._get_known_tiles")
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_swarm_uploads_with_transfer_manager(
+    client_mock, known_tiles_mock, upload_many_mock, bust_mock, email_mock
+):
+    base_folder = copy_exploded_levels("Terrain", ["L05"])
+    known_tiles_mock.return_value = {
+        "Terrain/5/4/10": get_checksum(
+            base_folder / "L05" / "R0000000a" / "C00000004.jpg"
+        )
+    }
+    upload_many_mock.side_effect = lambda pairs, **kwargs: (
+        [None] * (len(pairs) - 1) + [Exception("boom")]
+    )
+
+    with (
+        patch.object(settings, "CACHES_DIR", conftest.temp_folder),
+        patch.object(config, "config_folder", conftest.temp_folder),
+        patch.object(swarm, "RETRY_ATTEMPTS", 0),
+        patch.object(
+            swarm, "_format_cache_job_summary", wraps=swarm._format_cache_job_summary
+        ) as summary_mock,
+    ):
+        swarm.swarm("Terrain", "bucket", "jpeg", upload_engine="transfer-manager")
+        [failed_tile] = FailedTileJournal(
+            swarm.get_journal_path("Terrain", "bucket")
+        ).read()
+
+    [(level, rows, summary)] = summary_mock.call_args[0][2]
+    assert (level, rows) == ("5", 4)
+    assert summary["skipped_same_crc"] == 1
+    assert summary["created"] == 14
+    assert summary["errors"] == 1
+    [pairs] = upload_many_mock.call_args[0]
+    assert len(pairs) == 15
+    assert upload_many_mock.call_args[1]["upload_kwargs"] == {
+        "content_type": "image/jpeg"
+    }
+    #: only the tile that failed is left
+    assert len(list((base_folder / "L05").glob("*/*.jpg"))) == 1
+    assert len(manifest.get_tiles("bucket", "Terrain/")) == 14
+    assert failed_tile["stage"] == "upload"
+    assert failed_tile["error"] == "Exception"
+
+
+def test_parse_shard():
+    assert swarm.parse_shard("2/4") == (2, 4)
+
+    for value in ["0/4", "5/4", "2", "a/b"]:
+        with raises(ValueError):
+            swarm.parse_shard(value)
+
+
+def test_shards_are_disjoint_and_complete():
+    rows = [("5", str(row)) for row in range(100)]
+
+    shards = [
+        {row for row in rows if swarm.in_shard(*row, (index, 3))}
+        for index in range(1, 4)
+    ]
+
+    assert sum(len(shard) for shard in shards) == len(rows)
+    assert set.union(*shards) == set(rows)
+
+
+@patch("honeycomb.swarm.send_email")
+@patch("honeycomb.swarm.bust_discover_cache")
+@patch("honeycomb.swarm.stats.record_upload_throughput")
+@patch("honeycomb.swarm._get_known_tiles", return_value={})
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_sharded_swarm_and_merge(
+    client_mock, known_tiles_mock, throughput_mock, bust_mock, email_mock
+):
+    copy_exploded_levels("Terrain", ["L05", "L06"])
+    bucket = client_mock.return_value.bucket.return_value
+
+    with (
+        patch.object(settings, "CACHES_DIR", conftest.temp_folder),
+        patch.object(config, "config_folder", conftest.temp_folder),
+    ):
+        swarm.swarm("Terrain", "bucket", "jpeg", shard=(1, 2))
+
+        bust_mock.assert_not_called()
+        throughput_mock.assert_not_called()
+        with raises(ValueError, match="2/2"):
+            swarm.merge_shards("Terrain", "bucket")
+
+        swarm.swarm("Terrain", "bucket", "jpeg", shard=(2, 2))
+        level_summaries = swarm.merge_shards("Terrain", "bucket")
+
+    assert bucket.blob.return_value.upload_from_string.call_count == 52
+    assert [(level, rows) for level, rows, _ in level_summaries] == [("5", 4), ("6", 6)]
+    assert level_summaries[0][2]["created"] == 16
+    assert level_summaries[1][2]["created"] == 36
+    bust_mock.assert_called_once()
+    assert list((Path(conftest.temp_folder) / "_upload_shards").iterdir()) == []
+
+
+def test_orphan_candidates_belong_to_the_shard():
+    known_tiles = {f"Terrain/5/1/{row}": "abc==" for row in range(20)}
+
+    candidates = swarm._get_orphan_candidates(known_tiles, (1, 2))
+
+    assert candidates == {
+        name for name in known_tiles if swarm.in_shard("5", name.split("/")[-1], (1, 2))
+    }
+    assert swarm._get_orphan_candidates(known_tiles) == set(known_tiles)
+
+
+def test_read_levels_filters_bundle_tiles_by_shard():
+    level_folder = Path(conftest.temp_folder) / "L05"
+    conftest.write_bundle(
+        str(level_folder / "R0000C0000.bundle"),
+        {(row, 4): b"tile" for row in range(10)},
+    )
+    shard = (1, 2)
+
+    [(_, _, tiles)] = swarm.read_levels([level_folder], True, shard=shard)
+
+    rows = [tile.row for tile in tiles]
+    assert rows == [
+        str(row) for row in range(10) if swarm.in_shard("5", str(row), shard)
+    ]
+    assert 0 < len(rows) < 10
+
+
+def test_upload_tile_skips_blank_tiles():
+    bucket = Mock()
+    tile_file = Path(conftest.temp_folder) / "C00000004.png"
+    tile_file.parent.mkdir(parents=True, exist_ok=True)
+    tile_file.write_bytes(b"blank")
+    tile = swarm.Tile("5", "10", "4", tile_file)
+
+    action, uploaded_tile = swarm.upload_tile(
+        bucket,
+        "Terrain",
+        False,
+        {"Terrain/5/4/10": "abc=="},
+        tile,
+        (b"blank", "image/png", "abc==", False, {}, True, 5),
+        None,
+    )
+
+    assert action == "blank"
+    assert uploaded_tile is None
+    bucket.blob.return_value.upload_from_string.assert_not_called()
+    assert not tile_file.exists()
+
+
+@patch("honeycomb.swarm.send_email")
+@patch("honeycomb.swarm.bust_discover_cache")
+@patch("honeycomb.swarm.delete_blobs", side_effect=lambda bucket, names: names)
+@patch("honeycomb.swarm._get_known_tiles")
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_swarm_skips_blank_tiles(
+    client_mock, known_tiles_mock, delete_blobs_mock, bust_mock, email_mock
+):
+    base_folder = copy_exploded_levels("Terrain", ["L05"])
+    Image.new("RGBA", (256, 256), (0, 0, 0, 0)).save(
+        base_folder / "L05" / "R0000000a" / "C00000099.png", "PNG"
+    )
+    Image.new("RGBA", (256, 256), (0, 0, 0, 0)).save(
+        base_folder / "L05" / "R0000000a" / "C0000009a.png", "PNG"
+    )
+    known_tiles_mock.return_value = {"Terrain/5/153/10": "abc=="}
+    bucket = client_mock.return_value.bucket.return_value
+    bucket.name = "bucket"
+    bucket.blob.return_value.size = 100
+    bucket.blob.return_value.generation = 1
+
+    with (
+        patch.object(settings, "CACHES_DIR", conftest.temp_folder),
+        patch.object(config, "config_folder", conftest.temp_folder),
+        patch.object(
+            swarm, "_format_cache_job_summary", wraps=swarm._format_cache_job_summary
+        ) as summary_mock,
+    ):
+        swarm.swarm("Terrain", "bucket", "jpeg", skip_blank_tiles=True)
+
+    [(_, _, summary)] = summary_mock.call_args[0][2]
+    assert summary["blank"] == 2
+    assert summary["blank_bytes"] > 0
+    assert summary["created"] == 16
+    assert summary["deleted"] == 1
+    delete_blobs_mock.assert_called_once_with(bucket, ["Terrain/5/153/10"])
+    assert bucket.blob.return_value.upload_from_string.call_count == 16
+
+
+@patch("honeycomb.swarm.send_email")
+@patch("honeycomb.swarm.bust_discover_cache")
+@patch("honeycomb.swarm._get_known_tiles", return_value={})
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_swarm_reuses_conversions_of_identical_tiles(
+    client_mock, known_tiles_mock, bust_mock, email_mock
+):
+    row_folder = (
+        Path(conftest.temp_folder)
+        / "Terrain_Exploded"
+        / "_alllayers"
+        / "L05"
+        / "R0000000a"
+    )
+    row_folder.mkdir(parents=True)
+    for column in range(4):
+        Image.new("RGB", (256, 256), (0, 0, 255)).save(
+            row_folder / f"C0000000{column}.png", "PNG"
+        )
+    Image.new("RGB", (256, 256), (0, 255, 0)).save(row_folder / "C00000004.png", "PNG")
+    source_bytes = sum(tile.stat().st_size for tile in row_folder.iterdir())
+    bucket = client_mock.return_value.bucket.return_value
+
+    with (
+        patch.object(settings, "CACHES_DIR", conftest.temp_folder),
+        patch.object(config, "config_folder", conftest.temp_folder),
+        patch.object(config, "conversion_processes", 1),
+        patch.object(
+            swarm, "_format_upload_summary", wraps=swarm._format_upload_summary
+        ) as summary_mock,
+    ):
+        swarm.swarm("Terrain", "bucket", "jpeg")
+
+    context = summary_mock.call_args[0][1]
+    assert context["conversion_cache_hit_rate"] == 0.6
+    assert context["conversion_seconds_saved"] >= 0
+    uploads = bucket.blob.return_value.upload_from_string.call_args_list
+    assert context["bytes_before_encoding"] == source_bytes
+    assert context["bytes_after_encoding"] == sum(
+        len(upload[0][0]) for upload in uploads
+    )
+    assert len(uploads) == 5
+    assert all(upload[1]["content_type"] == "image/jpeg" for upload in uploads)
+    assert len({upload[0][0] for upload in uploads}) == 2
+
+
+@patch("honeycomb.swarm.send_email")
+@patch("honeycomb.swarm.bust_discover_cache")
+@patch("honeycomb.swarm._get_known_tiles", return_value={})
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_swarm_retries_failed_tiles(
+    client_mock, known_tiles_mock, bust_mock, email_mock
+):
+    base_folder = copy_exploded_levels("Terrain", ["L05"])
+    upload_mock = client_mock.return_value.bucket.return_value.blob.return_value.upload_from_string
+    failures = iter([Exception("first"), Exception("second")])
+
+    def upload(data, **kwargs):
+        #: the first two uploads fail once
+        error = next(failures, None)
+        if error is not None:
+            raise error
+
+    upload_mock.side_effect = upload
+
+    with (
+        patch.object(settings, "CACHES_DIR", conftest.temp_folder),
+        patch.object(config, "config_folder", conftest.temp_folder),
+        patch.object(swarm, "RETRY_BACKOFF_SECONDS", 0),
+        patch.object(
+            swarm, "_format_cache_job_summary", wraps=swarm._format_cache_job_summary
+        ) as summary_mock,
+    ):
+        swarm.swarm("Terrain", "bucket", "jpeg")
+        journal = FailedTileJournal(swarm.get_journal_path("Terrain", "bucket"))
+
+    [(_, _, summary)] = summary_mock.call_args[0][2]
+    assert summary["first_pass_errors"] == 2
+    assert summary["errors"] == 0
+    assert summary["created"] == 16
+    assert upload_mock.call_count == 18
+    assert list((base_folder / "L05").iterdir()) == []
+    assert journal.read() == []
+    bust_mock.assert_called_once()
+
+
+@patch("honeycomb.swarm.send_email")
+@patch("honeycomb.swarm.bust_discover_cache")
+@patch("honeycomb.swarm._get_known_tiles", return_value={})
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_swarm_retry_failed_only_uploads_the_journal(
+    client_mock, known_tiles_mock, bust_mock, email_mock
+):
+    base_folder = copy_exploded_levels("Terrain", ["L05", "L06"])
+    file_path = base_folder / "L05" / "R0000000a" / "C00000004.jpg"
+    upload_mock = client_mock.return_value.bucket.return_value.blob.return_value.upload_from_string
+
+    with (
+        patch.object(settings, "CACHES_DIR", conftest.temp_folder),
+        patch.object(config, "config_folder", conftest.temp_folder),
+    ):
+        journal = FailedTileJournal(swarm.get_journal_path("Terrain", "bucket"))
+        journal.record(
+            "Terrain",
+            swarm.Tile("5", "10", "4", file_path),
+            "upload",
+            TimeoutError("slow"),
+        )
+
+        swarm.swarm("Terrain", "bucket", "jpeg", retry_failed=True)
+
+        assert journal.read() == []
+
+    upload_mock.assert_called_once()
+    client_mock.return_value.bucket.return_value.blob.assert_called_with(
+        "Terrain/5/4/10"
+    )
+    assert not file_path.exists()
+    #: the rest of the cache was not walked
+    assert len(list((base_folder / "L06").glob("*/*.jpg"))) > 0
+
+
+def test_read_journal_levels_rereads_bundle_tiles():
+    bundle_path = Path(conftest.temp_folder) / "L05" / "R0000C0000.bundle"
+    conftest.write_bundle(str(bundle_path), {(10, 4): b"a", (10, 5): b"b"})
+    failed_tiles = [
+        {
+            "level": "5",
+            "row": "10",
+            "column": "5",
+            "file_path": str(bundle_path),
+            "from_bundle": True,
+        },
+        {
+            "level": "6",
+            "row": "1",
+            "column": "1",
+            "file_path": str(bundle_path.parent / "missing.png"),
+            "from_bundle": False,
+        },
+    ]
+
+    assert list(swarm.read_journal_levels(failed_tiles)) == [
+        ("5", [], [swarm.Tile("5", "10", "5", bundle_path, b"b")])
+    ]
+
+
+def test_merge_retry_summaries():
+    summary = {
+        **swarm._empty_upload_summary(),
+        "created": 10,
+        "errors": 3,
+        "first_pass_errors": 3,
+    }
+    retry_summary = {**swarm._empty_upload_summary(), "created": 2, "errors": 1}
+
+    [(_, _, merged)] = swarm._merge_retry_summaries(
+        [("5", 4, summary)], [("5", 2, retry_summary)]
+    )
+
+    assert merged["created"] == 12
+    assert merged["errors"] == 1
+    assert merged["first_pass_errors"] == 3
+
+
+@patch("honeycomb.swarm.send_email")
+@patch("honeycomb.swarm.bust_discover_cache")
+@patch("honeycomb.swarm._get_known_tiles", return_value={})
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_swarm_resumes_from_checkpoint(
+    client_mock, known_tiles_mock, bust_mock, email_mock
+):
+    base_folder = copy_exploded_levels("Terrain", ["L05", "L06"])
+    bucket = client_mock.return_value.bucket.return_value
+    job_path = Path(conftest.temp_folder) / "current_job.json"
+
+    with (
+        patch.object(settings, "CACHES_DIR", conftest.temp_folder),
+        patch.object(config, "config_folder", conftest.temp_folder),
+        patch.object(resumable, "file_path", job_path),
+        patch.object(
+            swarm, "_format_cache_job_summary", wraps=swarm._format_cache_job_summary
+        ) as summary_mock,
+    ):
+        resumable.start_new_job("Terrain", False, False, False, None, None)
+        #: level 6 and the first row of level 5 were uploaded before the job was interrupted
+        resumable.update_job(
+            "upload_progress",
+            {
+                "basemap": "Terrain",
+                "bucket": "bucket",
+                "prefix": "Terrain",
+                "completed_levels": ["6"],
+                "completed_rows": ["5/10"],
+                "level_summaries": [
+                    ["5", 1, {**swarm._empty_upload_summary(), "created": 4}],
+                    ["6", 2, {**swarm._empty_upload_summary(), "created": 9}],
+                ],
+            },
+        )
+
+        swarm.swarm("Terrain", "bucket", "jpeg", checkpoint=True)
+
+        assert resumable.get_current_job()["upload_progress"] is None
+
+    assert bucket.blob.return_value.upload_from_string.call_count == 12
+    #: the completed level and row were not walked
+    assert len(list((base_folder / "L06").glob("*/*.jpg"))) > 0
+    assert len(list((base_folder / "L05" / "R0000000a").iterdir())) == 4
+    [(_, rows_5, summary_5), (_, rows_6, summary_6)] = summary_mock.call_args[0][2]
+    assert (rows_5, summary_5["created"]) == (4, 16)
+    assert (rows_6, summary_6["created"]) == (2, 9)
+
+
+@patch("honeycomb.swarm.send_email")
+@patch("honeycomb.swarm.bust_discover_cache")
+@patch("honeycomb.swarm._get_known_tiles", return_value={})
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_swarm_checkpoints_bundle_uploads_without_partial_summaries(
+    client_mock, known_tiles_mock, bust_mock, email_mock
+):
+    tile = (
+        Path(conftest.test_data_folder)
+        / "JPG_Service"
+        / "Layers"
+        / "_alllayers"
+        / "L05"
+        / "R0000000a"
+        / "C00000004.jpg"
+    ).read_bytes()
+    conftest.write_bundle(
+        join(
+            conftest.temp_folder,
+            "Terrain",
+            "Terrain",
+            "_alllayers",
+            "L05",
+            "R0000C0000.bundle",
+        ),
+        {(10, 4): tile, (10, 5): tile, (11, 4): tile},
+    )
+    bucket = client_mock.return_value.bucket.return_value
+    bucket.blob.return_value.size = 100
+    bucket.blob.return_value.generation = 1
+    saved_progress = []
+    update_job = resumable.update_job
+
+    def record_progress(prop, value):
+        if prop == "upload_progress" and value is not None:
+            saved_progress.append(json.loads(json.dumps(value)))
+        update_job(prop, value)
+
+    with (
+        patch.object(settings, "CACHES_DIR", conftest.temp_folder),
+        patch.object(config, "config_folder", conftest.temp_folder),
+        patch.object(
+            resumable, "file_path", Path(conftest.temp_folder) / "current_job.json"
+        ),
+        patch.object(resumable, "update_job", side_effect=record_progress),
+        #: record the manifest after every tile
+        patch.object(swarm, "CHECKPOINT_SECONDS", -1),
+        patch.object(
+            swarm, "_record_manifest", wraps=swarm._record_manifest
+        ) as record_mock,
+    ):
+        resumable.start_new_job("Terrain", False, False, False, None, None)
+        swarm.swarm("Terrain", "bucket", "jpeg", from_bundles=True, checkpoint=True)
+
+    #: bundle rows are never complete so nothing is recorded for the level until it is done
+    assert all(
+        progress["level_summaries"] == []
+        for progress in saved_progress
+        if progress["completed_levels"] == []
+    )
+    [(_, rows, summary)] = saved_progress[-1]["level_summaries"]
+    assert saved_progress[-1]["completed_levels"] == ["5"]
+    assert (rows, summary["created"]) == (2, 3)
+    #: the tiles are in the manifest before the level is done in case the upload is interrupted
+    assert record_mock.call_count > 1
+    assert len(manifest.get_tiles("bucket", "Terrain/5/")) == 3
+
+
+@patch("honeycomb.swarm.send_email")
+@patch("honeycomb.swarm.bust_discover_cache")
+@patch("honeycomb.swarm._get_known_tiles", return_value={})
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_swarm_checkpoints_completed_rows(
+    client_mock, known_tiles_mock, bust_mock, email_mock
+):
+    copy_exploded_levels("Terrain", ["L05"])
+    completed_rows = []
+
+    with (
+        patch.object(settings, "CACHES_DIR", conftest.temp_folder),
+        patch.object(config, "config_folder", conftest.temp_folder),
+        patch.object(
+            resumable, "file_path", Path(conftest.temp_folder) / "current_job.json"
+        ),
+        patch.object(
+            resumable.UploadCheckpoint,
+            "complete_row",
+            lambda self, level, row, summary: completed_rows.append((level, row)),
+        ),
+    ):
+        resumable.start_new_job("Terrain", False, False, False, None, None)
+        swarm.swarm("Terrain", "bucket", "jpeg", checkpoint=True)
+
+    #: the last row is completed with the level
+    assert sorted(completed_rows) == [("5", "10"), ("5", "11"), ("5", "12")]
+
+
+@patch("honeycomb.swarm.send_email")
+@patch("honeycomb.swarm.bust_discover_cache")
+@patch("honeycomb.swarm._get_known_tiles", return_value={})
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_swarm_only_uploads_spot_tiles(
+    client_mock, known_tiles_mock, bust_mock, email_mock
+):
+    base_folder = copy_exploded_levels("Terrain", ["L05", "L06"])
+    spot_tiles = aoi.SpotTiles()
+    spot_tiles.add_range(5, 10, 5, 6)
+    spot_tiles.add_range(5, 11, 7, 9)
+    bucket = client_mock.return_value.bucket.return_value
+
+    with (
+        patch.object(settings, "CACHES_DIR", conftest.temp_folder),
+        patch.object(config, "config_folder", conftest.temp_folder),
+    ):
+        swarm.swarm(
+            "Terrain", "bucket", "jpeg", delete_orphans=True, spot_tiles=spot_tiles
+        )
+
+    blob_names = sorted(call[0][0] for call in bucket.blob.call_args_list)
+    assert blob_names == ["Terrain/5/5/10", "Terrain/5/6/10", "Terrain/5/7/11"]
+    #: level 6 is not in the spot so it is not walked
+    assert len(list((base_folder / "L06").glob("*/*.jpg"))) > 0
+    assert len(list((base_folder / "L05").glob("*/*.jpg"))) == 13
+
+
+def test_read_levels_skips_bundles_outside_of_the_spot():
+    level_folder = Path(conftest.temp_folder) / "L05"
+    conftest.write_bundle(str(level_folder / "R0000C0000.bundle"), {(10, 4): b"a"})
+    conftest.write_bundle(str(level_folder / "R0000C0080.bundle"), {(10, 4): b"b"})
+    spot_tiles = aoi.SpotTiles()
+    spot_tiles.add_range(5, 10, 0, 10)
+
+    with patch.object(
+        swarm.bundles, "read_bundle", wraps=swarm.bundles.read_bundle
+    ) as read_mock:
+        [(_, _, tiles)] = swarm.read_levels([level_folder], True, spot_tiles=spot_tiles)
+        tiles = list(tiles)
+
+    assert tiles == [
+        swarm.Tile("5", "10", "4", level_folder / "R0000C0000.bundle", b"a")
+    ]
+    read_mock.assert_called_once()
+    assert read_mock.call_args[0][0] == level_folder / "R0000C0000.bundle"
+
+
+@patch("honeycomb.swarm.send_email")
+@patch("honeycomb.swarm.bust_discover_cache")
+@patch("honeycomb.swarm._get_known_tiles", return_value={})
+@patch("honeycomb.swarm.collect_old_versions")
+@patch("honeycomb.swarm.publish_version")
+@patch("honeycomb.swarm.config.get_storage_client")
+def test_swarm_does_not_publish_a_version_of_a_spot_cache(
+    client_mock, publish_mock, collect_mock, known_tiles_mock, bust_mock, email_mock
+):
+    copy_exploded_levels("Terrain", ["L05"])
+    spot_tiles = aoi.SpotTiles()
+    spot_tiles.add_range(5, 10, 5, 6)
+    bucket = client_mock.return_value.bucket.return_value
+
+    with (
+        patch.object(settings, "CACHES_DIR", conftest.temp_folder),
+        patch.object(config, "config_folder", conftest.temp_folder),
+    ):
+        swarm.swarm(
+            "Terrain", "bucket", "jpeg", publish_versions=True, spot_tiles=spot_tiles
+        )
+
+    blob_names = sorted(call[0][0] for call in bucket.blob.call_args_list)
+    assert blob_names == ["Terrain/5/5/10", "Terrain/5/6/10"]
+    publish_mock.assert_not_called()
+    collect_mock.assert_not_called()
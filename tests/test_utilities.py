@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+test_utilities.py
+
+A module that contains tests for utilities.py
+"""
+
+import os
+from pathlib import Path
+
+import pytest
+from mock import MagicMock, patch
+
+from honeycomb import settings, utilities
+
+from . import conftest
+
+
+@pytest.fixture
+def project():
+    temp_folder = Path(conftest.temp_folder)
+    temp_folder.mkdir(parents=True)
+    source = temp_folder / "Maps.aprx"
+    source.write_bytes(b"project")
+    mp = MagicMock()
+
+    with (
+        patch.object(settings, "PRO_PROJECT", source),
+        patch.object(settings, "CACHES_DIR", temp_folder),
+        patch.object(utilities.arcpy, "mp", mp, create=True),
+    ):
+        yield source, mp
+
+
+def test_get_map_copies_the_project_once(project):
+    _, mp = project
+    pro_maps = utilities.ProMapCache()
+
+    first = pro_maps.get("Terrain")
+    second = pro_maps.get("Terrain")
+
+    assert first is second
+    assert mp.ArcGISProject.call_count == 1
+    assert (Path(conftest.temp_folder) / "TempProjects" / "Maps_Terrain.aprx").exists()
+    assert pro_maps.hits == 1
+    assert pro_maps.misses == 1
+    assert pro_maps.last_seconds_saved > 0
+    assert pro_maps.seconds_saved == pro_maps.last_seconds_saved
+
+
+@patch("honeycomb.utilities.copy", wraps=utilities.copy)
+def test_get_map_reopens_released_maps_without_copying(copy_mock, project):
+    _, mp = project
+    pro_maps = utilities.ProMapCache()
+
+    pro_maps.get("Terrain")
+    pro_maps.get("Lite")
+    pro_maps.release()
+    pro_maps.get("Terrain")
+
+    assert copy_mock.call_count == 2
+    assert mp.ArcGISProject.call_count == 3
+    assert pro_maps.misses == 3
+
+
+@patch("honeycomb.utilities.copy", wraps=utilities.copy)
+def test_get_map_copies_a_modified_project(copy_mock, project):
+    source, _ = project
+    pro_maps = utilities.ProMapCache()
+
+    pro_maps.get("Terrain")
+    stat = source.stat()
+    os.utime(source, (stat.st_atime, stat.st_mtime + 10))
+    pro_maps.get("Terrain")
+
+    assert copy_mock.call_count == 2
+    assert pro_maps.hits == 0
+
+
+def test_remove_copies(project):
+    pro_maps = utilities.ProMapCache("_1")
+    pro_maps.get("Terrain")
+    copy_path = Path(conftest.temp_folder) / "TempProjects" / "Maps_Terrain_1.aprx"
+    assert copy_path.exists()
+
+    pro_maps.remove_copies()
+
+    assert not copy_path.exists()
+    #: the next get makes a new copy
+    pro_maps.get("Terrain")
+    assert copy_path.exists()
+    assert pro_maps.misses == 2
+
+
+def test_get_map_raises_for_missing_maps(project):
+    _, mp = project
+    mp.ArcGISProject.return_value.listMaps.return_value = []
+
+    with pytest.raises(Exception, match="Map 'Terrain' not found in project."):
+        utilities.ProMapCache().get("Terrain")
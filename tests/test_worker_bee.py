@@ -6,6 +6,7 @@ test_worker_bee.py
 A module that contains tests for the cache module.
 """
 
+from honeycomb.history import EtaModel, PlannedAoi
 from honeycomb.worker_bee import WorkerBee, intersect_scales, parse_levels
 from mock import Mock, call, patch
 
@@ -32,22 +33,19 @@ def test_cache_extent(update_mock, host_mock, count_mock, input_mock):
 def test_spot_cache_recaches_errors_before_exploding():
     manager = Mock()
 
-    with patch("honeycomb.worker_bee.config.get_basemap") as get_basemap, patch(
-        "honeycomb.worker_bee.config.is_dev", return_value=True
-    ), patch("honeycomb.worker_bee.utilities.validate_map_layers"), patch(
-        "honeycomb.worker_bee.update_job"
-    ), patch(
-        "honeycomb.worker_bee.WorkerBee.delete_cache"
-    ), patch(
-        "honeycomb.worker_bee.WorkerBee.get_bundles_count", return_value=0
-    ), patch(
-        "honeycomb.worker_bee.WorkerBee.cache_extent"
-    ) as cache_extent, patch(
-        "honeycomb.worker_bee.WorkerBee.recache_errors"
-    ) as recache_errors, patch(
-        "honeycomb.worker_bee.explode_cache"
-    ) as explode_cache, patch(
-        "honeycomb.worker_bee.arcpy.analysis.Intersect", return_value="intersected"
+    with (
+        patch("honeycomb.worker_bee.config.get_basemap") as get_basemap,
+        patch("honeycomb.worker_bee.config.is_dev", return_value=True),
+        patch("honeycomb.worker_bee.utilities.validate_map_layers"),
+        patch("honeycomb.worker_bee.update_job"),
+        patch("honeycomb.worker_bee.WorkerBee.delete_cache"),
+        patch("honeycomb.worker_bee.WorkerBee.get_bundles_count", return_value=0),
+        patch("honeycomb.worker_bee.WorkerBee.cache_extent") as cache_extent,
+        patch("honeycomb.worker_bee.WorkerBee.recache_errors") as recache_errors,
+        patch("honeycomb.worker_bee.explode_cache") as explode_cache,
+        patch(
+            "honeycomb.worker_bee.arcpy.analysis.Intersect", return_value="intersected"
+        ),
     ):
         get_basemap.return_value = {"imageType": "jpeg"}
         manager.attach_mock(recache_errors, "recache_errors")
@@ -58,7 +56,7 @@ def test_spot_cache_recaches_errors_before_exploding():
     assert cache_extent.call_count == 2
     assert manager.mock_calls == [
         call.recache_errors(),
-        call.explode_cache("Terrain"),
+        call.explode_cache("Terrain", "blah"),
     ]
 
 
@@ -99,3 +97,51 @@ def test_parse_levels():
 
 def test_intersect_scales():
     assert intersect_scales([1, 2, 4], [1, 2, 3]) == [1, 2]
+
+
+def test_get_progress_estimates_each_level_from_the_history():
+    bee = WorkerBee.__new__(WorkerBee)
+    bee.start_bundles = 0
+    bee.start_time = 0
+    bee.complete_num_bundles = 100
+    bee.overall_progress_bar = Mock()
+    bee.overall_progress_bar_current_value = 0
+    bee.get_bundles_count = Mock(return_value=50)
+    bee.eta = EtaModel(
+        Mock(
+            get_durations=Mock(return_value={("a", (18,)): 3600, ("b", (19,)): 1800}),
+            get_level_rates=Mock(return_value={}),
+        )
+    )
+    bee.pending = {
+        "a-[1]": PlannedAoi("a", "a-[1]", (18,), 1),
+        "b-[1]": PlannedAoi("b", "b-[1]", (19,), 1),
+    }
+
+    assert bee.get_progress() == (
+        "50 of 100 (50%) bundle files created.\nEstimated hours remaining: 1.5\n"
+        "Level 18: 1 areas of interest left, 1.0 hours\nLevel 19: 1 areas of interest left, 0.5 hours"
+    )
+
+
+@patch("honeycomb.worker_bee.get_aoi_bundles", return_value=frozenset([(18, 0, 0)]))
+@patch("honeycomb.worker_bee.get_job_status", return_value=[])
+@patch("honeycomb.worker_bee.settings.CACHE_EXTENTS", [])
+def test_plan_aois_sorts_the_longest_areas_first(status_mock, bundles_mock):
+    bee = WorkerBee.__new__(WorkerBee)
+    bee.restrict_scales = [1]
+    bee.cache_processes = 1
+    bee.eta = EtaModel(
+        Mock(
+            get_durations=Mock(return_value={("a", (18,)): 60, ("b", (18,)): 3600}),
+            get_level_rates=Mock(return_value={}),
+        )
+    )
+    grid_aois = [("a", Mock()), ("unknown", Mock()), ("b", Mock())]
+
+    with patch("honeycomb.worker_bee.settings.SCALES", [0] * 18 + [1]):
+        bee.plan_aois([("grid", 1)], [grid_aois])
+
+    #: the serial path caches the areas of interest in this order as well as the process pool
+    assert [name for name, _ in grid_aois] == ["b", "a", "unknown"]
+    assert list(bee.pending) == ["a-[1]", "unknown-[1]", "b-[1]"]